@@ -5,7 +5,7 @@ import secrets
 from datetime import datetime
 from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Query
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
@@ -13,6 +13,12 @@ from pydantic import BaseModel, validator
 
 from db import async_session
 from models import SiteSettings
+from lobby_writer import lobby_writer
+import storage
+from game_cache import game_cache
+from redis_client import redis_client
+from ops import ops_snapshot, recount_games, migrate_legacy_keys, scan_keys, read_key, INSPECT_DEFAULT_COUNT
+import bulk_games
 
 from main import templates
 
@@ -111,3 +117,64 @@ async def post_settings(payload: SettingsPayload):
         await session.refresh(settings)
 
     return {"success": True}
+
+@router.get("/lobby_writer")
+async def lobby_writer_stats(username: str = Depends(get_current_admin)):
+    """Queue depth and flush latency of this worker's lobby write-behind queue."""
+    return lobby_writer.stats()
+
+@router.get("/storage")
+async def storage_stats(username: str = Depends(get_current_admin)):
+    """Redis commands, round trips and bytes per logical operation on this worker."""
+    return {
+        "ops": storage.stats(),
+        "game_cache": {"hits": game_cache.hits, "misses": game_cache.misses, "entries": len(game_cache.entries)}
+    }
+
+@router.get("/ops")
+async def ops_panel(username: str = Depends(get_current_admin)):
+    """Live numbers for the dashboard, read from counters and worker reports."""
+    return ops_snapshot(redis_client)
+
+@router.post("/ops/recount")
+async def ops_recount(username: str = Depends(get_current_admin)):
+    """Rebuild the active game counter with a full SCAN (e.g. after a manual flush)."""
+    return {"active_games": recount_games(redis_client)}
+
+@router.post("/ops/migrate-keys")
+async def ops_migrate_keys(username: str = Depends(get_current_admin)):
+    """Rename per-game keys from before hash tags; once, before switching to Redis Cluster."""
+    return {"renamed": migrate_legacy_keys(redis_client)}
+
+@router.get("/redis")
+async def inspect_redis(
+    prefix: str = "",
+    cursor: str = "0",
+    count: int = Query(INSPECT_DEFAULT_COUNT, ge=1),
+    username: str = Depends(get_current_admin),
+):
+    """One SCAN page of keys under `prefix`; pass back `cursor` until it is "0"."""
+    try:
+        return scan_keys(redis_client, prefix, cursor, count)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@router.get("/redis/key")
+async def inspect_redis_key(key: str, username: str = Depends(get_current_admin)):
+    entry = read_key(redis_client, key)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Key not found")
+    return entry
+
+@router.post("/games/bulk")
+async def bulk_create_games(request: Request, username: str = Depends(get_current_admin)):
+    """
+    Create up to BULK_MAX_GAMES games with shared settings for a tournament
+    round or simul. Returns every game ID with its pre-assigned players.
+    """
+    data = await request.json()
+    try:
+        games = await bulk_games.create_games(data)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid bulk game settings")
+    return {"games": games}
@@ -0,0 +1,194 @@
+import json
+import time
+import uuid
+
+import storage
+from fastapi import HTTPException
+from game_state import GameState, Stone
+from geometry import is_valid_size
+from game_helper import place_handicap_stones, rank_to_number, VALID_TIME_CONTROLS, VALID_RULE_SETS
+from game_cache import save_game
+from redis_client import redis_client
+from storage import players_key
+from ops import count_games_created
+from timers import schedule_join_timeout
+
+# Widest rank difference that will still be paired (the handicap cap)
+AUTOMATCH_MAX_RANK_GAP = 9
+# Waiting players poll; one who stops for this long is dropped from the pool
+AUTOMATCH_STALE_SECS = 30
+# How long a match result stays readable by the waiting player
+AUTOMATCH_RESULT_TTL_SECS = 300
+
+# Per bucket: KEYS[1] ranks (score = rank number), KEYS[2] last poll time.
+# Drops stale waiters, then claims the nearest rank within the gap on
+# either side, or queues the caller. One call, O(log n), no WATCH retries.
+CLAIM_SCRIPT = """
+local stale = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[5], 'LIMIT', 0, 100)
+if #stale > 0 then
+    redis.call('ZREM', KEYS[1], unpack(stale))
+    redis.call('ZREM', KEYS[2], unpack(stale))
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+
+local rank = tonumber(ARGV[2])
+local gap = tonumber(ARGV[3])
+local above = redis.call('ZRANGEBYSCORE', KEYS[1], rank, rank + gap, 'WITHSCORES', 'LIMIT', 0, 1)
+local below = redis.call('ZREVRANGEBYSCORE', KEYS[1], rank, rank - gap, 'WITHSCORES', 'LIMIT', 0, 1)
+
+local best = nil
+local best_rank = nil
+if #above > 0 then
+    best, best_rank = above[1], tonumber(above[2])
+end
+if #below > 0 and (best == nil or rank - tonumber(below[2]) < best_rank - rank) then
+    best, best_rank = below[1], tonumber(below[2])
+end
+
+if best then
+    redis.call('ZREM', KEYS[1], best)
+    redis.call('ZREM', KEYS[2], best)
+    return {best, tostring(best_rank)}
+end
+
+redis.call('ZADD', KEYS[1], rank, ARGV[1])
+redis.call('ZADD', KEYS[2], ARGV[4], ARGV[1])
+return false
+"""
+
+
+def bucket_name(board_size: int, time_control: str, rule_set: str) -> str:
+    return f"{board_size}:{time_control}:{rule_set}"
+
+
+# A bucket's two sets share the {bucket} hash tag so CLAIM_SCRIPT stays on one cluster slot
+def pool_key(bucket: str) -> str:
+    return f"automatch:pool:{{{bucket}}}"
+
+
+def heartbeat_key(bucket: str) -> str:
+    return f"automatch:seen:{{{bucket}}}"
+
+
+def ticket_key(player_id: str) -> str:
+    return f"automatch:ticket:{player_id}"
+
+
+def result_key(player_id: str) -> str:
+    return f"automatch:result:{player_id}"
+
+
+def create_matched_game(board_size: int, time_control: str, rule_set: str,
+                        players: dict) -> str:
+    """
+    Build the game with both players already seated, weaker player Black
+    with handicap stones, and store it together with both match results.
+    `players` maps player_id -> rank number.
+    """
+    (first, first_rank), (second, second_rank) = players.items()
+    game = GameState(board_size, time_control=time_control, rule_set=rule_set)
+    game.game_type = "automatch"
+    game.set_created_by(first)
+    game.set_color_preference("random")
+
+    if first_rank == second_rank:
+        black, white = (first, second) if uuid.uuid4().int & 1 else (second, first)
+        game.set_colors_randomized(True)
+    else:
+        black, white = (first, second) if first_rank < second_rank else (second, first)
+        game.set_allow_handicaps(True)
+        game.handicap_stones = min(abs(first_rank - second_rank), AUTOMATCH_MAX_RANK_GAP, game.geometry.max_handicap)
+        place_handicap_stones(game)
+    game.players = {black: Stone.BLACK.value, white: Stone.WHITE.value}
+
+    if time_control != "none":
+        for pid in game.players:
+            game.time_left[pid] = int(time_control)
+
+    game_id = str(uuid.uuid4())[:8]
+    game.version += 1
+    # Not a transaction: the keys span several cluster slots, and nobody
+    # can see the new game before the match result is written
+    with redis_client.pipeline(transaction=False) as pipe:
+        save_game(pipe, game_id, game)
+        pipe.hset(players_key(game_id), mapping=game.players)
+        # Same join timeout as any created game, in case neither player shows up
+        schedule_join_timeout(game_id, pipe, timeout_seconds=600)
+        count_games_created(pipe)
+        for pid in game.players:
+            pipe.set(result_key(pid), game_id, ex=AUTOMATCH_RESULT_TTL_SECS)
+            pipe.delete(ticket_key(pid))
+        storage.execute(pipe, "automatch_create")
+    return game_id
+
+
+def enqueue(player_id: str, board_size: int, time_control: str, rule_set: str, estimated_rank: str) -> dict:
+    """Claim the closest-ranked compatible waiter, or join the pool."""
+    if not is_valid_size(board_size):
+        raise HTTPException(status_code=400, detail="Invalid board size")
+    if time_control not in VALID_TIME_CONTROLS:
+        raise HTTPException(status_code=400, detail="Invalid time control setting")
+    if rule_set not in VALID_RULE_SETS:
+        raise HTTPException(status_code=400, detail="Invalid rule set")
+    rank = rank_to_number(estimated_rank)
+    if rank is None:
+        raise HTTPException(status_code=400, detail="Invalid rank provided")
+
+    bucket = bucket_name(board_size, time_control, rule_set)
+    now = time.time()
+    redis_client.delete(result_key(player_id))
+
+    claim = redis_client.register_script(CLAIM_SCRIPT)
+    claimed = claim(
+        keys=[pool_key(bucket), heartbeat_key(bucket)],
+        args=[player_id, rank, AUTOMATCH_MAX_RANK_GAP, now, now - AUTOMATCH_STALE_SECS]
+    )
+
+    if not claimed:
+        redis_client.set(
+            ticket_key(player_id),
+            json.dumps({"bucket": bucket, "rank": rank}),
+            ex=AUTOMATCH_RESULT_TTL_SECS
+        )
+        return {"status": "waiting", "player_id": player_id}
+
+    opponent, opponent_rank = claimed[0], int(float(claimed[1]))
+    game_id = create_matched_game(
+        board_size, time_control, rule_set,
+        {opponent: opponent_rank, player_id: rank}
+    )
+    print(f"Automatch paired {opponent} and {player_id} in game {game_id}")
+    return {"status": "matched", "player_id": player_id, "game_id": game_id}
+
+
+def poll(player_id: str) -> dict:
+    """Match result for a waiting player; also keeps them in the pool."""
+    game_id = redis_client.get(result_key(player_id))
+    if game_id:
+        return {"status": "matched", "player_id": player_id, "game_id": game_id}
+
+    ticket = redis_client.get(ticket_key(player_id))
+    if not ticket:
+        return {"status": "expired", "player_id": player_id}
+
+    bucket = json.loads(ticket)["bucket"]
+    # XX: only refresh players still waiting, never re-add a claimed one
+    if not redis_client.zadd(heartbeat_key(bucket), {player_id: time.time()}, xx=True, ch=True):
+        game_id = redis_client.get(result_key(player_id))
+        if game_id:
+            return {"status": "matched", "player_id": player_id, "game_id": game_id}
+        return {"status": "expired", "player_id": player_id}
+    return {"status": "waiting", "player_id": player_id}
+
+
+def cancel(player_id: str):
+    ticket = redis_client.get(ticket_key(player_id))
+    if not ticket:
+        return
+    bucket = json.loads(ticket)["bucket"]
+    with redis_client.pipeline(transaction=False) as pipe:
+        pipe.zrem(pool_key(bucket), player_id)
+        pipe.zrem(heartbeat_key(bucket), player_id)
+        pipe.delete(ticket_key(player_id))
+        storage.execute(pipe, "automatch_cancel")
@@ -0,0 +1,262 @@
+import asyncio
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from game_state import GameState, Stone
+from geometry import geometry
+
+# Strength is the number of playouts searched per move; the time budget
+# caps how long a single move may take whatever the playout count
+BOT_DEFAULT_PLAYOUTS = 1000
+BOT_MIN_PLAYOUTS = 50
+BOT_MAX_PLAYOUTS = 20000
+BOT_DEFAULT_TIME_BUDGET_SECS = 5.0
+BOT_MAX_TIME_BUDGET_SECS = 30.0
+
+# Searches run in separate processes so a thinking bot never blocks the event loop
+BOT_POOL_WORKERS = int(os.getenv("BOT_POOL_WORKERS", 2))
+
+UCT_EXPLORATION = 1.4
+PASS = -1
+
+EMPTY = Stone.EMPTY.value
+BLACK = Stone.BLACK.value
+WHITE = Stone.WHITE.value
+
+class FastBoard:
+    """
+    Minimal board for playouts: same 1D layout and stone values as
+    GameState.board_state, with simple ko and no move history.
+    """
+
+    __slots__ = ("size", "points", "neighbors", "ko_point")
+
+    def __init__(self, size: int, board_state, ko_point=None):
+        self.size = size
+        self.points = bytearray(board_state)
+        self.neighbors = geometry(size).neighbors
+        self.ko_point = ko_point
+
+    def copy(self):
+        return FastBoard(self.size, self.points, self.ko_point)
+
+    def group(self, index: int):
+        """Stones connected to `index` and their number of liberties."""
+        points = self.points
+        neighbors = self.neighbors
+        color = points[index]
+        stones = [index]
+        seen = {index}
+        liberties = set()
+        for stone in stones:
+            for n in neighbors[stone]:
+                value = points[n]
+                if value == EMPTY:
+                    liberties.add(n)
+                elif value == color and n not in seen:
+                    seen.add(n)
+                    stones.append(n)
+        return stones, len(liberties)
+
+    def is_eye(self, index: int, color: int) -> bool:
+        return all(self.points[n] == color for n in self.neighbors[index])
+
+    def is_legal(self, index: int, color: int) -> bool:
+        if self.points[index] != EMPTY or index == self.ko_point:
+            return False
+        for n in self.neighbors[index]:
+            value = self.points[n]
+            if value == EMPTY:
+                return True
+            _, liberties = self.group(n)
+            if value == color and liberties > 1:
+                return True
+            if value != color and liberties == 1:
+                return True  # captures
+        return False  # suicide
+
+    def play(self, index: int, color: int):
+        """Place a stone assumed legal, removing captures and updating ko."""
+        points = self.points
+        points[index] = color
+        captured = []
+        for n in self.neighbors[index]:
+            if points[n] == 3 - color:
+                stones, liberties = self.group(n)
+                if liberties == 0:
+                    for stone in stones:
+                        points[stone] = EMPTY
+                    captured.extend(stones)
+
+        self.ko_point = None
+        if len(captured) == 1 and not any(points[n] == color for n in self.neighbors[index]):
+            if self.group(index)[1] == 1:
+                self.ko_point = captured[0]
+
+    def candidate_moves(self, color: int) -> list:
+        return [
+            i for i in range(len(self.points))
+            if self.points[i] == EMPTY and not self.is_eye(i, color) and self.is_legal(i, color)
+        ]
+
+    def area_score(self) -> int:
+        """Black minus white: stones plus empty points bordered by one colour only."""
+        score = 0
+        points = self.points
+        for i, value in enumerate(points):
+            if value == BLACK:
+                score += 1
+            elif value == WHITE:
+                score -= 1
+            else:
+                around = {points[n] for n in self.neighbors[i]}
+                if around == {BLACK}:
+                    score += 1
+                elif around == {WHITE}:
+                    score -= 1
+        return score
+
+
+def _playout(board: FastBoard, color: int, rng: random.Random):
+    """Random moves that never fill own eyes, until both sides pass."""
+    passes = 0
+    for _ in range(3 * len(board.points)):
+        empties = [i for i, value in enumerate(board.points) if value == EMPTY]
+        rng.shuffle(empties)
+        for index in empties:
+            if not board.is_eye(index, color) and board.is_legal(index, color):
+                board.play(index, color)
+                passes = 0
+                break
+        else:
+            board.ko_point = None
+            passes += 1
+            if passes == 2:
+                return
+        color = 3 - color
+
+
+class _Node:
+    __slots__ = ("move", "parent", "color", "children", "untried", "wins", "visits")
+
+    def __init__(self, move, parent, color, untried):
+        self.move = move
+        self.parent = parent
+        self.color = color  # colour that played `move`
+        self.children = []
+        self.untried = untried
+        self.wins = 0
+        self.visits = 0
+
+    def select_child(self):
+        log_visits = math.log(self.visits)
+        return max(
+            self.children,
+            key=lambda c: c.wins / c.visits + UCT_EXPLORATION * math.sqrt(log_visits / c.visits)
+        )
+
+
+def choose_move(board_state: list, board_size: int, color: int, ko_point, komi: float,
+                playouts: int, time_budget: float, seed=None) -> int:
+    """
+    UCT search from the given position for `color`. Runs in a pool process,
+    so it only takes and returns plain values. Returns a board index or PASS.
+    """
+    rng = random.Random(seed)
+    root_board = FastBoard(board_size, board_state, ko_point)
+    root = _Node(None, None, 3 - color, root_board.candidate_moves(color))
+    if not root.untried:
+        return PASS
+
+    deadline = time.monotonic() + time_budget
+    for _ in range(playouts):
+        if time.monotonic() > deadline:
+            break
+
+        node = root
+        board = root_board.copy()
+
+        # Selection
+        while not node.untried and node.children:
+            node = node.select_child()
+            board.play(node.move, node.color)
+
+        # Expansion
+        if node.untried:
+            move = node.untried.pop(rng.randrange(len(node.untried)))
+            to_move = 3 - node.color
+            board.play(move, to_move)
+            child = _Node(move, node, to_move, board.candidate_moves(3 - to_move))
+            node.children.append(child)
+            node = child
+
+        # Simulation
+        _playout(board, 3 - node.color, rng)
+        black_wins = board.area_score() - komi > 0
+
+        # Backpropagation
+        while node is not None:
+            node.visits += 1
+            if (node.color == BLACK) == black_wins:
+                node.wins += 1
+            node = node.parent
+
+    return max(root.children, key=lambda c: c.visits).move
+
+
+_pool = None
+
+
+def bot_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=BOT_POOL_WORKERS)
+    return _pool
+
+
+def shutdown_bot_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def new_bot(playouts: int = BOT_DEFAULT_PLAYOUTS, time_budget: float = BOT_DEFAULT_TIME_BUDGET_SECS) -> dict:
+    """Settings stored on GameState.bot for a game against the built-in bot."""
+    return {
+        "player_id": "bot-" + os.urandom(3).hex(),
+        "playouts": playouts,
+        "time_budget": time_budget
+    }
+
+
+def is_bot_turn(game: GameState) -> bool:
+    if not game.bot or game.game_over or len(game.players) < 2:
+        return False
+    return game.players.get(game.bot["player_id"]) == game.current_turn.value
+
+
+async def pick_bot_move(game: GameState) -> int:
+    """Search off the event loop; answers a pass with a pass when already ahead."""
+    color = game.players[game.bot["player_id"]]
+
+    if game.consecutive_passes == 1:
+        margin = FastBoard(game.board_size, game.board_state).area_score() - game.komi
+        if (margin > 0) == (color == BLACK):
+            return PASS
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        bot_pool(),
+        choose_move,
+        list(game.board_state),
+        game.board_size,
+        color,
+        game.ko_point,
+        game.komi,
+        game.bot["playouts"],
+        game.bot["time_budget"]
+    )
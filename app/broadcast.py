@@ -0,0 +1,157 @@
+import asyncio
+import json
+import os
+import time
+
+from redis_client import redis_client, SHARDED_PUBSUB
+from game_cache import game_cache
+from storage import updates_channel, game_id_from_key
+from wire_format import encode_game_state_message
+
+# Upper bound on game_state snapshots per second sent to each spectator.
+# Players always receive every update; 0 disables the throttle.
+SPECTATOR_SNAPSHOTS_PER_SEC = float(os.getenv("SPECTATOR_SNAPSHOTS_PER_SEC", 4))
+
+# How often the worker's single pub/sub connection is drained when idle
+POLL_INTERVAL_SECS = 0.05
+
+TYPE_PREFIX = '{"type": "'
+
+# Plain and sharded (SPUBLISH) deliveries
+DATA_MESSAGE_TYPES = {"message", "smessage"}
+
+# Published after the stored game document changed
+STATE_CHANGING_TYPES = {"game_state", "dead_stones", "score_finalized", "takeback"}
+
+
+def message_type(raw: str) -> str | None:
+    """
+    Read the "type" field of a published message without decoding it.
+    Every publisher writes json.dumps({"type": ..., ...}), so the type is
+    always the leading key; anything else falls back to a full parse.
+    """
+    if raw.startswith(TYPE_PREFIX):
+        end = raw.find('"', len(TYPE_PREFIX))
+        if end != -1:
+            return raw[len(TYPE_PREFIX):end]
+    try:
+        return json.loads(raw).get("type")
+    except (ValueError, AttributeError):
+        return None
+
+
+class GameBroadcaster:
+    """
+    One pub/sub connection per worker, shared by every local socket.
+    Each published payload is forwarded as the exact string it arrived as,
+    so a game with hundreds of local spectators is never re-parsed or
+    re-encoded per socket.
+    """
+
+    def __init__(self, redis_client, spectator_rate: float = SPECTATOR_SNAPSHOTS_PER_SEC,
+                 sharded: bool = SHARDED_PUBSUB):
+        self.redis_client = redis_client
+        self.pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        self.sharded = sharded
+        if sharded:
+            # A cluster pub/sub holds one connection per shard and reads them
+            # through get_sharded_message; a single node delivers "smessage"s
+            # on the plain connection
+            self.read_message = getattr(self.pubsub, "get_sharded_message", self.pubsub.get_message)
+            self.listen, self.unlisten = self.pubsub.ssubscribe, self.pubsub.sunsubscribe
+        else:
+            self.read_message = self.pubsub.get_message
+            self.listen, self.unlisten = self.pubsub.subscribe, self.pubsub.unsubscribe
+        self.spectator_interval = 1.0 / spectator_rate if spectator_rate > 0 else 0
+        self.players = {}     # game_id -> set of SocketSender
+        self.spectators = {}  # game_id -> set of SocketSender
+        self.pending_snapshot = {}   # game_id -> newest game_state held back from spectators
+        self.last_snapshot_at = {}   # game_id -> monotonic time of last spectator snapshot
+        self.task = None
+
+    def subscribe(self, game_id: str, sender):
+        if game_id not in self.players and game_id not in self.spectators:
+            self.listen(updates_channel(game_id))
+            game_cache.watch(game_id)
+        group = self.spectators if sender.is_spectator else self.players
+        group.setdefault(game_id, set()).add(sender)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    def unsubscribe(self, game_id: str, sender):
+        for group in (self.players, self.spectators):
+            senders = group.get(game_id)
+            if senders is not None:
+                senders.discard(sender)
+                if not senders:
+                    del group[game_id]
+        if game_id not in self.players and game_id not in self.spectators:
+            self.pending_snapshot.pop(game_id, None)
+            self.last_snapshot_at.pop(game_id, None)
+            game_cache.unwatch(game_id)
+            try:
+                self.unlisten(updates_channel(game_id))
+            except Exception as err:
+                print("Broadcast unsubscribe error:", err)
+
+    @staticmethod
+    def deliver(senders, raw: str, kind: str | None):
+        """Enqueue to every sender, packing game_state at most once for binary clients."""
+        packed = None
+        for sender in senders:
+            if sender.binary and kind == "game_state":
+                if packed is None:
+                    packed = encode_game_state_message(raw)
+                sender.enqueue(packed, kind)
+            else:
+                sender.enqueue(raw, kind)
+
+    def dispatch(self, game_id: str, raw: str):
+        kind = message_type(raw)
+        if kind in STATE_CHANGING_TYPES:
+            game_cache.notify(game_id)
+
+        self.deliver(self.players.get(game_id, ()), raw, kind)
+
+        spectators = self.spectators.get(game_id)
+        if not spectators:
+            return
+        if kind == "game_state" and self.spectator_interval:
+            # Hold the snapshot; flush_snapshots sends the newest one on schedule
+            self.pending_snapshot[game_id] = raw
+            return
+        # Deltas (e.g. takebacks) apply on top of the latest snapshot, so
+        # release any held one first to keep ordering intact
+        held = self.pending_snapshot.pop(game_id, None)
+        if held is not None:
+            self.last_snapshot_at[game_id] = time.monotonic()
+            self.deliver(spectators, held, "game_state")
+        self.deliver(spectators, raw, kind)
+
+    def flush_snapshots(self):
+        if not self.pending_snapshot:
+            return
+        now = time.monotonic()
+        for game_id in list(self.pending_snapshot):
+            if now - self.last_snapshot_at.get(game_id, 0) < self.spectator_interval:
+                continue
+            raw = self.pending_snapshot.pop(game_id)
+            self.last_snapshot_at[game_id] = now
+            self.deliver(self.spectators.get(game_id, ()), raw, "game_state")
+
+    async def run(self):
+        while self.players or self.spectators:
+            try:
+                msg = self.read_message()
+                while msg:
+                    if msg["type"] in DATA_MESSAGE_TYPES:
+                        self.dispatch(game_id_from_key(msg["channel"]), msg["data"])
+                    msg = self.read_message()
+                self.flush_snapshots()
+            except Exception as err:
+                print("Broadcast listener error:", err)
+                await asyncio.sleep(1)
+            await asyncio.sleep(POLL_INTERVAL_SECS)
+
+
+broadcaster = GameBroadcaster(redis_client)
@@ -0,0 +1,147 @@
+import time
+import uuid
+
+from fastapi import HTTPException
+from sqlalchemy.dialects.postgresql import insert
+
+import storage
+from db import async_session
+from deadlines import JOIN_TIMEOUT, schedule_deadlines
+from game_cache import save_game
+from game_helper import validate_game_settings
+from game_state import GameState, Stone
+from models import PublicGame
+from ops import count_games_created
+from redis_client import redis_client
+from storage import players_key
+
+# Largest event created by one request
+BULK_MAX_GAMES = 200
+# Seated games nobody has connected to by then are abandoned (see handle_join_timeout)
+BULK_DEFAULT_JOIN_TIMEOUT_SECS = 3600
+BULK_MAX_JOIN_TIMEOUT_SECS = 86400
+
+
+def parse_pairings(data: dict) -> list:
+    """
+    (black, white) per game. Explicit `pairings` entries may name either
+    player or leave a seat open with null; a bare `count` pre-assigns fresh
+    IDs to both seats of every game.
+    """
+    pairings = data.get("pairings")
+    if pairings is None:
+        count = int(data.get("count", 0))
+        if not 1 <= count <= BULK_MAX_GAMES:
+            raise HTTPException(status_code=400, detail=f"count must be between 1 and {BULK_MAX_GAMES}")
+        return [(new_player_id(), new_player_id()) for _ in range(count)]
+
+    if not isinstance(pairings, list) or not 1 <= len(pairings) <= BULK_MAX_GAMES:
+        raise HTTPException(status_code=400, detail=f"pairings must list 1 to {BULK_MAX_GAMES} games")
+    result = []
+    for pairing in pairings:
+        black, white = pairing.get("black"), pairing.get("white")
+        if black is not None and black == white:
+            raise HTTPException(status_code=400, detail="A player cannot play both colours in one game")
+        result.append((black, white))
+    return result
+
+
+def new_player_id() -> str:
+    return str(uuid.uuid4())[:8]
+
+
+def build_game(settings: dict, black: str | None, white: str | None) -> GameState:
+    game = GameState(
+        settings["board_size"],
+        time_control=settings["time_control"],
+        komi=settings["komi"],
+        rule_set=settings["rule_set"]
+    )
+    game.game_type = "tournament"
+    game.set_created_by(settings["created_by"])
+    game.set_allow_handicaps(False)
+    game.byo_yomi_periods = settings["byo_yomi_periods"]
+    game.byo_yomi_time = settings["byo_yomi_time"]
+
+    if black is not None:
+        game.players[black] = Stone.BLACK.value
+    if white is not None:
+        game.players[white] = Stone.WHITE.value
+
+    # seat_player seats a newcomer opposite whoever is already there
+    if black is None and white is None:
+        game.set_color_preference(settings["color_preference"])
+    else:
+        game.set_color_preference("black" if black is not None else "white")
+    game.set_colors_randomized(False)
+
+    if game.time_control != "none" and len(game.players) == 2:
+        for pid in game.players:
+            game.time_left[pid] = int(game.time_control)
+    game.version += 1
+    return game
+
+
+async def create_games(data: dict) -> list:
+    """
+    Create every game of an event in one Redis pipeline: documents, player
+    hashes, the active game counter and a single ZADD of join deadlines.
+    Public games with an open seat get their lobby rows in one INSERT.
+    """
+    settings = {
+        "board_size": int(data.get("board_size", 19)),
+        "time_control": data.get("time_control", "none"),
+        "komi": float(data.get("komi", 6.5)),
+        "rule_set": data.get("rule_set", "japanese"),
+        "color_preference": data.get("color_preference", "random"),
+        "byo_yomi_periods": int(data.get("byo_yomi_periods", 0)),
+        "byo_yomi_time": int(data.get("byo_yomi_time", 0)),
+        "created_by": data.get("organizer", "organizer")
+    }
+    validate_game_settings(
+        settings["board_size"], settings["rule_set"], settings["time_control"], settings["komi"],
+        settings["color_preference"], settings["byo_yomi_periods"], settings["byo_yomi_time"]
+    )
+    public = bool(data.get("public", False))
+    join_timeout = int(data.get("join_timeout_secs", BULK_DEFAULT_JOIN_TIMEOUT_SECS))
+    if not 60 <= join_timeout <= BULK_MAX_JOIN_TIMEOUT_SECS:
+        raise HTTPException(status_code=400, detail="Invalid join timeout")
+
+    pairings = parse_pairings(data)
+    created = []
+    lobby_rows = []
+    with redis_client.pipeline(transaction=False) as pipe:
+        for black, white in pairings:
+            game_id = str(uuid.uuid4())[:8]
+            game = build_game(settings, black, white)
+            # Not cached: an event should not evict this worker's live games
+            save_game(pipe, game_id, game, cache=False)
+            if game.players:
+                pipe.hset(players_key(game_id), mapping=game.players)
+            created.append({"game_id": game_id, "black": black, "white": white})
+
+            if public and len(game.players) < 2:
+                lobby_rows.append({
+                    "id": game_id,
+                    "board_size": settings["board_size"],
+                    "created_by": settings["created_by"],
+                    "rule_set": settings["rule_set"],
+                    "komi": settings["komi"],
+                    "time_control": settings["time_control"],
+                    "byo_yomi_periods": settings["byo_yomi_periods"],
+                    "byo_yomi_time": settings["byo_yomi_time"],
+                    "color_preference": game.color_preference,
+                    "allow_handicaps": False
+                })
+
+        count_games_created(pipe, len(created))
+        schedule_deadlines(pipe, JOIN_TIMEOUT, [g["game_id"] for g in created], time.time() + join_timeout)
+        storage.execute(pipe, "bulk_create")
+
+    if lobby_rows:
+        async with async_session() as session:
+            await session.execute(insert(PublicGame).values(lobby_rows))
+            await session.commit()
+
+    print(f"Bulk created {len(created)} games ({len(lobby_rows)} listed publicly)")
+    return created
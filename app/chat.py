@@ -0,0 +1,252 @@
+import json
+import time
+
+import storage
+from better_profanity.utils import get_complete_path_of_file, read_wordlist
+from storage import chat_key, publish_update
+
+# Messages kept per game for players and spectators who join late
+CHAT_HISTORY_LEN = 50
+# Longest message accepted; anything beyond is trimmed
+CHAT_MAX_LENGTH = 500
+
+# Token bucket defaults: a burst of 5 messages, refilled at one per second
+CHAT_RATE_PER_SEC = 1.0
+CHAT_BURST = 5
+
+# Characters each letter of a listed word may be written as, the
+# substitutions better_profanity expands per word. Only the listed word's
+# own letters vary: "1" may stand for "l", but "i" in a message never does.
+CHAR_VARIANTS = {
+    "a": ("@", "*", "4"),
+    "i": ("*", "l", "1"),
+    "o": ("*", "0", "@"),
+    "u": ("*", "v"),
+    "v": ("*", "u"),
+    "l": ("1",),
+    "e": ("*", "3"),
+    "s": ("$", "5"),
+    "t": ("7",),
+}
+
+WORD_PUNCTUATION = {"@", "$", "*", "'", '"'}
+# What may separate the words of a multi-word list entry ("blow job",
+# "hand-job", "f.u.c.k"). Entries with other punctuation ("sh!+") spell
+# letters with it, which the variants above cannot express, and splitting
+# them would list fragments like "sh"; they are left out.
+ENTRY_SEPARATORS = {" ", "-", "_", "."}
+
+
+def _fold_table(variants: dict) -> dict:
+    """
+    Map every character in `variants` onto one representative of all the
+    characters it is interchangeable with, directly or through others. The
+    automaton runs over folded text, so it finds every candidate at the
+    price of some false ones, which are checked per word afterwards.
+    """
+    groups = []
+    for letter, chars in variants.items():
+        group = {letter, *chars}
+        for other in [g for g in groups if g & group]:
+            group |= other
+            groups.remove(other)
+        groups.append(group)
+    return {char: min(group) for group in groups for char in group}
+
+
+FOLDED_CHARS = _fold_table(CHAR_VARIANTS)
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char in WORD_PUNCTUATION
+
+
+def _spelled_as(word: str, text: str) -> bool:
+    """Whether lowercased `text` spells the listed `word`, letter by letter."""
+    return all(t == w or t in CHAR_VARIANTS.get(w, ()) for w, t in zip(word, text))
+
+
+class ProfanityMatcher:
+    """
+    Aho-Corasick automaton over the folded word list.
+    Built once; censoring a message is a single linear pass over it, plus a
+    per-letter check of each candidate.
+    """
+
+    def __init__(self, words):
+        self.goto = [{}]
+        self.fail = [0]
+        self.words = [[]]  # listed words ending at this state, separators as single spaces
+
+        for word in words:
+            if any(not _is_word_char(char) and char not in ENTRY_SEPARATORS for char in word):
+                continue
+            word = self._normalize(word.lower())[0].strip()
+            self._add_word(word)
+            if " " in word:
+                # Like better_profanity, a multi-word entry also matches
+                # with its separators left out ("blowjob" for "blow job")
+                self._add_word(word.replace(" ", ""))
+        self._build_failure_links()
+
+    @classmethod
+    def from_default_wordlist(cls):
+        return cls(read_wordlist(get_complete_path_of_file("profanity_wordlist.txt")))
+
+    @staticmethod
+    def _normalize(text: str):
+        """
+        Lowercase text and collapse separator runs to one space. Returns the
+        normalised string and, for each of its characters, the index of the
+        originating character in `text`.
+        """
+        chars = []
+        positions = []
+        for i, char in enumerate(text):
+            if _is_word_char(char):
+                chars.append(char.lower())
+                positions.append(i)
+            elif chars and chars[-1] != " ":
+                chars.append(" ")
+                positions.append(i)
+        return "".join(chars), positions
+
+    @staticmethod
+    def _fold(text: str) -> str:
+        return "".join(FOLDED_CHARS.get(char, char) for char in text)
+
+    def _add_word(self, word: str):
+        if not word:
+            return
+        state = 0
+        for char in self._fold(word):
+            nxt = self.goto[state].get(char)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][char] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.words.append([])
+            state = nxt
+        if word not in self.words[state]:
+            self.words[state].append(word)
+
+    def _build_failure_links(self):
+        queue = list(self.goto[0].values())
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for char, nxt in self.goto[state].items():
+                queue.append(nxt)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[nxt] = target if target != nxt else 0
+
+    @staticmethod
+    def _token_bounds(text: str):
+        """Indices where a space-separated token starts, and where one ends."""
+        starts = {i for i, c in enumerate(text) if c != " " and (i == 0 or text[i - 1] == " ")}
+        ends = {i for i, c in enumerate(text) if c != " " and (i + 1 == len(text) or text[i + 1] == " ")}
+        return starts, ends
+
+    def _matches(self, normalized: str, positions: list):
+        """Spans in the original text of listed words that start and end on token bounds."""
+        starts, ends = self._token_bounds(normalized)
+        state = 0
+        for end, char in enumerate(self._fold(normalized)):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+
+            # Walk the suffix chain; every state with words may end one here
+            if end not in ends:
+                continue
+            probe = state
+            while probe:
+                for word in self.words[probe]:
+                    start = end - len(word) + 1
+                    if start in starts and _spelled_as(word, normalized[start:end + 1]):
+                        yield positions[start], positions[end]
+                        break
+                probe = self.fail[probe]
+
+    def censor(self, text: str, censor_char: str = "*") -> str:
+        normalized, positions = self._normalize(text)
+        if not normalized.strip():
+            return text
+
+        # Keep the longest match at each start, dropping overlaps left to right
+        spans = sorted(set(self._matches(normalized, positions)), key=lambda s: (s[0], -s[1]))
+        result = []
+        cursor = 0
+        last_end = -1
+        for start, end in spans:
+            if start <= last_end:
+                continue
+            result.append(text[cursor:start])
+            result.append(censor_char * 4)
+            cursor = end + 1
+            last_end = end
+        result.append(text[cursor:])
+        return "".join(result)
+
+
+class TokenBucket:
+    """Per-connection rate limiter: `capacity` burst, refilled at `rate` tokens/sec."""
+
+    def __init__(self, rate: float = CHAT_RATE_PER_SEC, capacity: int = CHAT_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def consume(self, tokens: float = 1.0) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True
+
+    def retry_after(self, tokens: float = 1.0) -> float:
+        return max(0.0, (tokens - self.tokens) / self.rate)
+
+
+# Built once per worker at import time
+profanity_filter = ProfanityMatcher.from_default_wordlist()
+
+
+def post_chat_message(game_id: str, sender: str, text: str, source: str, redis_client):
+    """Append to the capped per-game stream and broadcast, in one round trip."""
+    censored = profanity_filter.censor(text[:CHAT_MAX_LENGTH])
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.xadd(
+        chat_key(game_id),
+        {"sender": sender, "text": censored},
+        maxlen=CHAT_HISTORY_LEN,
+        approximate=True
+    )
+    publish_update(
+        pipe,
+        game_id,
+        json.dumps({
+            "type": "chat",
+            "sender": sender,
+            "text": censored,
+            "source": source
+        })
+    )
+    storage.execute(pipe, "chat_post")
+
+
+def get_chat_history(game_id: str, redis_client, count: int = CHAT_HISTORY_LEN) -> list:
+    """Last `count` messages, oldest first, in a single XREVRANGE."""
+    entries = redis_client.xrevrange(chat_key(game_id), count=count)
+    return [
+        {"sender": fields.get("sender"), "text": fields.get("text")}
+        for _, fields in reversed(entries)
+    ]
@@ -0,0 +1,64 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+# Timer code reads the time and sleeps through a Clock so that the same
+# code runs against the wall clock in production and against VirtualClock
+# in timer_sim, where an hour of play takes as long as the work it causes.
+
+# Event loop passes given to woken tasks before virtual time moves on
+SETTLE_ROUNDS = 3
+
+
+class Clock:
+    """The wall clock."""
+
+    def time(self) -> float:
+        return time.time()
+
+    async def sleep(self, secs: float):
+        await asyncio.sleep(secs)
+
+
+class VirtualClock(Clock):
+    """
+    A clock that only moves when advance() is called. Sleepers wake in
+    deadline order, each seeing time() equal to its own deadline, and get
+    a few event loop passes to run before time moves on.
+    """
+
+    def __init__(self, start: float | None = None):
+        self.now = time.time() if start is None else start
+        self.sleepers = []  # heap of (wake_at, seq, future)
+        self.seq = itertools.count()
+
+    def time(self) -> float:
+        return self.now
+
+    async def sleep(self, secs: float):
+        if secs <= 0:
+            await asyncio.sleep(0)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.sleepers, (self.now + secs, next(self.seq), future))
+        await future
+
+    async def advance(self, secs: float):
+        target = self.now + secs
+        while self.sleepers and self.sleepers[0][0] <= target:
+            wake_at = self.sleepers[0][0]
+            self.now = max(self.now, wake_at)
+            while self.sleepers and self.sleepers[0][0] <= wake_at:
+                _, _, future = heapq.heappop(self.sleepers)
+                if not future.done():  # cancelled sleepers are skipped
+                    future.set_result(None)
+            await self.settle()
+        self.now = target
+
+    async def settle(self, rounds: int = SETTLE_ROUNDS):
+        for _ in range(rounds):
+            await asyncio.sleep(0)
+
+
+system_clock = Clock()
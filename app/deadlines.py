@@ -0,0 +1,69 @@
+import time
+
+import storage
+
+# One sorted set shared by every worker. Members are
+# "<kind>:<game_id>" or "<kind>:<game_id>:<player_id>", scored by the
+# unix time at which the event becomes due.
+DEADLINES_KEY = "deadlines"
+
+JOIN_TIMEOUT = "join_timeout"
+DISCONNECT_FORFEIT = "disconnect_forfeit"
+POST_GAME_CLEANUP = "post_game_cleanup"
+PRESENCE_LOST = "presence_lost"
+# Backstop for a bot that has not moved in time (its owner died or the
+# search failed): wakes whichever worker now owns the game
+BOT_TURN = "bot_turn"
+
+# Read and remove due members in one step so that two workers polling
+# the queue at the same moment never both handle the same event.
+POP_DUE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #due > 0 then
+    redis.call('ZREM', KEYS[1], unpack(due))
+end
+return due
+"""
+
+
+def deadline_member(kind: str, game_id: str, player_id: str | None = None) -> str:
+    if player_id is None:
+        return f"{kind}:{game_id}"
+    return f"{kind}:{game_id}:{player_id}"
+
+
+def parse_deadline_member(member: str):
+    parts = member.split(":", 2)
+    kind, game_id = parts[0], parts[1]
+    player_id = parts[2] if len(parts) > 2 else None
+    return kind, game_id, player_id
+
+
+def schedule_deadline(redis_client, kind: str, game_id: str, due_at: float, player_id: str | None = None):
+    """Schedule (or reschedule) an event; re-adding a member moves its deadline."""
+    redis_client.zadd(DEADLINES_KEY, {deadline_member(kind, game_id, player_id): due_at})
+
+
+def schedule_deadlines(redis_client, kind: str, game_ids: list, due_at: float):
+    """Schedule the same event for many games with a single ZADD."""
+    if game_ids:
+        redis_client.zadd(DEADLINES_KEY, {deadline_member(kind, game_id): due_at for game_id in game_ids})
+
+
+def cancel_deadline(redis_client, kind: str, game_id: str, player_id: str | None = None):
+    redis_client.zrem(DEADLINES_KEY, deadline_member(kind, game_id, player_id))
+
+
+def pop_due_deadlines(redis_client, now: float | None = None, limit: int = 100) -> list:
+    """
+    Atomically pop up to `limit` events whose deadline has passed.
+    Returns a list of (kind, game_id, player_id) tuples.
+    """
+    if now is None:
+        now = time.time()
+    pop_due = redis_client.register_script(POP_DUE_SCRIPT)
+    started = time.perf_counter()
+    members = pop_due(keys=[DEADLINES_KEY], args=[now, limit])
+    storage.record("deadline_pop", bytes_in=sum(len(m) for m in members),
+                   elapsed_ms=(time.perf_counter() - started) * 1000)
+    return [parse_deadline_member(m.decode() if isinstance(m, bytes) else m) for m in members]
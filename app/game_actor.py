@@ -0,0 +1,561 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+
+from fastapi import HTTPException
+
+import storage
+from bot import is_bot_turn
+from clock import Clock, system_clock
+from deadlines import BOT_TURN, schedule_deadline
+from game_cache import game_cache, load_game, save_game, save_and_publish, publish_state, is_finished
+from game_helper import play_move, seat_player, request_takeback, resolve_takeback
+from game_state import GameState
+from ops import WORKER_ID, FINISHED_TOKEN_SUFFIX
+from redis_client import redis_client
+from replay import record_checkpoint
+from scoring import toggle_dead_stone, finalize_score
+from storage import actor_key, commands_key, applied_key, version_key, game_key, replies_key, inbox_key
+
+# Each live game has at most one owner: the worker holding its lease keeps
+# the decoded GameState and applies every routed command to it, one at a
+# time, so concurrent moves and clock ticks no longer overwrite each other.
+# Other workers append commands to the game's stream, nudge the owner
+# through its inbox and wait for the reply. The stream doubles as the
+# command log: the owner writes a snapshot of the document, with the id of
+# the last entry it reflects, every ACTOR_SNAPSHOT_COMMANDS changes or
+# ACTOR_SNAPSHOT_SECS, and a worker taking over an expired lease replays
+# the stream from there. Live clients get every change through the update
+# channel in between; readers of the stored document may trail by up to
+# one snapshot.
+
+# Lease length; owners renew it every third of that
+ACTOR_LEASE_SECS = 5
+# Longest BLPOP of the listener thread, so it notices shutdown
+ACTOR_BLOCK_SECS = 1
+# Owned games without commands or clock ticks for this long are handed back
+ACTOR_IDLE_SECS = 60
+# A command not answered within this long fails with 503 and is skipped if
+# a new owner finds it later
+COMMAND_TIMEOUT_SECS = 5
+# Stream entries kept per game, applied or not
+COMMAND_LOG_LEN = 1000
+# An owner snapshots a changed game after this many changing commands or
+# clock ticks, or this long after its previous snapshot, whichever is first.
+# Clock ticks are not logged: a crash loses at most this long of clock time.
+ACTOR_SNAPSHOT_COMMANDS = 20
+ACTOR_SNAPSHOT_SECS = 5
+# Inbox and reply list of a worker that stopped reading them disappear after this long
+INBOX_TTL_SECS = 60
+# Grace on top of the bot's time budget before the deadline worker wakes it again
+BOT_STALL_SECS = 10
+
+# KEYS[1] lease, KEYS[2] command stream, KEYS[3] applied entry id,
+# KEYS[4] version token, KEYS[5] document, all on the game's slot.
+# ARGV[1] worker id, ARGV[2] lease ms, ARGV[3] log length, ARGV[4]
+# finished token suffix, ARGV[5..] fields of a command to append, if any.
+# A missing or finished game gets {false, 'missing' | 'finished'} and no
+# keys are written; a document from before version tokens gets a version 0
+# token first.
+# Otherwise takes or renews the lease when it is free or ours, and the
+# stream and applied id follow the version token's TTL, if it has one.
+# Returns {owner, new entry id}, plus for the owner the version token, the
+# applied id and every entry after it.
+ACQUIRE_SCRIPT = """
+local token = redis.call('GET', KEYS[4])
+if not token then
+    if redis.call('EXISTS', KEYS[5]) == 0 then
+        return {false, 'missing'}
+    end
+    token = '0.legacy'
+    redis.call('SET', KEYS[4], token)
+end
+if string.sub(token, -#ARGV[4]) == ARGV[4] then
+    return {false, 'finished'}
+end
+local owner = redis.call('GET', KEYS[1])
+if not owner or owner == ARGV[1] then
+    owner = ARGV[1]
+    redis.call('SET', KEYS[1], owner, 'PX', ARGV[2])
+end
+local id = false
+if #ARGV > 4 then
+    id = redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[3], '*', unpack(ARGV, 5))
+end
+local ttl = redis.call('PTTL', KEYS[4])
+if ttl > 0 then
+    redis.call('PEXPIRE', KEYS[2], ttl)
+    redis.call('PEXPIRE', KEYS[3], ttl)
+end
+if owner ~= ARGV[1] then
+    return {owner, id}
+end
+local applied = redis.call('GET', KEYS[3]) or '0-0'
+return {owner, id, token, applied, redis.call('XRANGE', KEYS[2], '(' .. applied, '+')}
+"""
+
+# Drop the lease only if this worker still holds it
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def _move(game_id: str, game: GameState, command: dict, pipe, clock: Clock):
+    play_move(game, command.get("player_id"), command.get("index"), clock)
+    game.version += 1
+    record_checkpoint(pipe, game_id, game)
+
+
+def _join(game_id: str, game: GameState, command: dict, pipe, clock: Clock) -> dict:
+    player_id = command["player_id"]
+    if seat_player(game_id, game, player_id, command.get("estimated_rank"), pipe):
+        game.version += 1
+    return {"player_id": player_id, "full": len(game.players) == 2}
+
+
+def _takeback_request(game_id: str, game: GameState, command: dict, pipe, clock: Clock) -> dict | None:
+    player_id = command.get("player_id")
+    request_takeback(game_id, game, player_id, pipe)
+    if game.bot and game.bot["player_id"] != player_id:
+        # The bot agrees to every takeback, straight away
+        resolve_takeback(game_id, game, game.bot["player_id"], True, pipe)
+        return {"quiet": True}
+
+
+def _takeback(game_id: str, game: GameState, command: dict, pipe, clock: Clock) -> dict | None:
+    if resolve_takeback(game_id, game, command.get("player_id"), bool(command.get("accept")), pipe):
+        # Clients apply the queued delta; no game_state needed
+        return {"quiet": True}
+
+
+def _forfeit(game_id: str, game: GameState, command: dict, pipe, clock: Clock):
+    if not is_finished(game):
+        game.end_game(reason="resign", resigned_player=command.get("player_id"))
+        game.version += 1
+
+
+def _toggle_dead(game_id: str, game: GameState, command: dict, pipe, clock: Clock):
+    toggle_dead_stone(game_id, game, command.get("player_id"), command.get("index"), pipe)
+
+
+def _finalize(game_id: str, game: GameState, command: dict, pipe, clock: Clock):
+    finalize_score(game_id, game, command.get("player_id"), pipe)
+
+
+def _wake_bot(game_id: str, game: GameState, command: dict, pipe, clock: Clock):
+    pass  # Applying any command starts the bot when it is its turn
+
+
+# Command type -> handler(game_id, game, command, pipe, clock). Handlers mutate
+# the game in place and bump its version when they change it, may queue
+# side writes and smaller updates on the commit pipeline, and raise
+# HTTPException before changing the game. They may return extra reply
+# fields; "quiet" saves the game without a game_state update.
+COMMAND_HANDLERS = {
+    "move": _move,
+    "join": _join,
+    "takeback_request": _takeback_request,
+    "takeback": _takeback,
+    "forfeit": _forfeit,
+    "toggle_dead": _toggle_dead,
+    "finalize": _finalize,
+    "wake_bot": _wake_bot
+}
+# Commands that only change the document, so replaying them from the
+# stream after a takeover gives the same game. The others also write keys
+# of their own (seats, takeback requests, dead stones), so a batch applying
+# one of them is snapshotted straight away.
+REPLAYABLE_COMMANDS = {"move", "forfeit", "wake_bot"}
+
+
+def _entry_order(entry_id: str) -> tuple:
+    ms, seq = entry_id.split("-")
+    return int(ms), int(seq)
+
+
+def _fields(raw) -> dict:
+    """Stream entry fields, from a script reply (flat list) or redis-py (dict)."""
+    if isinstance(raw, dict):
+        return raw
+    return dict(zip(raw[::2], raw[1::2]))
+
+
+def _failure(status: int, detail: str) -> dict:
+    return {"ok": False, "status": status, "detail": detail}
+
+
+def _refused(reply: list) -> dict:
+    """The failure for an acquire() reply that found no live game."""
+    if reply[1] == "finished":
+        return _failure(400, "The game is over")
+    return _failure(404, "Game not found")
+
+
+class Actor:
+    """An owned game: the live GameState and how far it is ahead of its snapshot."""
+
+    def __init__(self, game: GameState | None, applied: str, now: float):
+        self.game = game
+        self.applied = applied  # last entry applied to the game
+        self.saved = applied  # last entry reflected in the stored snapshot
+        self.unsaved = 0  # changes since the snapshot
+        self.active_at = now
+        self.saved_at = now
+
+    def dirty(self) -> bool:
+        return self.unsaved > 0 or self.applied != self.saved
+
+
+class GameActors:
+    """
+    The games this worker owns. Commands submitted here for an owned game
+    are applied inline. A listener thread blocks on this worker's inbox
+    (commands submitted elsewhere) and reply list (answers to commands
+    submitted here) and hands both to the event loop; one task renews
+    leases and hands back idle games.
+    """
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self.owned = {}  # game_id -> Actor
+        self.waiting = {}  # command_id -> future of a submit waiting for its reply
+        self.bot_tasks = {}  # game_id -> task playing the bot's turn
+        # Coroutine function(game_id) playing the bot's move, set by the app
+        self.play_bot = None
+        self.clock = system_clock
+        self.task = None
+        self.loop = None
+        self.listener = None
+        self.stopping = False
+
+    def acquire(self, game_id: str, fields: dict | None = None) -> list:
+        args = [WORKER_ID, int(ACTOR_LEASE_SECS * 1000), COMMAND_LOG_LEN, FINISHED_TOKEN_SUFFIX]
+        for name, value in (fields or {}).items():
+            args += [name, value]
+        acquire = self.redis_client.register_script(ACQUIRE_SCRIPT)
+        started = time.perf_counter()
+        reply = acquire(
+            keys=[actor_key(game_id), commands_key(game_id), applied_key(game_id), version_key(game_id), game_key(game_id)],
+            args=args
+        )
+        storage.record("actor_acquire", bytes_out=sum(len(str(a)) for a in args),
+                       elapsed_ms=(time.perf_counter() - started) * 1000)
+        return reply
+
+    def own(self, game_id: str, reply: list, clock: Clock) -> Actor:
+        actor = self.owned.get(game_id)
+        if actor is not None and actor.saved != reply[3]:
+            # Another worker held the lease in between and snapshotted
+            self.drop(game_id)
+            actor = None
+        if actor is None:
+            token, applied = reply[2], reply[3]
+            game = game_cache.current(game_id, token)
+            if game is None:
+                game = load_game(game_id, self.redis_client)
+            actor = self.owned[game_id] = Actor(game, applied, clock.time())
+            self.clock = clock
+            if self.task is None or self.task.done():
+                self.task = asyncio.create_task(self.run())
+            self.listen()
+        return actor
+
+    def listen(self):
+        """Start the listener thread, once per worker."""
+        self.loop = asyncio.get_running_loop()
+        if self.listener is None or not self.listener.is_alive():
+            self.stopping = False
+            self.listener = threading.Thread(target=self.read_lists, name="game-actors", daemon=True)
+            self.listener.start()
+
+    def drop(self, game_id: str):
+        """Forget a game whose lease is gone, with any changes not in its snapshot."""
+        actor = self.owned.pop(game_id, None)
+        if actor is not None and actor.unsaved:
+            # The cached object is ahead of the stored token; whoever owns
+            # the game next replays those changes from the stream
+            game_cache.discard(game_id)
+
+    def release(self, game_id: str):
+        actor = self.owned.get(game_id)
+        if actor is not None and actor.dirty() and actor.game is not None:
+            with self.redis_client.pipeline(transaction=False) as pipe:
+                self.snapshot(pipe, game_id, actor, False, actor.active_at)
+                storage.execute(pipe, "actor_snapshot")
+        self.owned.pop(game_id, None)
+        release = self.redis_client.register_script(RELEASE_SCRIPT)
+        release(keys=[actor_key(game_id)], args=[WORKER_ID])
+        storage.record("actor_release")
+
+    def release_all(self):
+        """Hand every owned game back, e.g. on shutdown, so others take over at once."""
+        for game_id in list(self.owned):
+            self.release(game_id)
+
+    def close(self):
+        """On shutdown: release every game and let the listener thread end."""
+        self.stopping = True
+        self.release_all()
+
+    def run_command(self, game_id: str, game: GameState | None, fields: dict, pipe, clock: Clock) -> tuple:
+        """The command's result, and whether replaying the stream would redo it."""
+        if float(fields["expires"]) < clock.time():
+            return _failure(503, "The command expired before it was applied"), True
+        if game is None:
+            return _failure(404, "Game not found"), True
+        try:
+            command = json.loads(fields["command"])
+        except ValueError:
+            return _failure(400, "Malformed command"), True
+        handler = COMMAND_HANDLERS.get(command.get("type")) if isinstance(command, dict) else None
+        if handler is None:
+            return _failure(400, "Unknown command"), True
+        version = game.version
+        try:
+            extra = handler(game_id, game, command, pipe, clock) or {}
+        except HTTPException as e:
+            return _failure(e.status_code, e.detail), True
+        except Exception as e:
+            # Still counts as applied: a command that crashes must not block
+            # every later one, nor leave earlier ones to be applied again
+            print(f"Command {command.get('type')} failed in game {game_id}: {e}")
+            return _failure(500, "The command failed"), True
+        return {
+            "ok": True,
+            "changed": game.version != version,
+            "quiet": extra.pop("quiet", False),
+            "version": game.version,
+            "game_over": game.game_over,
+            "bot_turn": is_bot_turn(game),
+            **extra
+        }, command["type"] in REPLAYABLE_COMMANDS
+
+    def apply(self, game_id: str, reply: list, mutate=None, inline: str | None = None,
+              clock: Clock = system_clock) -> tuple:
+        """
+        Apply the pending entries of an acquire() reply in stream order, then
+        `mutate(game)` if given (True when it changed the game), and publish
+        the new state once for all of it, snapshotting when one is due.
+        Results go back through reply keys, except the inline command's,
+        which is returned with the game.
+        """
+        actor = self.own(game_id, reply, clock)
+        game = actor.game
+        now = clock.time()
+
+        last_id, changes, publish, snapshot, inline_result = actor.applied, 0, False, False, None
+        with self.redis_client.pipeline(transaction=False) as pipe:
+            for entry_id, raw in reply[4]:
+                if _entry_order(entry_id) <= _entry_order(last_id):
+                    continue
+                last_id = entry_id
+                fields = _fields(raw)
+                result, replayable = self.run_command(game_id, game, fields, pipe, clock)
+                if result["ok"] and result["changed"]:
+                    changes += 1
+                    publish = publish or not result["quiet"]
+                snapshot = snapshot or not replayable
+                if fields["id"] == inline:
+                    inline_result = result
+                else:
+                    pipe.rpush(replies_key(fields["worker"]), json.dumps({"id": fields["id"], **result}))
+                    pipe.expire(replies_key(fields["worker"]), INBOX_TTL_SECS)
+
+            if game is not None and mutate is not None and mutate(game):
+                game.version += 1
+                changes += 1
+                publish = True
+
+            moved = last_id != actor.applied
+            actor.applied, actor.unsaved, actor.active_at = last_id, actor.unsaved + changes, now
+            if game is not None:
+                snapshot = snapshot or is_finished(game) or actor.unsaved >= ACTOR_SNAPSHOT_COMMANDS \
+                    or now - actor.saved_at >= ACTOR_SNAPSHOT_SECS
+                if snapshot and actor.dirty():
+                    self.snapshot(pipe, game_id, actor, publish, now)
+                elif publish:
+                    publish_state(pipe, game_id, game)
+            bot_turn = game is not None and is_bot_turn(game)
+            if bot_turn and moved:
+                schedule_deadline(pipe, BOT_TURN, game_id,
+                                  now + game.bot["time_budget"] + BOT_STALL_SECS)
+            if pipe.command_stack:
+                storage.execute(pipe, "actor_commit")
+
+        if game is None or is_finished(game):
+            # Nothing left to own; a finished game's lease went with its live keys
+            self.release(game_id)
+        elif bot_turn:
+            self.wake_bot(game_id)
+        return game, inline_result
+
+    def snapshot(self, pipe, game_id: str, actor: Actor, publish: bool, now: float):
+        """Queue the owned game's document, if it changed, and the id of the last entry it reflects."""
+        if actor.unsaved:
+            if publish:
+                save_and_publish(pipe, game_id, actor.game)
+            else:
+                save_game(pipe, game_id, actor.game)
+        if actor.applied != actor.saved and not is_finished(actor.game):
+            pipe.set(applied_key(game_id), actor.applied, keepttl=True)
+        actor.saved, actor.unsaved, actor.saved_at = actor.applied, 0, now
+
+    def flush(self, now: float):
+        """Snapshot every owned game whose last snapshot is ACTOR_SNAPSHOT_SECS old, in one round trip."""
+        with self.redis_client.pipeline(transaction=False) as pipe:
+            for game_id, actor in self.owned.items():
+                if actor.dirty() and actor.game is not None and now - actor.saved_at >= ACTOR_SNAPSHOT_SECS:
+                    self.snapshot(pipe, game_id, actor, False, now)
+            if pipe.command_stack:
+                storage.execute(pipe, "actor_snapshot")
+
+    def wake_bot(self, game_id: str):
+        """
+        Start the bot's move on the owner, whatever got the game here: a
+        human move, a takeover after a restart or a takeback. A bot task
+        applying its own move may start the next one.
+        """
+        if self.play_bot is None:
+            return
+        task = self.bot_tasks.get(game_id)
+        if task is not None and not task.done() and task is not asyncio.current_task():
+            return  # Already thinking
+        task = self.bot_tasks[game_id] = asyncio.create_task(self.play_bot(game_id))
+        task.add_done_callback(lambda done: self.forget_bot_task(game_id, done))
+
+    def forget_bot_task(self, game_id: str, task: asyncio.Task):
+        if self.bot_tasks.get(game_id) is task:
+            del self.bot_tasks[game_id]
+
+    async def submit(self, game_id: str, command: dict, clock: Clock = system_clock) -> dict:
+        """
+        Run a command on the game's actor, here or on its owner. Returns the
+        result; a rejected command raises HTTPException as if applied here.
+        """
+        command_id = uuid.uuid4().hex[:12]
+        reply = self.acquire(game_id, {
+            "id": command_id,
+            "worker": WORKER_ID,
+            "expires": clock.time() + COMMAND_TIMEOUT_SECS,
+            "command": json.dumps(command)
+        })
+        owner = reply[0]
+        if owner is None:
+            result = _refused(reply)
+        elif owner == WORKER_ID:
+            _, result = self.apply(game_id, reply, inline=command_id, clock=clock)
+            if result is None:
+                result = _failure(503, "The command was trimmed from the log before it was applied")
+        else:
+            self.listen()
+            self.notify(owner, game_id)
+            result = await self.wait_reply(command_id)
+        if not result["ok"]:
+            raise HTTPException(status_code=result["status"], detail=result["detail"])
+        return result
+
+    def run_local(self, game_id: str, mutate, clock: Clock = system_clock) -> GameState | None:
+        """
+        `mutate(game)` on the owned game, taking the lease if it is free.
+        Returns the game, or None if another worker owns it (or it is gone or
+        finished).
+        """
+        reply = self.acquire(game_id)
+        if reply[0] != WORKER_ID:
+            self.drop(game_id)
+            return None
+        game, _ = self.apply(game_id, reply, mutate=mutate, clock=clock)
+        return game
+
+    def notify(self, owner: str, game_id: str):
+        with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.rpush(inbox_key(owner), game_id)
+            pipe.expire(inbox_key(owner), INBOX_TTL_SECS)
+            storage.execute(pipe, "actor_notify")
+
+    async def wait_reply(self, command_id: str) -> dict:
+        # Registered after the XADD is fine: replies reach the loop only
+        # through receive(), which cannot run before this awaits
+        future = self.waiting[command_id] = asyncio.get_running_loop().create_future()
+        try:
+            return await asyncio.wait_for(future, COMMAND_TIMEOUT_SECS)
+        except asyncio.TimeoutError:
+            return _failure(503, "The game did not answer in time, try again")
+        finally:
+            self.waiting.pop(command_id, None)
+
+    def read_lists(self):
+        """
+        Listener thread: parks one pooled connection in BLPOP on the inbox
+        and the reply list (same hash tag, so one slot on a cluster) and
+        passes each item to the event loop.
+        """
+        keys = [inbox_key(WORKER_ID), replies_key(WORKER_ID)]
+        while not self.stopping:
+            try:
+                item = self.redis_client.blpop(keys, timeout=ACTOR_BLOCK_SECS)
+            except Exception as err:
+                print("Actor listener error:", err)
+                time.sleep(1)
+                continue
+            if item is not None:
+                self.loop.call_soon_threadsafe(self.receive, *item)
+
+    def receive(self, key: str, value: str):
+        try:
+            if key == inbox_key(WORKER_ID):
+                storage.record("actor_inbox", bytes_in=len(value))
+                self.take_over(value)
+            else:
+                storage.record("actor_wait_reply", bytes_in=len(value))
+                result = json.loads(value)
+                future = self.waiting.get(result.pop("id"))
+                if future is not None and not future.done():
+                    future.set_result(result)
+        except Exception as err:
+            print("Actor loop error:", err)
+
+    def take_over(self, game_id: str):
+        """Apply whatever a nudge announced, or pass the nudge on to the current owner."""
+        reply = self.acquire(game_id)
+        if reply[0] == WORKER_ID:
+            self.apply(game_id, reply, clock=self.clock)
+        elif reply[0] is None:
+            self.drop(game_id)
+        else:
+            # The lease moved on while the nudge was queued
+            self.drop(game_id)
+            self.notify(reply[0], game_id)
+
+    def renew(self, now: float):
+        """Extend every owned lease in one round trip; drop lost and idle games."""
+        game_ids = list(self.owned)
+        with self.redis_client.pipeline(transaction=False) as pipe:
+            for game_id in game_ids:
+                # PEXPIRE before the GET: extending a lease that has just
+                # passed to another worker only extends theirs
+                pipe.pexpire(actor_key(game_id), int(ACTOR_LEASE_SECS * 1000))
+                pipe.get(actor_key(game_id))
+            owners = storage.execute(pipe, "actor_renew")[1::2]
+        for game_id, owner in zip(game_ids, owners):
+            if owner != WORKER_ID:
+                self.drop(game_id)
+            elif now - self.owned[game_id].active_at > ACTOR_IDLE_SECS:
+                self.release(game_id)
+
+    async def run(self):
+        while self.owned:
+            await self.clock.sleep(ACTOR_LEASE_SECS / 3)
+            try:
+                self.renew(self.clock.time())
+                self.flush(self.clock.time())
+            except Exception as err:
+                print("Actor loop error:", err)
+
+
+game_actors = GameActors(redis_client)
@@ -0,0 +1,234 @@
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+import storage
+from game_state import GameState
+from ops import FINISHED_TOKEN_SUFFIX, finish_game
+from storage import (
+    game_key, version_key, players_key, chat_key, disconnect_key, takeback_key,
+    checkpoint_key, dead_stones_key, finalized_key, commands_key, applied_key, actor_key,
+    deltas_key, publish_update, state_message
+)
+
+# Decoded games kept per worker
+GAME_CACHE_SIZE = int(os.getenv("GAME_CACHE_SIZE", 1024))
+# How long a finished game's result record (and its chat and players) outlives the game
+RESULT_TTL_SECS = int(os.getenv("RESULT_TTL_SECS", 3600))
+
+
+class GameCache:
+    """
+    Bounded LRU of decoded GameState objects for this worker.
+
+    Every write stores a small version token ("<version>.<nonce>") next to
+    the document, so an entry is validated with one tiny GET instead of
+    fetching and decoding the whole game. The nonce keeps two workers that
+    raced to the same version number from trusting each other's copy.
+
+    Games this worker is subscribed to through the broadcaster are also
+    "verified" until an update notification arrives; read-only callers
+    (fresh=False) skip Redis entirely for those.
+
+    Returned objects are shared. Mutate one only when saving it straight
+    away with save_game.
+
+    Finished games also keep their serialised result record, which never
+    changes, so serving it is a plain copy of the cached string.
+    """
+
+    def __init__(self, maxsize: int = GAME_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()  # game_id -> (token, GameState, record JSON or None)
+        self.watched = set()    # games whose updates reach this worker's pub/sub
+        self.verified = set()   # watched games with no update since last validation
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, game_id: str, game: GameState, token: str, record: str | None = None):
+        self.entries[game_id] = (token, game, record)
+        self.entries.move_to_end(game_id)
+        if game_id in self.watched:
+            self.verified.add(game_id)
+        while len(self.entries) > self.maxsize:
+            evicted, _ = self.entries.popitem(last=False)
+            self.verified.discard(evicted)
+
+    def discard(self, game_id: str):
+        self.entries.pop(game_id, None)
+        self.verified.discard(game_id)
+
+    def watch(self, game_id: str):
+        self.watched.add(game_id)
+
+    def unwatch(self, game_id: str):
+        self.watched.discard(game_id)
+        self.verified.discard(game_id)
+
+    def notify(self, game_id: str):
+        """An update was published for this game; revalidate before trusting the entry."""
+        self.verified.discard(game_id)
+
+    def get(self, game_id: str, redis_client, fresh: bool = True) -> GameState | None:
+        entry = self.entries.get(game_id)
+
+        if entry is not None and not fresh and game_id in self.verified:
+            self.entries.move_to_end(game_id)
+            self.hits += 1
+            return entry[1]
+
+        if entry is not None:
+            started = time.perf_counter()
+            token = redis_client.get(version_key(game_id))
+            storage.record("load_game.validate", bytes_in=len(token or ""),
+                           elapsed_ms=(time.perf_counter() - started) * 1000)
+            if token is not None and token == entry[0]:
+                self.entries.move_to_end(game_id)
+                if game_id in self.watched:
+                    self.verified.add(game_id)
+                self.hits += 1
+                return entry[1]
+
+        # One MGET so the document, its token and its undo deltas are read together
+        self.misses += 1
+        started = time.perf_counter()
+        raw, token, deltas = redis_client.mget(game_key(game_id), version_key(game_id), deltas_key(game_id))
+        storage.record("load_game.fetch", bytes_in=len(raw or "") + len(token or "") + len(deltas or ""),
+                       elapsed_ms=(time.perf_counter() - started) * 1000)
+        if raw is None:
+            self.discard(game_id)
+            return None
+
+        data = json.loads(raw)
+        if deltas is not None:
+            data["undo_deltas"] = json.loads(deltas)
+        game = GameState.from_dict(data)
+        if token is None:
+            # Written before version tokens existed; decode every time
+            self.discard(game_id)
+        else:
+            self.put(game_id, game, token, raw if data.get("compact") else None)
+        return game
+
+    def record(self, game_id: str) -> str | None:
+        entry = self.entries.get(game_id)
+        return entry[2] if entry is not None else None
+
+    def current(self, game_id: str, token: str) -> GameState | None:
+        """The cached object if it is still at `token`, without asking Redis."""
+        entry = self.entries.get(game_id)
+        if entry is None or entry[0] != token:
+            return None
+        self.entries.move_to_end(game_id)
+        self.hits += 1
+        return entry[1]
+
+    def token(self, game_id: str) -> str | None:
+        entry = self.entries.get(game_id)
+        return entry[0] if entry is not None else None
+
+
+game_cache = GameCache()
+
+
+def load_game(game_id: str, redis_client, fresh: bool = True) -> GameState | None:
+    """
+    Decoded game or None. Pass fresh=False on read-only paths that can
+    tolerate the broadcaster's notification delay.
+    """
+    return game_cache.get(game_id, redis_client, fresh)
+
+
+def load_result(game_id: str, redis_client) -> str | None:
+    """The serialised result record of a finished game, or None for live and missing games."""
+    if game_cache.get(game_id, redis_client, fresh=False) is None:
+        return None
+    return game_cache.record(game_id)
+
+
+def is_finished(game: GameState) -> bool:
+    return game.game_over and not game.in_scoring_phase
+
+
+def serialize(game: GameState) -> str:
+    """
+    The stored form: the document clients see (save_game keeps the undo
+    deltas under their own key), or the result record once the game is
+    finished.
+    """
+    if is_finished(game):
+        return json.dumps(game.to_record(), separators=(",", ":"))
+    return json.dumps(game.to_dict())
+
+
+def save_game(target, game_id: str, game: GameState, game_json: str | None = None, cache: bool = True) -> str:
+    """
+    SET the document and a new version token on a client or pipeline.
+    With cache=False the caller puts the object in the cache itself once
+    its transaction has committed. Returns the token.
+
+    A finished game replaces its document with the result record instead,
+    see save_result.
+    """
+    if game_json is None:
+        game_json = serialize(game)
+    if is_finished(game):
+        return save_result(target, game_id, game, game_json, cache)
+
+    token = f"{game.version}.{uuid.uuid4().hex[:8]}"
+    target.set(game_key(game_id), game_json)
+    target.set(version_key(game_id), token)
+    target.set(deltas_key(game_id), json.dumps(game.move_deltas))
+    if cache:
+        game_cache.put(game_id, game, token)
+    return token
+
+
+def save_result(target, game_id: str, game: GameState, record_json: str, cache: bool = True,
+                was_live: bool | None = None) -> str:
+    """
+    Compact a finished game: the record replaces the document, state only
+    live play needs is dropped, and everything a reviewer still reads
+    expires after RESULT_TTL_SECS. Also takes the game off the active count
+    if `was_live`; by default unless the token it was loaded with shows it
+    had already finished.
+    """
+    if was_live is None:
+        previous = game_cache.token(game_id)
+        was_live = not (previous and previous.endswith(FINISHED_TOKEN_SUFFIX))
+    token = f"{game.version}.{uuid.uuid4().hex[:8]}{FINISHED_TOKEN_SUFFIX}"
+    target.set(game_key(game_id), record_json, ex=RESULT_TTL_SECS)
+    finish_game(target, game_id, token, RESULT_TTL_SECS, was_live=was_live)
+    for key in (players_key(game_id), chat_key(game_id), disconnect_key(game_id), checkpoint_key(game_id)):
+        target.expire(key, RESULT_TTL_SECS)
+    target.delete(
+        takeback_key(game_id),
+        dead_stones_key(game_id, "black"),
+        dead_stones_key(game_id, "white"),
+        finalized_key(game_id),
+        commands_key(game_id),
+        applied_key(game_id),
+        actor_key(game_id),
+        deltas_key(game_id)
+    )
+    if cache:
+        game_cache.put(game_id, game, token, record_json)
+    return token
+
+
+def save_and_publish(pipe, game_id: str, game: GameState, cache: bool = True) -> str:
+    """
+    save_game plus the game_state update on the same pipeline, serialising
+    the document once for both. Returns the token.
+    """
+    game_json = serialize(game)
+    token = save_game(pipe, game_id, game, game_json, cache=cache)
+    publish_update(pipe, game_id, state_message(game_json))
+    return token
+
+
+def publish_state(pipe, game_id: str, game: GameState):
+    """The game_state update alone, for an owner publishing a change between snapshots."""
+    publish_update(pipe, game_id, state_message(serialize(game)))
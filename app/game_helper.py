@@ -1,176 +1,320 @@
 from game_state import Stone, GameState
 import json
 import random
-import uuid
-import redis
 from fastapi import HTTPException
+import storage
 from redis_client import redis_client
-from sqlalchemy import delete
-from db import async_session
-from models import PublicGame
+from clock import Clock, system_clock
+from deadlines import JOIN_TIMEOUT, cancel_deadline
+from replay import drop_checkpoint
+from game_cache import game_cache
+from storage import game_key, players_key, takeback_key, publish_update
+from lobby_writer import lobby_writer
+from ops import delete_game
+from geometry import MIN_BOARD_SIZE, MAX_BOARD_SIZE, is_valid_size
+
+VALID_TIME_CONTROLS = {"none", "300", "600", "900", "1800", "3600", "7200", "15"}
+VALID_RULE_SETS = {"japanese", "chinese"}
+VALID_COLOR_PREFERENCES = {"random", "black", "white"}
+
+################################
+### GAME SETTINGS VALIDATION ###
+################################
+
+def validate_game_settings(board_size: int, rule_set: str, time_control: str, komi: float,
+                           color_preference: str, byo_yomi_periods: int, byo_yomi_time: int):
+    """Raises HTTPException for any setting a new game may not use."""
+    if not is_valid_size(board_size):
+        raise HTTPException(status_code=400, detail=f"Board size must be between {MIN_BOARD_SIZE} and {MAX_BOARD_SIZE}")
+
+    if rule_set not in VALID_RULE_SETS:
+        raise HTTPException(status_code=400, detail="Invalid rule set")
+
+    if time_control not in VALID_TIME_CONTROLS:
+        raise HTTPException(status_code=400, detail="Invalid time control setting")
+
+    if komi < 0.5 or komi > 50:
+        raise HTTPException(status_code=400, detail="Invalid komi value")
+
+    if color_preference not in VALID_COLOR_PREFERENCES:
+        raise HTTPException(status_code=400, detail="Invalid color preference")
+
+    if byo_yomi_periods not in [0, 1, 2, 3, 4, 5]:
+        raise HTTPException(status_code=400, detail="Invalid byo-yomi periods")
+
+    if byo_yomi_time < 0 or byo_yomi_time > 60 or byo_yomi_time % 5 != 0:
+        raise HTTPException(status_code=400, detail="Invalid byo-yomi time")
 
 #########################
 ### JOIN GAME UTILITY ###
 #########################
 
-def do_join(game_id: str, incoming_player_id: str | None = None, estimated_rank: str | None = None) -> str:
+def seat_player(game_id: str, game: GameState, player_id: str, estimated_rank: str | None, pipe) -> bool:
     """
-    Core join logic: slots a player into the GameState in Redis,
-    applies handicaps, publishes updates, and returns the final player_id.
-    Raises HTTPException on any error (404, full game, missing rank, etc.).
+    Core join logic, run by the game's actor: slots a player into the
+    GameState, applies handicaps and keeps the player -> color hash in step
+    on `pipe`. Returns False when the player already has a seat.
+    Raises HTTPException (full game, missing rank, etc.) before anything
+    is changed.
     """
-    key = f"game:{game_id}"
-    pipe = redis_client.pipeline()
-    try:
-        pipe.watch(key)
-
-        raw = redis_client.get(key)
-        if not raw:
-            raise HTTPException(404, "Game not found or expired")
-
-        game = GameState.from_dict(json.loads(raw))
-
-        # Re-connect case
-        if incoming_player_id and incoming_player_id in game.players:
-            return incoming_player_id
-
-        # Full game?
-        if len(game.players) >= 2:
-            raise HTTPException(400, "Game is full")
-
-        # New player ID
-        player_id = incoming_player_id or str(uuid.uuid4())[:8]
-
-        # Handicap rank required?
-        if getattr(game, "allow_handicaps", False) and not estimated_rank:
-            raise HTTPException(400, "Estimated rank is required for handicap games")
-
-        # Slot color for first vs second
-        if len(game.players) == 0:
-            # first slot
-            if game.color_preference == "random":
-                color = random.choice([Stone.BLACK, Stone.WHITE])
-                game.players[player_id] = color.value
-            else:
-                pref = Stone.BLACK.value if game.color_preference == "black" else Stone.WHITE.value
-                game.players[player_id] = pref
+    # Re-connect case
+    if player_id in game.players:
+        return False
+
+    # Full game?
+    if len(game.players) >= 2:
+        raise HTTPException(400, "Game is full")
+
+    # Handicap rank required?
+    handicaps = getattr(game, "allow_handicaps", False)
+    if handicaps and not estimated_rank:
+        raise HTTPException(400, "Estimated rank is required for handicap games")
+    if handicaps and game.players:
+        ranks = [*(getattr(game, "estimated_ranks", None) or {}).values(), estimated_rank]
+        if any(rank_to_number(rank) is None for rank in ranks):
+            raise HTTPException(400, "Invalid rank provided")
+
+    # Slot color for first vs second
+    if len(game.players) == 0:
+        # first slot
+        if game.color_preference == "random":
+            color = random.choice([Stone.BLACK, Stone.WHITE])
+            game.players[player_id] = color.value
         else:
-            # second slot
-            existing_id = next(iter(game.players))
-            existing_color = game.players[existing_id]
-            new_color = Stone.BLACK if existing_color == Stone.WHITE.value else Stone.WHITE
-            game.players[player_id] = new_color.value
-
-        # Apply handicap stones if needed
-        if getattr(game, "allow_handicaps", False):
-            if not getattr(game, "estimated_ranks", None):
-                game.estimated_ranks = {}
-            game.estimated_ranks[player_id] = estimated_rank
-
-            if len(game.players) == 2 and len(game.estimated_ranks) == 2:
-                # finalize handicap logic exactly as before...
-                pids = list(game.players.keys())
-                r1 = rank_to_number(game.estimated_ranks[pids[0]])
-                r2 = rank_to_number(game.estimated_ranks[pids[1]])
-                if r1 is None or r2 is None:
-                    raise HTTPException(400, "Invalid rank provided")
-                diff = abs(r1 - r2)
-                game.handicap_stones = min(diff, 9)
-
-                # assign weaker player Black
-                if r1 > r2:
-                    game.players[pids[0]] = Stone.WHITE.value
-                    game.players[pids[1]] = Stone.BLACK.value
-                else:
-                    game.players[pids[0]] = Stone.BLACK.value
-                    game.players[pids[1]] = Stone.WHITE.value
-
-                place_handicap_stones(game)
-
-        # Initialize time_left if time control and second joined
-        if game.time_control != "none" and len(game.players) == 2:
-            try:
-                default_time = int(game.time_control)
-            except:
-                default_time = 300
-            for pid in game.players:
-                game.time_left.setdefault(pid, default_time)
-
-        # Commit atomically
-        pipe.multi()
-        pipe.set(key, json.dumps(game.to_dict()))
-        pipe.execute()
-
-        # Publish to subscribers if game is now full
-        if len(game.players) == 2:
-            redis_client.publish(
-                f"game_updates:{game_id}",
-                json.dumps({"type": "game_state", "payload": game.to_dict()})
-            )
-
-        return player_id
-
-    except redis.WatchError:
-        raise HTTPException(409, "Conflict: Game state changed. Try again.")
-    finally:
-        pipe.reset()
+            pref = Stone.BLACK.value if game.color_preference == "black" else Stone.WHITE.value
+            game.players[player_id] = pref
+    else:
+        # second slot
+        existing_id = next(iter(game.players))
+        existing_color = game.players[existing_id]
+        new_color = Stone.BLACK if existing_color == Stone.WHITE.value else Stone.WHITE
+        game.players[player_id] = new_color.value
+
+    # Apply handicap stones if needed
+    if handicaps:
+        if not getattr(game, "estimated_ranks", None):
+            game.estimated_ranks = {}
+        game.estimated_ranks[player_id] = estimated_rank
+
+        if len(game.players) == 2 and len(game.estimated_ranks) == 2:
+            pids = list(game.players.keys())
+            r1 = rank_to_number(game.estimated_ranks[pids[0]])
+            r2 = rank_to_number(game.estimated_ranks[pids[1]])
+            diff = abs(r1 - r2)
+            game.handicap_stones = min(diff, game.geometry.max_handicap)
+
+            # assign weaker player Black
+            if r1 > r2:
+                game.players[pids[0]] = Stone.WHITE.value
+                game.players[pids[1]] = Stone.BLACK.value
+            else:
+                game.players[pids[0]] = Stone.BLACK.value
+                game.players[pids[1]] = Stone.WHITE.value
+
+            place_handicap_stones(game)
+
+    # Initialize time_left if time control and second joined
+    if game.time_control != "none" and len(game.players) == 2:
+        try:
+            default_time = int(game.time_control)
+        except:
+            default_time = 300
+        for pid in game.players:
+            game.time_left.setdefault(pid, default_time)
+
+    # The actor saves and publishes the game with the hash; someone has
+    # joined, so the join timeout is over
+    pipe.delete(players_key(game_id))
+    pipe.hset(players_key(game_id), mapping=game.players)
+    cancel_deadline(pipe, JOIN_TIMEOUT, game_id)
+    return True
+
+#########################
+### MAKE MOVE UTILITY ###
+#########################
+
+def play_move(game: GameState, player_id: str | None, index: int | None, clock: Clock = system_clock):
+    """
+    Validate and apply one move (index >= 0), pass (-1) or resignation (-2)
+    to an in-memory game; the game's actor persists and broadcasts it.
+    Raises HTTPException describing why the move was rejected, before
+    anything is changed.
+    """
+    # Validate request
+    if not player_id or index is None:
+        raise HTTPException(status_code=400, detail="Missing player_id or index")
+    if isinstance(index, bool) or not isinstance(index, int):
+        raise HTTPException(status_code=400, detail="Invalid move")
+
+    # Validate player
+    if player_id not in game.players:
+        raise HTTPException(status_code=403, detail="You are not part of this game")
+
+    # Validate both players are connected
+    if index != -2:
+        if len(game.players) < 2:
+            raise HTTPException(status_code=400, detail="Waiting for the second player to join")
+
+    # Determine player's color and check turn
+    player_color = Stone(game.players[player_id])
+    if player_color != game.current_turn:
+        raise HTTPException(status_code=400, detail="Not your turn")
+
+    # Attempt to make the move
+    if not game.is_valid_move(index, player_color):
+        raise HTTPException(status_code=400, detail="Invalid move")
+
+    game.make_move(index, player_color)
+    game.moves.append({
+        "index": index,
+        "color": player_color.value,
+        "timestamp": clock.time()
+    })
+    #Reset byo-yomi if needed
+    if game.byo_yomi_periods > 0:
+        game.byo_yomi_time_left[player_id] = game.byo_yomi_time
+
+########################
+### TAKEBACK UTILITY ###
+########################
+
+TAKEBACK_REQUEST_TTL_SECS = 60
+
+def request_takeback(game_id: str, game: GameState, player_id: str, pipe):
+    """Ask the opponent to undo the requesting player's last move; run by the game's actor."""
+    if player_id not in game.players or len(game.players) < 2:
+        raise HTTPException(status_code=403, detail="You are not part of this game")
+    if game.game_over:
+        raise HTTPException(status_code=400, detail="The game is over")
+    if not game.move_deltas or game.move_deltas[-1]["color"] != game.players[player_id]:
+        raise HTTPException(status_code=400, detail="You can only take back your own last move")
+
+    # Remember the move count so a request made stale by a new move is refused
+    created = redis_client.set(
+        takeback_key(game_id),
+        f"{player_id}:{len(game.moves)}",
+        nx=True,
+        ex=TAKEBACK_REQUEST_TTL_SECS
+    )
+    storage.record("takeback_request")
+    if not created:
+        raise HTTPException(status_code=409, detail="A takeback request is already pending")
+
+    publish_update(pipe, game_id, json.dumps({"type": "takeback_request", "player_id": player_id}))
+
+def resolve_takeback(game_id: str, game: GameState, player_id: str, accept: bool, pipe) -> bool:
+    """
+    Opponent's answer to a pending takeback, run by the game's actor. On
+    accept the last move is undone from its delta and only that delta is
+    queued for broadcast on `pipe`. Returns True if a move was undone.
+    """
+    if player_id not in game.players:
+        raise HTTPException(status_code=403, detail="You are not part of this game")
+    key = takeback_key(game_id)
+    pending = redis_client.get(key)
+    storage.record("takeback_resolve", bytes_in=len(pending or ""))
+    if not pending:
+        raise HTTPException(status_code=400, detail="No takeback request pending")
+
+    requester, move_count = pending.rsplit(":", 1)
+    if requester == player_id:
+        raise HTTPException(status_code=403, detail="Only your opponent can answer this request")
+    deleted = redis_client.delete(key)
+    storage.record("takeback_resolve", new_call=False)
+    if not deleted:
+        raise HTTPException(status_code=409, detail="The takeback request was already answered")
+
+    if not accept:
+        publish_update(pipe, game_id, json.dumps({"type": "takeback_declined", "player_id": requester}))
+        return False
+
+    if len(game.moves) != int(move_count):
+        raise HTTPException(status_code=409, detail="The position changed since the takeback was requested")
+
+    delta = game.undo_move()
+    if delta is None:
+        raise HTTPException(status_code=400, detail="There is no move to take back")
+    game.moves.pop()
+
+    game.version += 1
+    last_move = game.moves[-1]["index"] if game.moves else None
+    drop_checkpoint(pipe, game_id, len(game.moves) + 1)
+    publish_update(
+        pipe,
+        game_id,
+        json.dumps({
+            "type": "takeback",
+            "player_id": requester,
+            "delta": {
+                "index": delta["index"],
+                "color": delta["color"],
+                "captured": delta["captured"]
+            },
+            "current_turn": game.current_turn.value,
+            "captured_black": game.captured_black,
+            "captured_white": game.captured_white,
+            "last_move_index": last_move,
+            "legal": game.legal_moves_encoded(),
+            "version": game.version
+        })
+    )
+    return True
+
+############################
+### Player Color Utility ###
+############################
+
+def get_player_color(game_id: str, player_id: str) -> int | None:
+    """
+    Look up a seated player's color from the small `players:{<id>}` hash
+    without fetching or decoding the full game document.
+    """
+    color = redis_client.hget(players_key(game_id), player_id)
+    storage.record("player_color")
+    if color is not None:
+        return int(color)
+
+    # Games seated before the hash existed: read once and backfill
+    raw = redis_client.get(game_key(game_id))
+    if not raw:
+        return None
+    players = json.loads(raw).get("players", {})
+    if players:
+        redis_client.hset(players_key(game_id), mapping=players)
+    return players.get(player_id)
+
+##############################
+### Remove Game From Redis ###
+##############################
+
+def delete_game_keys(game_id: str, redis_client):
+    """Delete a game document along with every per-game side key."""
+    delete_game(redis_client, game_id)
+    storage.record("delete_game", commands=1)
+    game_cache.discard(game_id)
 
 ###########################
 ### Remove Game From DB ###
 ###########################
-async def remove_public_game(game_id: str):
-    async with async_session() as session:
-        await session.execute(
-            delete(PublicGame).where(PublicGame.id == game_id)
-        )
-        await session.commit()
+def remove_public_game(game_id: str):
+    # Batched with other lobby writes by this worker's write-behind queue
+    lobby_writer.queue_delete(game_id)
 
 ########################
 ### Handicap Utility ###
 ########################
 def place_handicap_stones(game):
+    placements = game.geometry.handicap_points(game.handicap_stones)
+    if not placements:
+        return  # Fewer than 2 stones, or a board too small for handicap points
 
-    star_points_by_size = {
-        9: [(2, 6), (6, 2), (2, 2), (6, 6), (2, 4), (6, 4), (4, 2), (4, 6), (4, 4)],  # Corrected
-        13: [(3, 9), (9, 3), (3, 3), (9, 9), (3, 6), (9, 6), (6, 3), (6, 9), (6, 6)],
-        19: [(3, 15), (15, 3), (3, 3), (15, 15), (3, 9), (15, 9), (9, 3), (9, 15), (9, 9)]
-    }
-
-    size = game.board_size
-    if size not in star_points_by_size:
-        return  # Unknown board size, do nothing
-
-    # Correct order of stone placement based on number of stones
-    order_for_stones = [
-        [0, 1],                      # 2 stones
-        [0, 1, 2],                   # 3 stones
-        [0, 1, 2, 3],                # 4 stones
-        [0, 1, 2, 3, 8],             # 5 stones (center added)
-        [0, 1, 2, 3, 4, 5],          # 6 stones (left middle and right middle)
-        [0, 1, 2, 3, 4, 5, 8],       # 7 stones (6 plus center)
-        [0, 1, 2, 3, 4, 5, 6, 7],    # 8 stones (6 plus top middle and bottom middle)
-        [0, 1, 2, 3, 4, 5, 6, 7, 8], # 9 stones (all star points)
-    ]
-
-    num_stones = min(game.handicap_stones, 9)
-
-    if num_stones < 2:
-        return  # Handicap usually starts at 2 stones minimum
-
-    selected_indices = order_for_stones[num_stones - 2]  # 2 stones => index 0
-
-    star_points = star_points_by_size[size]
-
-    game.handicap_placements = []
-
-    for idx in selected_indices:
-        x, y = star_points[idx]
-        index = y * size + x  # (row * board_size + column)
+    game.handicap_placements = list(placements)
+    for index in placements:
         game.board_state[index] = Stone.BLACK.value
-        game.handicap_placements.append(index)
 
     # After placing handicap stones, it becomes White's turn
     game.current_turn = Stone.WHITE
+    game.reset_legal_moves()
 
 ###############################
 ### Rank Conversion Utility ###
@@ -190,6 +334,8 @@ for i in range(1, 10):
 for i in range(1, 10):
     RANK_TO_NUMBER[f"{i}p"] = 38 + i  # 1p -> 39, 2p -> 40, ..., 9p -> 47
 
-def rank_to_number(rank: str) -> int:
+def rank_to_number(rank: str) -> int | None:
+    if not isinstance(rank, str):
+        return None
     rank = rank.strip().lower()
     return RANK_TO_NUMBER.get(rank)
\ No newline at end of file
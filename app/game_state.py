@@ -1,7 +1,10 @@
 from enum import Enum
-import copy
+import base64
 import time
 
+from geometry import geometry
+from wire_format import pack_moves, unpack_moves
+
 class Stone(Enum):
     EMPTY = 0
     BLACK = 1
@@ -11,10 +14,11 @@ class GameState:
     def __init__(self, board_size: int, time_control="none", komi=6.5, rule_set="japanese"):
         self.game_type = "private"
         self.board_size = board_size
+        self.geometry = geometry(board_size)  # shared per-size tables, never serialized
         self.players = {}
         self.board_state = [Stone.EMPTY.value] * (board_size * board_size)  # 1D board
-        self.previous_state = copy.deepcopy(self.board_state)
-        self.two_moves_ago_state = copy.deepcopy(self.board_state)
+        self.ko_point = None  # point the side to move may not play (simple ko)
+        self.move_deltas = []  # one reversible delta per move, see make_move
         self.current_turn = Stone.BLACK
         self.consecutive_passes = 0 
         self.captured_black = 0
@@ -49,6 +53,14 @@ class GameState:
         self.handicap_placements = []
         self.estimated_ranks = {}
         self.created_at = time.time()
+        self.version = 0  # bumped on every persisted change
+        self.bot = None  # settings for games against the built-in bot, see bot.new_bot
+        # Legal points for the side to move as a bitmask (bit i = board index i),
+        # kept current by make_move/undo_move; see reset_legal_moves
+        self.empty_points = 0
+        self.surrounded = set()  # empty points with no empty neighbour, the only suicide candidates
+        self.legal = 0
+        self.reset_legal_moves()
 
     def set_colors_randomized(self, randomized: bool):
         self.colors_randomized = bool(randomized)
@@ -114,14 +126,29 @@ class GameState:
         self.game_over = True
         self.game_over_reason = "scored"
 
-    def check_capture(self, index: int, color: Stone):
+    def check_capture(self, index: int, color: Stone) -> list:
         opponent = Stone.BLACK if color == Stone.WHITE else Stone.WHITE
+        captured = []
 
         for neighbor in self.get_adjacent_indices(index):
             if self.board_state[neighbor] == opponent.value:
                 group = set()
                 if self.count_liberties(neighbor, group, opponent) == 0:
                     self.remove_group(group)
+                    captured.extend(group)
+
+        return sorted(captured)
+
+    def find_ko_point(self, index: int, color: Stone, captured: list):
+        # A lone stone that captured exactly one stone and now sits in atari
+        # on that point: immediate recapture would repeat the position
+        if len(captured) != 1:
+            return None
+        if any(self.board_state[n] == color.value for n in self.get_adjacent_indices(index)):
+            return None
+        if self.count_liberties(index, set(), color) != 1:
+            return None
+        return captured[0]
 
     def remove_group(self, group: set):
         for index in group:
@@ -150,21 +177,126 @@ class GameState:
             # Find the resigning player's ID from the color
             resigned_player = next((pid for pid, c in self.players.items() if c == color.value), None)
             self.end_game(reason="resign", resigned_player=resigned_player)
+            self.legal = 0
             return  # Exit early; no further moves after resignation
 
+        # Everything needed to reverse this move without a board snapshot
+        delta = {
+            "index": index,
+            "color": color.value,
+            "captured": [],
+            "ko_point": self.ko_point,
+            "passes": self.consecutive_passes
+        }
+
         if index == -1:
             self.consecutive_passes += 1
+            self.ko_point = None
         else:
-            self.two_moves_ago_state = copy.deepcopy(self.previous_state)
-            self.previous_state = copy.deepcopy(self.board_state)
             self.board_state[index] = color.value
-            self.check_capture(index, color)
+            delta["captured"] = self.check_capture(index, color)
+            self.ko_point = self.find_ko_point(index, color, delta["captured"])
             self.consecutive_passes = 0
 
+        self.move_deltas.append(delta)
+
         if self.consecutive_passes >= 2:
             self.end_game(reason="double_pass")
 
         self.current_turn = Stone.BLACK if color == Stone.WHITE else Stone.WHITE
+        self._update_legal_moves(index, delta["captured"])
+
+    def undo_move(self):
+        """
+        Reverse the last move in O(captures) using its recorded delta.
+        Returns the delta that was undone, or None if there is nothing to undo.
+        """
+        if not self.move_deltas or self.game_over:
+            return None
+
+        delta = self.move_deltas.pop()
+        index = delta["index"]
+        color = Stone(delta["color"])
+        opponent = Stone.BLACK if color == Stone.WHITE else Stone.WHITE
+
+        if index >= 0:
+            self.board_state[index] = Stone.EMPTY.value
+            for point in delta["captured"]:
+                self.board_state[point] = opponent.value
+            if opponent == Stone.BLACK:
+                self.captured_black -= len(delta["captured"])
+            else:
+                self.captured_white -= len(delta["captured"])
+
+        self.ko_point = delta["ko_point"]
+        self.consecutive_passes = delta["passes"]
+        self.current_turn = color
+        self._update_legal_moves(index, delta["captured"])
+        return delta
+
+    def reset_legal_moves(self):
+        """
+        Rebuild the legal-move mask from the whole board. Needed only after
+        the board or the side to move is set directly (loading, handicap
+        stones, replay positions); moves keep it current on their own.
+        """
+        self.empty_points = 0
+        for index, stone in enumerate(self.board_state):
+            if stone == Stone.EMPTY.value:
+                self.empty_points |= 1 << index
+        self.surrounded = {
+            index for index in range(len(self.board_state))
+            if self._is_surrounded(index)
+        }
+        self._refresh_legal()
+
+    def _is_surrounded(self, index: int) -> bool:
+        if self.board_state[index] != Stone.EMPTY.value:
+            return False
+        return all(self.board_state[n] != Stone.EMPTY.value for n in self.get_adjacent_indices(index))
+
+    def _update_legal_moves(self, index: int, changed: list):
+        """
+        A move (or its undo) only changes the played point and the captured
+        stones, so only those points and their neighbours can enter or leave
+        the empty and surrounded sets.
+        """
+        if index >= 0:
+            affected = {index, *self.get_adjacent_indices(index)}
+            for point in (index, *changed):
+                if self.board_state[point] == Stone.EMPTY.value:
+                    self.empty_points |= 1 << point
+                else:
+                    self.empty_points &= ~(1 << point)
+            for point in changed:
+                affected.add(point)
+                affected.update(self.get_adjacent_indices(point))
+            for point in affected:
+                if self._is_surrounded(point):
+                    self.surrounded.add(point)
+                else:
+                    self.surrounded.discard(point)
+        self._refresh_legal()
+
+    def _refresh_legal(self):
+        # Every empty point is legal except the ko point and suicides, and a
+        # suicide needs all four neighbours occupied
+        legal = self.empty_points
+        if self.ko_point is not None:
+            legal &= ~(1 << self.ko_point)
+        for point in self.surrounded:
+            if self.is_suicidal(point, self.current_turn):
+                legal &= ~(1 << point)
+        self.legal = legal
+
+    def legal_moves(self) -> int:
+        """Bitmask of the points the side to move may play; none once the game is over."""
+        return 0 if self.game_over else self.legal
+
+    def legal_moves_encoded(self) -> str:
+        """The mask as base64 of little-endian bytes: bit i of byte i // 8 is point i."""
+        points = self.board_size * self.board_size
+        return base64.b64encode(self.legal_moves().to_bytes((points + 7) // 8, "little")).decode()
 
 
     def is_valid_move(self, index: int, color: Stone) -> bool:
@@ -178,10 +310,12 @@ class GameState:
             return False
         if index == -1:  # Passing move
             return True
+        if self.is_in_bounds(index) and self.legal >> index & 1:
+            return True
         if self.is_in_bounds(index):
             if self.is_unoccupied(index):
                 if not self.is_suicidal(index, color):
-                    if not self.check_ko():
+                    if not self.check_ko(index):
                         return True
                     else:
                         print("Illegal move: Ko rule")
@@ -199,10 +333,8 @@ class GameState:
     def is_unoccupied(self, index: int) -> bool:
         return self.board_state[index] == Stone.EMPTY.value
 
-    def check_ko(self) -> bool:
-        if all(stone == Stone.EMPTY.value for stone in self.board_state):
-            return False  # No stones = no Ko rule
-        return self.board_state == self.two_moves_ago_state
+    def check_ko(self, index: int) -> bool:
+        return index == self.ko_point
 
     def is_suicidal(self, index: int, color: Stone) -> bool:
         visited = set()
@@ -305,19 +437,8 @@ class GameState:
         return Stone.EMPTY, 0  # Neutral territory
 
 
-    def get_adjacent_indices(self, index: int) -> list:
-        directions = [-self.board_size, self.board_size, -1, 1]
-        neighbors = []
-
-        for dir in directions:
-            neighbor = index + dir
-            if self.is_in_bounds(neighbor):
-                # Prevent wrap-around on the left/right edges
-                if abs((index % self.board_size) - (neighbor % self.board_size)) > 1:
-                    continue
-                neighbors.append(neighbor)
-
-        return neighbors
+    def get_adjacent_indices(self, index: int) -> tuple:
+        return self.geometry.neighbors[index]
 
     def to_dict(self):
         return {
@@ -325,8 +446,7 @@ class GameState:
             "board_size": self.board_size,
             "players": self.players,
             "board_state": self.board_state,
-            "previous_state": self.previous_state,
-            "two_moves_ago_state": self.two_moves_ago_state,
+            "ko_point": self.ko_point,
             "current_turn": self.current_turn.value,
             "consecutive_passes": self.consecutive_passes,
             "game_over": self.game_over,
@@ -358,17 +478,95 @@ class GameState:
             "handicap_stones": self.handicap_stones,
             "handicap_placements": self.handicap_placements,
             "estimated_ranks": self.estimated_ranks,
-            "created_at": self.created_at
+            "created_at": self.created_at,
+            "version": self.version,
+            "bot": self.bot,
+            "legal": self.legal_moves_encoded()
+        }
+
+    def to_record(self) -> dict:
+        """
+        The immutable result record a finished game is compacted into: final
+        board, captures and result, with the moves packed and no deltas,
+        timestamps or scoring-phase scratch state.
+        """
+        return {
+            "compact": True,
+            "game_type": self.game_type,
+            "board_size": self.board_size,
+            "players": self.players,
+            "board_state": self.board_state,
+            "current_turn": self.current_turn.value,
+            "game_over": True,
+            "in_scoring_phase": False,
+            "game_over_reason": self.game_over_reason,
+            "resigned_player": self.resigned_player,
+            "winner": self.winner,
+            "final_score": self.final_score,
+            "captured_black": self.captured_black,
+            "captured_white": self.captured_white,
+            "agreed_dead": self.agreed_dead,
+            "excluded_points": self.excluded_points,
+            "moves_packed": pack_moves(self.moves),
+            "rule_set": self.rule_set,
+            "komi": self.komi,
+            "time_control": self.time_control,
+            "time_left": self.time_left,
+            "periods_left": self.periods_left,
+            "byo_yomi_periods": self.byo_yomi_periods,
+            "byo_yomi_time": self.byo_yomi_time,
+            "byo_yomi_time_left": self.byo_yomi_time_left,
+            "handicap_stones": self.handicap_stones,
+            "handicap_placements": self.handicap_placements,
+            "created_by": self.created_by,
+            "created_at": self.created_at,
+            "version": self.version,
+            "bot": self.bot
         }
 
+    @staticmethod
+    def from_record(data):
+        game = GameState(data["board_size"], time_control=data["time_control"],
+                         komi=data["komi"], rule_set=data["rule_set"])
+        game.game_type = data["game_type"]
+        game.players = data["players"]
+        game.board_state = data["board_state"]
+        game.current_turn = Stone(data["current_turn"])
+        game.game_over = True
+        game.game_over_reason = data["game_over_reason"]
+        game.resigned_player = data["resigned_player"]
+        game.winner = data["winner"]
+        game.final_score = data["final_score"]
+        game.captured_black = data["captured_black"]
+        game.captured_white = data["captured_white"]
+        game.agreed_dead = data["agreed_dead"]
+        game.excluded_points = data["excluded_points"]
+        game.dead_black = game.dead_white = [d["index"] for d in game.agreed_dead] + game.excluded_points
+        game.moves = unpack_moves(data["moves_packed"])
+        game.time_left = data["time_left"]
+        game.periods_left = data["periods_left"]
+        game.byo_yomi_periods = data["byo_yomi_periods"]
+        game.byo_yomi_time = data["byo_yomi_time"]
+        game.byo_yomi_time_left = data["byo_yomi_time_left"]
+        game.handicap_stones = data["handicap_stones"]
+        game.handicap_placements = data["handicap_placements"]
+        game.created_by = data["created_by"]
+        game.created_at = data["created_at"]
+        game.version = data["version"]
+        game.bot = data["bot"]
+        game.reset_legal_moves()
+        return game
+
     @staticmethod
     def from_dict(data):
+        if data.get("compact"):
+            return GameState.from_record(data)
         game = GameState(data["board_size"])
         game.game_type = data.get("game_type", "private")
         game.players = data["players"]
         game.board_state = data["board_state"]
-        game.previous_state = data["previous_state"]
-        game.two_moves_ago_state = data["two_moves_ago_state"]
+        game.ko_point = data.get("ko_point")
+        game.move_deltas = data.get("undo_deltas", data.get("move_deltas", []))
         game.current_turn = Stone(data["current_turn"])
         game.consecutive_passes = data["consecutive_passes"]
         game.game_over = data["game_over"]
@@ -400,4 +598,7 @@ class GameState:
         game.handicap_placements = data.get("handicap_placements", [])
         game.estimated_ranks = data.get("estimated_ranks", {})
         game.created_at = data.get("created_at") or time.time()
+        game.version = data.get("version", 0)
+        game.bot = data.get("bot")
+        game.reset_legal_moves()
         return game
\ No newline at end of file
@@ -0,0 +1,116 @@
+from functools import lru_cache
+
+MIN_BOARD_SIZE = 5
+MAX_BOARD_SIZE = 25
+
+# Handicap stones in placement order, as star point names; a layout for
+# n stones uses the first entry of HANDICAP_ORDER with n points
+HANDICAP_ORDER = [
+    ["lower_left", "upper_right"],
+    ["lower_left", "upper_right", "upper_left"],
+    ["lower_left", "upper_right", "upper_left", "lower_right"],
+    ["lower_left", "upper_right", "upper_left", "lower_right", "center"],
+    ["lower_left", "upper_right", "upper_left", "lower_right", "left", "right"],
+    ["lower_left", "upper_right", "upper_left", "lower_right", "left", "right", "center"],
+    ["lower_left", "upper_right", "upper_left", "lower_right", "left", "right", "top", "bottom"],
+    ["lower_left", "upper_right", "upper_left", "lower_right", "left", "right", "top", "bottom", "center"],
+]
+
+
+def is_valid_size(size: int) -> bool:
+    return isinstance(size, int) and MIN_BOARD_SIZE <= size <= MAX_BOARD_SIZE
+
+
+class Geometry:
+    """
+    Everything about a board that depends only on its size, computed once
+    per size and shared by every game of that size. Indices use the same
+    1D row-major layout as GameState.board_state.
+    """
+
+    __slots__ = ("size", "points", "neighbors", "star_points", "handicap_layouts",
+                 "max_handicap", "sgf_coords", "sgf_index")
+
+    def __init__(self, size: int):
+        self.size = size
+        self.points = size * size
+
+        neighbors = []
+        for index in range(self.points):
+            x, y = index % size, index // size
+            adjacent = []
+            if y > 0:
+                adjacent.append(index - size)
+            if y < size - 1:
+                adjacent.append(index + size)
+            if x > 0:
+                adjacent.append(index - 1)
+            if x < size - 1:
+                adjacent.append(index + 1)
+            neighbors.append(tuple(adjacent))
+        self.neighbors = tuple(neighbors)
+
+        named = self._named_star_points()
+        self.star_points = tuple(sorted(named.values()))
+        self.handicap_layouts = {
+            len(order): tuple(named[name] for name in order)
+            for order in HANDICAP_ORDER
+            if all(name in named for name in order)
+        }
+        self.max_handicap = max(self.handicap_layouts, default=0)
+
+        letters = "abcdefghijklmnopqrstuvwxyz"
+        self.sgf_coords = tuple(
+            letters[i % size] + letters[i // size] for i in range(self.points)
+        ) if size <= len(letters) else ()
+        self.sgf_index = {coord: i for i, coord in enumerate(self.sgf_coords)}
+
+    def _named_star_points(self) -> dict:
+        """
+        Corner points on the 4th line from 13x13 up and the 3rd line from
+        7x7; side points on odd boards from 9x9; the centre on odd boards.
+        """
+        size = self.size
+        point = lambda x, y: y * size + x
+        named = {}
+
+        edge = 3 if size >= 13 else 2 if size >= 7 else None
+        mid = size // 2 if size % 2 else None
+        if edge is not None:
+            far = size - 1 - edge
+            named.update({
+                "lower_left": point(edge, far),
+                "upper_right": point(far, edge),
+                "upper_left": point(edge, edge),
+                "lower_right": point(far, far)
+            })
+            if mid is not None and size >= 9:
+                named.update({
+                    "left": point(edge, mid),
+                    "right": point(far, mid),
+                    "top": point(mid, edge),
+                    "bottom": point(mid, far)
+                })
+        if mid is not None:
+            named["center"] = point(mid, mid)
+        return named
+
+    def handicap_points(self, stones: int) -> tuple:
+        """Placement for `stones` handicap stones, capped at what the board offers."""
+        stones = min(stones, self.max_handicap)
+        while stones >= 2 and stones not in self.handicap_layouts:
+            stones -= 1
+        return self.handicap_layouts.get(stones, ())
+
+    def to_sgf(self, index: int) -> str:
+        """Board index -> SGF point; a pass is the empty value."""
+        return self.sgf_coords[index] if 0 <= index < self.points else ""
+
+    def from_sgf(self, value: str) -> int:
+        """SGF point -> board index; empty, "tt" on boards up to 19x19, or off-board is a pass."""
+        return self.sgf_index.get(value, -1)
+
+
+@lru_cache(maxsize=None)
+def geometry(size: int) -> Geometry:
+    return Geometry(size)
@@ -0,0 +1,166 @@
+import asyncio
+import datetime
+import os
+import time
+
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert
+
+from db import async_session
+from models import PublicGame
+import storage
+from redis_client import redis_client
+from storage import game_key, players_key
+
+# Flush when this many mutations are pending, or after the interval, whichever comes first
+LOBBY_BATCH_SIZE = int(os.getenv("LOBBY_BATCH_SIZE", 200))
+LOBBY_FLUSH_INTERVAL_SECS = float(os.getenv("LOBBY_FLUSH_INTERVAL_SECS", 0.25))
+
+
+class LobbyWriter:
+    """
+    Per-worker write-behind queue for the public game list. Inserts and
+    deletes are collected in memory and written as one multi-row INSERT
+    and one DELETE ... WHERE id IN (...) per flush, in a single session.
+    """
+
+    def __init__(self, batch_size: int = LOBBY_BATCH_SIZE, flush_interval: float = LOBBY_FLUSH_INTERVAL_SECS):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending_inserts = {}  # game_id -> row
+        self.pending_deletes = set()
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+        self.flushes = 0
+        self.failures = 0
+        self.rows_inserted = 0
+        self.rows_deleted = 0
+        self.skipped_inserts = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    @property
+    def depth(self) -> int:
+        return len(self.pending_inserts) + len(self.pending_deletes)
+
+    def queue_insert(self, game_id: str, **columns):
+        columns.setdefault("created_at", datetime.datetime.utcnow())
+        self.pending_deletes.discard(game_id)
+        self.pending_inserts[game_id] = {"id": game_id, **columns}
+        self._kick()
+
+    def queue_delete(self, game_id: str):
+        # A row that was never written only needs to be forgotten
+        if self.pending_inserts.pop(game_id, None) is None:
+            self.pending_deletes.add(game_id)
+        self._kick()
+
+    def _kick(self):
+        if self.depth >= self.batch_size:
+            self.wakeup.set()
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+    def _still_open(self, game_ids: list) -> set:
+        """
+        Games that still exist with a free seat. Another worker may have
+        seated the second player (and queued its delete) before our insert
+        went out; those rows would otherwise linger in the lobby.
+        """
+        with redis_client.pipeline(transaction=False) as pipe:
+            for game_id in game_ids:
+                pipe.exists(game_key(game_id))
+                pipe.hlen(players_key(game_id))
+            results = storage.execute(pipe, "lobby_open_check")
+        return {
+            game_id
+            for game_id, exists, seated in zip(game_ids, results[::2], results[1::2])
+            if exists and seated < 2
+        }
+
+    async def flush(self):
+        if not self.depth:
+            return
+
+        inserts, self.pending_inserts = self.pending_inserts, {}
+        deletes, self.pending_deletes = self.pending_deletes, set()
+
+        started = time.perf_counter()
+        try:
+            rows = list(inserts.values())
+            if rows:
+                open_ids = self._still_open(list(inserts))
+                self.skipped_inserts += len(rows) - len(open_ids)
+                rows = [row for row in rows if row["id"] in open_ids]
+
+            async with async_session() as session:
+                if rows:
+                    await session.execute(
+                        insert(PublicGame).values(rows).on_conflict_do_nothing(index_elements=["id"])
+                    )
+                if deletes:
+                    await session.execute(
+                        delete(PublicGame).where(PublicGame.id.in_(deletes))
+                    )
+                await session.commit()
+
+            self.rows_inserted += len(rows)
+            self.rows_deleted += len(deletes)
+        except Exception as e:
+            # Put the batch back for the next flush; newer mutations win
+            print(f"Lobby flush failed ({len(inserts)} inserts, {len(deletes)} deletes): {e}")
+            self.failures += 1
+            for game_id, row in inserts.items():
+                if game_id not in self.pending_deletes:
+                    self.pending_inserts.setdefault(game_id, row)
+            self.pending_deletes |= {g for g in deletes if g not in self.pending_inserts}
+            return
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+
+        self.flushes += 1
+        self.total_flush_ms += elapsed_ms
+
+    async def stop(self):
+        """Stop the flush loop and drain whatever is still queued."""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.depth,
+            "pending_inserts": len(self.pending_inserts),
+            "pending_deletes": len(self.pending_deletes),
+            "flushes": self.flushes,
+            "failures": self.failures,
+            "rows_inserted": self.rows_inserted,
+            "rows_deleted": self.rows_deleted,
+            "skipped_inserts": self.skipped_inserts,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "max_flush_ms": round(self.max_flush_ms, 2),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 2) if self.flushes else 0.0
+        }
+
+
+lobby_writer = LobbyWriter()
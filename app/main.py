@@ -1,7 +1,7 @@
 from fastapi import FastAPI, Request, HTTPException, WebSocket, WebSocketDisconnect, Query, Depends
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response
 from pathlib import Path
 from pydantic import BaseModel
 import traceback
@@ -11,11 +11,30 @@ import uuid
 import redis
 import json
 from game_state import GameState, Stone
-from game_helper import do_join, remove_public_game
-from timers import record_disconnect_time, clear_disconnect_time, clear_all_disconnects, start_timer_for_game, start_join_timeout_for_game, join_timeout_tasks
-from better_profanity import profanity
+from geometry import MIN_BOARD_SIZE, MAX_BOARD_SIZE
+from game_helper import remove_public_game, get_player_color, validate_game_settings
+from timers import clear_all_disconnects, mark_player_disconnected, start_timer_for_game, schedule_join_timeout, run_deadline_worker, timer_tasks
+from presence import touch_presence, touch_presences, HEARTBEAT_INTERVAL_SECS, PRESENCE_TTL_SECS
+from chat import TokenBucket, post_chat_message, get_chat_history
+from send_queue import SocketSender, TaggedSender
+from broadcast import broadcaster
+from wire_format import FORMAT_JSON, FORMAT_BINARY, encode_game_state
+from replay import get_position
+from game_cache import load_game, load_result, save_game
+from game_actor import game_actors
+from scoring import queue_scoring_marks, scoring_marks
+import storage
+from storage import game_key, publish_update
+import automatch
+from ops import count_games_created, run_ops_reporter, remove_worker_report
+from bot import (
+    BOT_DEFAULT_PLAYOUTS, BOT_MIN_PLAYOUTS, BOT_MAX_PLAYOUTS,
+    BOT_DEFAULT_TIME_BUDGET_SECS, BOT_MAX_TIME_BUDGET_SECS,
+    new_bot, is_bot_turn, pick_bot_move, shutdown_bot_pool
+)
 from db import async_session
 from models import PublicGame, SiteSettings
+from lobby_writer import lobby_writer
 from redis_client import redis_client
 from typing import Optional
 from sqlalchemy import func
@@ -34,8 +53,6 @@ templates.env.globals["url_for"] = app.url_path_for
 from admin_settings import router as admin_router
 app.include_router(admin_router)
 
-profanity.load_censor_words()
-
 class CreateGameRequest(BaseModel):
     board_size: int
 
@@ -50,6 +67,29 @@ async def start_sweeper():
             stale_threshold_secs=86400
         )
     )
+    print("Starting deadline worker...")
+    asyncio.create_task(run_deadline_worker(redis_client))
+    print("Starting lobby writer...")
+    lobby_writer.start()
+    print("Starting ops reporter...")
+    asyncio.create_task(run_ops_reporter(redis_client, broadcaster, timer_tasks))
+
+@app.on_event("shutdown")
+async def stop_bot_pool():
+    shutdown_bot_pool()
+
+@app.on_event("shutdown")
+async def drain_lobby_writer():
+    await lobby_writer.stop()
+
+@app.on_event("shutdown")
+async def drop_ops_report():
+    remove_worker_report(redis_client)
+
+@app.on_event("shutdown")
+async def release_game_actors():
+    # Other workers take over this worker's games without waiting out the leases
+    game_actors.close()
 
 ### GET SETTINGS ENDPOINT ###
 @app.get("/settings")
@@ -84,17 +124,15 @@ def about_page(request: Request):
 
 @app.get("/game/{game_id}")
 def get_game(request: Request, game_id: str):
-    game_data = redis_client.get(f"game:{game_id}")
-    if not game_data:
+    if load_game(game_id, redis_client, fresh=False) is None:
         raise HTTPException(status_code=404, detail="Game not found")
 
     return templates.TemplateResponse("game.html", {"request": request, "game_id": game_id})
 
 @app.get("/spectate/{game_id}")
 async def spectate_page(request: Request, game_id: str):
-    # verify the game still exists in Redis
-    game_data = redis_client.get(f"game:{game_id}")
-    if not game_data:
+    # verify the game still exists
+    if load_game(game_id, redis_client, fresh=False) is None:
         raise HTTPException(status_code=404, detail="Game not found or has ended")
     
     # render the spectate template, passing just the game_id
@@ -121,32 +159,22 @@ async def create_game(request: Request):
         byo_yomi_time = int(data.get("byo_yomi_time", 0))
         game_type = data.get("game_type", "private")
         creator_rank = data.get("creator_rank", None)
+        bot_playouts = int(data.get("bot_playouts", BOT_DEFAULT_PLAYOUTS))
+        bot_time_budget = float(data.get("bot_time_budget", BOT_DEFAULT_TIME_BUDGET_SECS))
 
-        if board_size not in [9, 13, 19]:
-            raise HTTPException(status_code=400, detail="Invalid board size")
-
-        if rule_set not in ["japanese", "chinese"]:
-            raise HTTPException(status_code=400, detail="Invalid rule set")
-
-        valid_times = {"none", "300", "600", "900", "1800", "3600", "7200", "15"}
-        if time_control not in valid_times:
-            raise HTTPException(status_code=400, detail="Invalid time control setting")
-
-        if komi < 0.5 or komi > 50:
-            raise HTTPException(status_code=400, detail="Invalid komi value")
-
-        if color_preference not in ["random", "black", "white"]:
-            raise HTTPException(status_code=400, detail="Invalid color preference")
-
-        if byo_yomi_periods not in [0, 1, 2, 3, 4, 5]:
-            raise HTTPException(status_code=400, detail="Invalid byo-yomi periods")
+        validate_game_settings(board_size, rule_set, time_control, komi,
+                               color_preference, byo_yomi_periods, byo_yomi_time)
 
-        if byo_yomi_time < 0 or byo_yomi_time > 60 or byo_yomi_time % 5 != 0:
-            raise HTTPException(status_code=400, detail="Invalid byo-yomi time")
-
-        if game_type not in ["private", "public"]:
+        if game_type not in ["private", "public", "bot"]:
             raise HTTPException(status_code=400, detail="Invalid game type")
 
+        if game_type == "bot":
+            if not BOT_MIN_PLAYOUTS <= bot_playouts <= BOT_MAX_PLAYOUTS:
+                raise HTTPException(status_code=400, detail="Invalid bot strength")
+            if not 0.5 <= bot_time_budget <= BOT_MAX_TIME_BUDGET_SECS:
+                raise HTTPException(status_code=400, detail="Invalid bot time budget")
+            allow_handicaps = False
+
         # Assign or reuse player_id
         player_id = incoming_player_id or str(uuid.uuid4())[:8]
 
@@ -162,34 +190,40 @@ async def create_game(request: Request):
         game.set_allow_handicaps(allow_handicaps)
         game.byo_yomi_periods = byo_yomi_periods
         game.byo_yomi_time = byo_yomi_time
+        if game_type == "bot":
+            game.bot = new_bot(bot_playouts, bot_time_budget)
+
+        # Store game in Redis and queue the join timeout on the shared deadline queue
+        with redis_client.pipeline(transaction=False) as pipe:
+            save_game(pipe, game_id, game)
+            schedule_join_timeout(game_id, pipe, timeout_seconds=600)
+            count_games_created(pipe)
+            storage.execute(pipe, "create_game")
 
-        # Store game in Redis
-        redis_client.set(f"game:{game_id}", json.dumps(game.to_dict()))
-        # Start join timer coroutine
-        start_join_timeout_for_game(game_id, redis_client, timeout_seconds=600)
 
+        if game_type == "bot":
+            # Seat the creator and the bot straight away; the bot opens if it drew Black
+            await submit_join(game_id, player_id)
+            await submit_join(game_id, game.bot["player_id"])
 
         if game_type == "public":
             if allow_handicaps and not creator_rank:
                 raise HTTPException(status_code=400, detail="Estimated rank is required for handicap games")
 
-            do_join(game_id, player_id, creator_rank)
-
-            async with async_session() as session:
-                new_game = PublicGame(
-                    id=game_id,
-                    board_size=board_size,
-                    created_by=player_id,
-                    rule_set=rule_set,
-                    komi=komi,
-                    time_control=time_control,
-                    byo_yomi_periods=byo_yomi_periods,
-                    byo_yomi_time=byo_yomi_time,
-                    color_preference=color_preference,
-                    allow_handicaps=allow_handicaps
-                )
-                session.add(new_game)
-                await session.commit()
+            await submit_join(game_id, player_id, creator_rank)
+
+            lobby_writer.queue_insert(
+                game_id,
+                board_size=board_size,
+                created_by=player_id,
+                rule_set=rule_set,
+                komi=komi,
+                time_control=time_control,
+                byo_yomi_periods=byo_yomi_periods,
+                byo_yomi_time=byo_yomi_time,
+                color_preference=color_preference,
+                allow_handicaps=allow_handicaps
+            )
 
         return {
             "game_id": game_id,
@@ -208,21 +242,46 @@ async def create_game(request: Request):
 @app.post("/game/{game_id}/join")
 async def join_game(game_id: str, request: Request):
     data = await request.json()
-    player_id = do_join(
+    result = await submit_join(
         game_id,
         incoming_player_id=data.get("player_id"),
         estimated_rank=data.get("estimated_rank")
     )
-    raw = redis_client.get(f"game:{game_id}")
-    game = GameState.from_dict(json.loads(raw))
-    if len(game.players) == 2:
-        asyncio.create_task(remove_public_game(game_id))
-    return {"message": "Joined successfully", "player_id": player_id}
+    if result["full"]:
+        remove_public_game(game_id)
+    return {"message": "Joined successfully", "player_id": result["player_id"]}
+
+
+@app.post("/automatch")
+async def automatch_enqueue(request: Request):
+    data = await request.json()
+    try:
+        board_size = int(data.get("board_size", 19))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid board size format")
+    return automatch.enqueue(
+        data.get("player_id") or str(uuid.uuid4())[:8],
+        board_size,
+        data.get("time_control", "none"),
+        data.get("rule_set", "japanese"),
+        data.get("estimated_rank")
+    )
+
+
+@app.get("/automatch/{player_id}")
+async def automatch_status(player_id: str):
+    return automatch.poll(player_id)
+
+
+@app.delete("/automatch/{player_id}")
+async def automatch_cancel(player_id: str):
+    automatch.cancel(player_id)
+    return {"message": "Left the automatch queue"}
 
 
 @app.get("/games/public")
 async def list_public_games(
-    board_size: Optional[int]      = Query(None, description="9, 13, or 19"),
+    board_size: Optional[int]      = Query(None, description=f"{MIN_BOARD_SIZE} to {MAX_BOARD_SIZE}"),
     time_control: Optional[str]    = Query(None, description="seconds or 'none'"),
     allow_handicaps: Optional[bool]= Query(None),
     byo_yomi_periods: Optional[int]= Query(None, description="0–5"),
@@ -283,69 +342,62 @@ async def list_public_games(
         ],
     }
 
+async def submit_move(game_id: str, player_id: str, index: int) -> dict:
+    """
+    Shared by the HTTP and WebSocket move paths. The game's actor applies
+    the move, on this worker or the one owning the game; returns its result.
+    """
+    result = await game_actors.submit(game_id, {"type": "move", "player_id": player_id, "index": index})
+
+    #Handle game over; the owner starts the bot itself when it is its turn
+    if result["game_over"]:
+        clear_all_disconnects(game_id, redis_client)
+
+    return result
+
+async def submit_join(game_id: str, incoming_player_id: str | None = None,
+                      estimated_rank: str | None = None) -> dict:
+    """
+    Seat a player (a new one without `incoming_player_id`) through the
+    game's actor. The result carries the final player_id and whether the
+    game is now full. Raises HTTPException on any error (404, full game,
+    missing rank, etc.).
+    """
+    return await game_actors.submit(game_id, {
+        "type": "join",
+        "player_id": incoming_player_id or str(uuid.uuid4())[:8],
+        "estimated_rank": estimated_rank
+    })
+
+async def play_bot_turn(game_id: str):
+    """Let the bot answer through the same move path as a human player."""
+    try:
+        game = load_game(game_id, redis_client)
+        if game is None or not is_bot_turn(game):
+            return
+
+        index = await pick_bot_move(game)
+        await submit_move(game_id, game.bot["player_id"], index)
+    except HTTPException as e:
+        # The game moved on while the bot was thinking (resignation, timeout...)
+        print(f"Bot move rejected in game {game_id}: {e.detail}")
+    except Exception as e:
+        print(f"Bot error in game {game_id}: {e}")
+        traceback.print_exc()
+
+# Whichever worker owns a bot game plays the bot's turns
+game_actors.play_bot = play_bot_turn
+
 @app.post("/game/{game_id}/move")
 async def make_move(game_id: str, request: Request):
     try:
         data = await request.json()
-        player_id = data.get("player_id")
-        index = data.get("index")
-
-        # Validate request
-        if not player_id or index is None:
-            raise HTTPException(status_code=400, detail="Missing player_id or index")
-
-        # Fetch game from Redis
-        game_data = redis_client.get(f"game:{game_id}")
-        if not game_data:
-            raise HTTPException(status_code=404, detail="Game not found")
-
-        game = GameState.from_dict(json.loads(game_data))
-
-        # Validate player
-        if player_id not in game.players:
-            raise HTTPException(status_code=403, detail="You are not part of this game")
-
-        # Validate both players are connected
-        if index != -2:
-            if len(game.players) < 2:
-                raise HTTPException(status_code=400, detail="Waiting for the second player to join")
-
-        # Determine player's color and check turn
-        player_color = Stone(game.players[player_id])
-        if player_color != game.current_turn:
-            raise HTTPException(status_code=400, detail="Not your turn")
-
-        # Attempt to make the move
-        if game.is_valid_move(index, player_color):
-            game.make_move(index, player_color)
-            game.moves.append({
-                "index": index,
-                "color": player_color.value,
-                "timestamp": time.time()
-            })
-            #Reset byo-yomi if needed
-            if game.byo_yomi_periods > 0:
-                game.byo_yomi_time_left[player_id] = game.byo_yomi_time
-        else:
-            raise HTTPException(status_code=400, detail="Invalid move")
-
-        with redis_client.pipeline() as pipe:
-            pipe.set(f"game:{game_id}", json.dumps(game.to_dict()))
-            pipe.publish(
-                f"game_updates:{game_id}",
-                json.dumps({
-                    "type": "game_state",
-                    "payload": game.to_dict()
-                })
-            )
-            pipe.execute()  # Execute both commands atomically
-
-        #Handle game over
-        if game.game_over:
-            clear_all_disconnects(game_id, redis_client)
-
+        await submit_move(game_id, data.get("player_id"), data.get("index"))
         return {"message": "Move successful"}
 
+    except HTTPException:
+        raise
+
     except Exception as e:
         print(f"Error in /move: {e}")
         traceback.print_exc()  # Show full stack trace
@@ -353,191 +405,366 @@ async def make_move(game_id: str, request: Request):
 
 @app.get("/game/{game_id}/state")
 async def get_game_state(game_id: str):
-    game_data = redis_client.get(f"game:{game_id}")
-    if not game_data:
+    # Finished games are served as their cached result record, without re-encoding
+    record = load_result(game_id, redis_client)
+    if record is not None:
+        return Response(content=record, media_type="application/json")
+
+    game = load_game(game_id, redis_client, fresh=False)
+    if game is None:
         raise HTTPException(status_code=404, detail="Game not found")
 
-    game = GameState.from_dict(json.loads(game_data))
     return game.to_dict()
 
+@app.get("/game/{game_id}/legal")
+async def get_legal_moves(game_id: str):
+    """
+    Points the side to move may play. `legal` is base64 of little-endian
+    bytes, bit i of byte i // 8 set when index i is legal; passing is always legal.
+    """
+    game = load_game(game_id, redis_client, fresh=False)
+    if game is None:
+        raise HTTPException(status_code=404, detail="Game not found")
+
+    return {
+        "version": game.version,
+        "current_turn": game.current_turn.value,
+        "legal": game.legal_moves_encoded(),
+        "count": game.legal_moves().bit_count()
+    }
+
+@app.get("/game/{game_id}/position")
+async def get_game_position(game_id: str, move: int = Query(...)):
+    return get_position(game_id, move)
+
 ###################################################
 ### Websocket endpoint and connection functions ###
 ###################################################
 
-def add_active_connection(game_id: str, player_id: str):
-    redis_client.sadd(f"ws_connections:{game_id}", player_id)
+# Store process-local connected players
+local_sockets = {}  # Key: (game_id, player_id), Value: websocket instance
 
-def remove_active_connection(game_id: str, player_id: str):
-    redis_client.srem(f"ws_connections:{game_id}", player_id)
+# Games one multiplexed socket may follow at once
+MULTI_MAX_SUBSCRIPTIONS = 200
 
-def get_active_connections(game_id: str) -> set:
-    return redis_client.smembers(f"ws_connections:{game_id}")
 
-# Store process-local connected players
-local_sockets = {}  # Key: (game_id, player_id), Value: websocket instance
+def announce_reconnect(game_id: str, player_id: str) -> tuple:
+    """
+    Publish a player's reconnect notice and read the stored game and any
+    scoring marks in one round trip. Returns the raw document (None if
+    gone) and the scoring_marks message (None outside scoring).
+    """
+    with redis_client.pipeline(transaction=False) as pipe:
+        publish_update(
+            pipe,
+            game_id,
+            json.dumps({"type": "reconnect_notice", "player_id": player_id})
+        )
+        pipe.get(game_key(game_id))
+        queue_scoring_marks(pipe, game_id)
+        _, raw, *marks = storage.execute(pipe, "ws_connect")
+    return raw, scoring_marks(*marks)
+
+
+@app.websocket("/ws/multi")
+async def multi_websocket_endpoint(websocket: WebSocket, player_id: str = Query(None)):
+    """
+    Follow many games over one socket. Client messages carry a game_id:
+      {"type": "subscribe", "game_id": ..., "role": "player" | "spectator"}
+      {"type": "unsubscribe", "game_id": ...}
+      {"type": "move", "game_id": ..., "index": ..., "request_id": ...}
+      {"type": "seek", "game_id": ..., "move": ...}
+    and every server message arrives as {"game_id": ..., "message": {...}},
+    except the socket-wide ping and errors about a message itself.
+    Playing needs `player_id` on the URL; the socket then gets player
+    priority and queue limits, otherwise it is a spectator socket.
+    """
+    await websocket.accept()
+    sender = SocketSender(websocket, is_spectator=(player_id is None))
+    sender.start()
+    print(f"Multiplexed WebSocket connected for player {player_id}")
+
+    subscriptions = {}  # game_id -> TaggedSender
+    playing = set()     # subscribed game_ids where player_id is seated
+
+    def reject(detail: str, game_id: str | None = None, **extra):
+        sender.enqueue(json.dumps({"type": "error", "game_id": game_id, "detail": detail, **extra}), "error")
+
+    def subscribe(game_id: str, as_player: bool):
+        if game_id in subscriptions:
+            return reject("Already subscribed", game_id)
+        if len(subscriptions) >= MULTI_MAX_SUBSCRIPTIONS:
+            return reject("Too many subscriptions", game_id)
+        if as_player and (player_id is None or get_player_color(game_id, player_id) is None):
+            return reject("You are not part of this game", game_id)
+
+        if as_player:
+            start_timer_for_game(game_id, redis_client)
+            touch_presence(game_id, player_id, redis_client)
+            raw, marks = announce_reconnect(game_id, player_id)
+        else:
+            raw, marks = redis_client.get(game_key(game_id)), None
+        if raw is None:
+            return reject("Game not found", game_id)
+
+        channel = TaggedSender(sender, game_id, is_spectator=not as_player)
+        channel.enqueue(storage.state_message(raw), "game_state")
+        if marks:
+            channel.enqueue(json.dumps(marks), "scoring_marks")
+        subscriptions[game_id] = channel
+        if as_player:
+            playing.add(game_id)
+        broadcaster.subscribe(game_id, channel)
+
+    def unsubscribe(game_id: str):
+        channel = subscriptions.pop(game_id, None)
+        if channel is None:
+            return
+        broadcaster.unsubscribe(game_id, channel)
+        if game_id in playing:
+            playing.discard(game_id)
+            mark_player_disconnected(game_id, player_id, redis_client)
+
+    last_seen = time.time()
+
+    async def heartbeat():
+        # One ping for the whole socket; a pong refreshes presence in every game played
+        try:
+            while True:
+                await asyncio.sleep(HEARTBEAT_INTERVAL_SECS)
+                if time.time() - last_seen > PRESENCE_TTL_SECS:
+                    print(f"Heartbeat timeout for multiplexed socket of player {player_id}")
+                    sender.close(code=1001, reason="Heartbeat timeout")
+                    break
+                sender.enqueue(json.dumps({"type": "ping"}), "ping")
+        except Exception as err:
+            print("Heartbeat error:", err)
+
+    heartbeat_task = asyncio.create_task(heartbeat())
+
+    try:
+        while True:
+            raw = await websocket.receive_text()
+            last_seen = time.time()
+            message = json.loads(raw)
+            kind = message.get("type")
+            game_id = message.get("game_id")
+
+            if kind == "pong":
+                if playing:
+                    for resumed in touch_presences(list(playing), player_id, redis_client):
+                        publish_update(
+                            redis_client,
+                            resumed,
+                            json.dumps({"type": "reconnect_notice", "player_id": player_id})
+                        )
+                continue
+
+            if not isinstance(game_id, str) or not game_id:
+                reject("Missing game_id")
+                continue
+
+            if kind == "subscribe":
+                subscribe(game_id, as_player=(message.get("role", "spectator") == "player"))
+
+            elif kind == "unsubscribe":
+                unsubscribe(game_id)
+
+            elif kind == "seek":
+                channel = subscriptions.get(game_id)
+                if channel is None:
+                    reject("Not subscribed", game_id)
+                    continue
+                try:
+                    position = get_position(game_id, message.get("move"))
+                    channel.enqueue(json.dumps({"type": "position", **position}), "position")
+                except HTTPException as e:
+                    channel.enqueue(json.dumps({"type": "seek_rejected", "detail": e.detail}), "seek_rejected")
+
+            elif kind == "move":
+                channel = subscriptions.get(game_id)
+                request_id = message.get("request_id")
+                if game_id not in playing:
+                    reject("Not subscribed as a player", game_id, request_id=request_id)
+                    continue
+                try:
+                    result = await submit_move(game_id, player_id, message.get("index"))
+                    channel.enqueue(json.dumps({
+                        "type": "move_ack",
+                        "request_id": request_id,
+                        "version": result["version"]
+                    }), "move_ack")
+                except HTTPException as e:
+                    channel.enqueue(json.dumps({
+                        "type": "move_rejected",
+                        "request_id": request_id,
+                        "detail": e.detail
+                    }), "move_rejected")
+
+            else:
+                reject(f"Unknown message type {kind}", game_id)
+
+    except WebSocketDisconnect:
+        print(f"Multiplexed WebSocket disconnected for player {player_id}")
+    finally:
+        for game_id in list(subscriptions):
+            unsubscribe(game_id)
+        heartbeat_task.cancel()
+        try:
+            await heartbeat_task
+        except asyncio.CancelledError:
+            pass
+        await sender.stop()
+
 
 @app.websocket("/ws/{game_id}")
 async def websocket_endpoint(
     websocket: WebSocket,
     game_id: str,
     player_id: str = Query(None),
-    role: str      = Query("player")
+    role: str      = Query("player"),
+    wire_format: str = Query(FORMAT_JSON, alias="format")
 ):
     is_spectator = (role == "spectator")
+    binary = (wire_format == FORMAT_BINARY)
     connection_id = str(uuid.uuid4())
 
     #Make sure the game exists in redis
-    if not redis_client.exists(f"game:{game_id}"):
+    if not redis_client.exists(game_key(game_id)):
         await websocket.close(code=1008, reason="Game not found")
         return
 
     await websocket.accept()
     print(f"WebSocket connected for game {game_id} by player {player_id} role={role}")
 
-    # Only real players start timers, clear disconnects, publish reconnect notices, and join active set
+    # All outgoing traffic goes through a bounded per-socket queue
+    sender = SocketSender(websocket, is_spectator, binary=binary)
+    sender.start()
+
+    # Only real players start timers, refresh presence (which clears disconnects) and publish reconnect notices
     if not is_spectator:
         start_timer_for_game(game_id, redis_client)
-        clear_disconnect_time(game_id, player_id, redis_client)
-        redis_client.publish(
-            f"game_updates:{game_id}",
-            json.dumps({"type": "reconnect_notice", "player_id": player_id})
-        )
-        # Send current game state to the reconnecting player
-        raw = redis_client.get(f"game:{game_id}")
-        if raw:
-            await websocket.send_text(
-                json.dumps({
-                    "type":    "game_state",
-                    "payload": json.loads(raw)
-                })
-            )
-
-        add_active_connection(game_id, player_id)
+        touch_presence(game_id, player_id, redis_client)
+        raw, marks = announce_reconnect(game_id, player_id)
+        if raw and binary:
+            sender.enqueue(encode_game_state(json.loads(storage.public_document(raw))), "game_state")
+        elif raw:
+            # Wrap the stored document as-is instead of decoding and re-encoding it
+            sender.enqueue(storage.state_message(raw), "game_state")
+        if marks:
+            sender.enqueue(json.dumps(marks), "scoring_marks")
+
+    # Backfill recent chat for late joiners and reconnects in one read
+    history = get_chat_history(game_id, redis_client)
+    if history:
+        sender.enqueue(json.dumps({"type": "chat_history", "messages": history}), "chat_history")
+
+    chat_bucket = TokenBucket()
 
     # Register connection for broadcast (players & spectators)
     local_sockets[(game_id, player_id)] = websocket
 
-    # Subscribe to Redis pub/sub channel
-    pubsub = redis_client.pubsub()
-    pubsub.subscribe(f"game_updates:{game_id}")
-    print(f"Listening for Redis updates for game {game_id}")
+    # Share this worker's pub/sub connection; payloads are forwarded verbatim
+    broadcaster.subscribe(game_id, sender)
 
-    async def redis_listener():
+    last_seen = time.time()
+
+    async def heartbeat():
+        # Application-level ping; a client that stops answering is dropped
+        # even if the socket never raised a clean disconnect
         try:
             while True:
-                msg = pubsub.get_message(ignore_subscribe_messages=True)
-                if msg:
-                    data = json.loads(msg["data"])
-                    await websocket.send_text(json.dumps(data))
-                await asyncio.sleep(0.1)
+                await asyncio.sleep(HEARTBEAT_INTERVAL_SECS)
+                if time.time() - last_seen > PRESENCE_TTL_SECS:
+                    print(f"Heartbeat timeout for game {game_id} player {player_id} role={role}")
+                    if not is_spectator:
+                        mark_player_disconnected(game_id, player_id, redis_client)
+                    sender.close(code=1001, reason="Heartbeat timeout")
+                    break
+                sender.enqueue(json.dumps({"type": "ping"}), "ping")
         except Exception as err:
-            print("Redis listener error:", err)
-        finally:
-            pubsub.close()
+            print("Heartbeat error:", err)
 
-    listener_task = asyncio.create_task(redis_listener())
+    heartbeat_task = asyncio.create_task(heartbeat())
 
     try:
         while True:
-            if not is_spectator:
-                raw = await websocket.receive_text()
-                message = json.loads(raw)
-
-                if message["type"] == "toggle_dead_stone":
-                    group = message.get("group", [])
-                    pid   = message.get("player_id")
-                    game_data = redis_client.get(f"game:{game_id}")
-                    if not game_data:
-                        continue
-
-                    game = GameState.from_dict(json.loads(game_data))
-                    color = game.players.get(pid)
-                    dead_list = set(getattr(game, "dead_black" if color == Stone.BLACK.value else "dead_white", []))
-                    group_set = set(group)
-                    if group_set.issubset(dead_list):
-                        dead_list -= group_set
-                    else:
-                        dead_list |= group_set
-                    if color == Stone.BLACK.value:
-                        game.dead_black = list(dead_list)
-                    else:
-                        game.dead_white = list(dead_list)
-
-                    redis_client.set(f"game:{game_id}", json.dumps(game.to_dict()))
-                    payload = {
-                        "type": "toggle_dead_stone",
-                        "index": list(group_set),
-                        "player_id": pid,
-                        "payload": game.to_dict()
-                    }
-                    redis_client.publish(f"game_updates:{game_id}", json.dumps(payload))
-
-                elif message["type"] == "finalize_score":
-                    pid = message.get("player_id")
-                    game_data = redis_client.get(f"game:{game_id}")
-                    if not game_data:
-                        continue
+            raw = await websocket.receive_text()
+            last_seen = time.time()
+            message = json.loads(raw)
+
+            if message["type"] == "pong":
+                if not is_spectator and touch_presence(game_id, player_id, redis_client):
+                    # Heartbeats resumed after the player was marked disconnected
+                    publish_update(
+                        redis_client,
+                        game_id,
+                        json.dumps({"type": "reconnect_notice", "player_id": player_id})
+                    )
+                continue
+
+            if message["type"] == "seek":
+                # Review any earlier position without rebuilding it client-side
+                try:
+                    position = get_position(game_id, message.get("move"))
+                    sender.enqueue(json.dumps({"type": "position", **position}), "position")
+                except HTTPException as e:
+                    sender.enqueue(json.dumps({
+                        "type": "seek_rejected",
+                        "detail": e.detail
+                    }), "seek_rejected")
+                continue
 
-                    game = GameState.from_dict(json.loads(game_data))
-                    if not hasattr(game, "finalized_players"):
-                        game.finalized_players = []
-
-                    if pid not in game.finalized_players:
-                        game.finalized_players.append(pid)
-                        print(f"Player {pid} finalized their score in game {game_id}")
-
-                    # Check if both players finalized and selections match
-                    if (
-                        set(game.dead_black or []) == set(game.dead_white or []) and
-                        len(game.finalized_players) == 2
-                    ):
-                        agreed = set(game.dead_black or [])
-
-                        removed_stones = []
-                        excluded_points = []
-                        for idx in agreed:
-                            color = game.board_state[idx]
-                            if color in (Stone.BLACK.value, Stone.WHITE.value):
-                                removed_stones.append((idx, color))
-                                game.board_state[idx] = Stone.EMPTY.value
-                            elif color == Stone.EMPTY.value:
-                                excluded_points.append(idx)
-                            if color == Stone.BLACK.value:
-                                game.captured_white += 1
-                            elif color == Stone.WHITE.value:
-                                game.captured_black += 1
-
-                        game.agreed_dead = [
-                            {"index": idx, "color": color}
-                            for idx, color in removed_stones
-                        ]
-                        game.excluded_points = excluded_points
-
-                        rule_set = getattr(game, "rule_set", "japanese").lower()
-                        if rule_set == "japanese":
-                            game.final_score = game.score_game(excluded=excluded_points)
+            if not is_spectator:
+                if message["type"] == "move":
+                    # Same validation as POST /game/{id}/move, answered on this socket
+                    request_id = message.get("request_id")
+                    try:
+                        result = await submit_move(game_id, player_id, message.get("index"))
+                        sender.enqueue(json.dumps({
+                            "type": "move_ack",
+                            "request_id": request_id,
+                            "version": result["version"]
+                        }), "move_ack")
+                    except HTTPException as e:
+                        sender.enqueue(json.dumps({
+                            "type": "move_rejected",
+                            "request_id": request_id,
+                            "detail": e.detail
+                        }), "move_rejected")
+
+                elif message["type"] in ("takeback_request", "takeback_accept", "takeback_decline"):
+                    try:
+                        if message["type"] == "takeback_request":
+                            await game_actors.submit(game_id, {"type": "takeback_request", "player_id": player_id})
                         else:
-                            game.final_score = game.score_game()
-
-                        game.game_over = True
-                        game.in_scoring_phase = False
-                        game.game_over_reason = "double_pass"
-
-                        black_score, white_score = game.final_score
-                        if black_score != white_score:
-                            winner_color = Stone.BLACK if black_score > white_score else Stone.WHITE
-                            for pid_, stone in game.players.items():
-                                if stone == winner_color.value:
-                                    game.winner = pid_
-                                    break
+                            await game_actors.submit(game_id, {
+                                "type": "takeback",
+                                "player_id": player_id,
+                                "accept": message["type"] == "takeback_accept"
+                            })
+                    except HTTPException as e:
+                        sender.enqueue(json.dumps({
+                            "type": "takeback_rejected",
+                            "detail": e.detail
+                        }), "takeback_rejected")
+
+                elif message["type"] in ("toggle_dead_stone", "finalize_score"):
+                    # Marks live in per-player sets; the server expands the clicked point itself
+                    try:
+                        if message["type"] == "toggle_dead_stone":
+                            await game_actors.submit(game_id, {
+                                "type": "toggle_dead",
+                                "player_id": player_id,
+                                "index": message.get("index")
+                            })
                         else:
-                            game.winner = None
-
-                    redis_client.set(f"game:{game_id}", json.dumps(game.to_dict()))
-                    redis_client.publish(
-                        f"game_updates:{game_id}",
-                        json.dumps({"type": "game_state", "payload": game.to_dict()})
-                    )
+                            await game_actors.submit(game_id, {"type": "finalize", "player_id": player_id})
+                    except HTTPException as e:
+                        sender.enqueue(json.dumps({
+                            "type": "scoring_rejected",
+                            "detail": e.detail
+                        }), "scoring_rejected")
 
                 elif message["type"] == "chat":
                     pid  = message.get("player_id")
@@ -545,77 +772,30 @@ async def websocket_endpoint(
                     if not text:
                         continue
 
-                    game_data = redis_client.get(f"game:{game_id}")
-                    if not game_data:
+                    if not chat_bucket.consume():
+                        sender.enqueue(json.dumps({
+                            "type": "chat_rate_limited",
+                            "retry_after": round(chat_bucket.retry_after(), 1)
+                        }), "chat_rate_limited")
                         continue
 
-                    game = GameState.from_dict(json.loads(game_data))
-                    color = game.players.get(pid)
-                    sender = "Black" if color == Stone.BLACK.value else "White"
-                    censored = profanity.censor(text)
-
-                    redis_client.publish(
-                        f"game_updates:{game_id}",
-                        json.dumps({
-                            "type": "chat",
-                            "sender": sender,
-                            "text": censored,
-                            "source": connection_id
-                        })
-                    )
-            else:
-                await asyncio.sleep(1)
+                    color = get_player_color(game_id, pid)
+                    if color is None:
+                        continue
+                    sender_name = "Black" if color == Stone.BLACK.value else "White"
+                    post_chat_message(game_id, sender_name, text, connection_id, redis_client)
 
     except WebSocketDisconnect:
         print(f"WebSocket disconnected for game {game_id} player {player_id} role={role}")
         local_sockets.pop((game_id, player_id), None)
 
         if not is_spectator:
-            remove_active_connection(game_id, player_id)
-            record_disconnect_time(game_id, player_id, redis_client)
-            redis_client.publish(
-                f"game_updates:{game_id}",
-                json.dumps({
-                    "type": "disconnect_notice",
-                    "disconnected_player": player_id,
-                    "timestamp": time.time(),
-                    "timeout_seconds": 60
-                })
-            )
+            mark_player_disconnected(game_id, player_id, redis_client)
     finally:
-        listener_task.cancel()
+        broadcaster.unsubscribe(game_id, sender)
+        heartbeat_task.cancel()
         try:
-            await listener_task
+            await heartbeat_task
         except asyncio.CancelledError:
             pass
-
-### DEBUG ROUTES ###
-@app.get("/debug/redis")
-def debug_redis_state():
-    keys = redis_client.keys("*")
-    redis_snapshot = {}
-
-    for key in keys:
-        key_type = redis_client.type(key)
-
-        if key_type == "string":
-            redis_snapshot[key] = redis_client.get(key)
-
-        elif key_type == "hash":
-            redis_snapshot[key] = redis_client.hgetall(key)
-
-        elif key_type == "list":
-            redis_snapshot[key] = redis_client.lrange(key, 0, -1)
-
-        elif key_type == "set":
-            redis_snapshot[key] = list(redis_client.smembers(key))
-
-        elif key_type == "zset":
-            redis_snapshot[key] = redis_client.zrange(key, 0, -1, withscores=True)
-
-        else:
-            redis_snapshot[key] = f"<Unsupported type: {key_type}>"
-
-    redis_snapshot["join_timeout_tasks"] = list(join_timeout_tasks.keys())
-
-    return JSONResponse(content=redis_snapshot)
+        await sender.stop()
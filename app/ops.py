@@ -0,0 +1,328 @@
+import asyncio
+import json
+import os
+import socket
+import time
+
+from redis.cluster import RedisCluster
+
+import storage
+from deadlines import DEADLINES_KEY
+from storage import (
+    OPS_COUNTERS_KEY, OPS_WORKERS_KEY, game_key, version_key, game_side_keys, key_family, legacy_key
+)
+
+# How often each worker publishes its live numbers; reports older than
+# three intervals belong to a dead worker and are dropped on read
+OPS_REPORT_INTERVAL_SECS = 5
+# Local games whose keys are measured with MEMORY USAGE per report
+OPS_MEMORY_SAMPLE = 20
+
+# Page size bounds for the key inspector
+INSPECT_DEFAULT_COUNT = 100
+INSPECT_MAX_COUNT = 1000
+# Elements returned when reading a single key
+INSPECT_MAX_ELEMENTS = 200
+INSPECT_MAX_STRING = 65536
+
+ACTIVE_GAMES = "active_games"
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Version tokens of finished games, compacted into result records, end in this
+FINISHED_TOKEN_SUFFIX = ".final"
+
+# KEYS[1] game document, KEYS[2] version token, KEYS[3..] other side
+# keys, all on the game's slot. Returns 1 only when a live document was
+# removed, so deleting the same game twice (sweeper and cleanup racing)
+# uncounts it once, and a result record, already uncounted when the game
+# finished, not at all. The counter itself lives on another slot and is
+# moved by the caller.
+DELETE_GAME_SCRIPT = """
+local token = redis.call('GET', KEYS[2])
+local finished = token and string.sub(token, -#ARGV[1]) == ARGV[1]
+local deleted = redis.call('DEL', KEYS[1])
+redis.call('DEL', unpack(KEYS, 2))
+if deleted == 1 and not finished then
+    return 1
+end
+return 0
+"""
+
+SIZE_COMMANDS = {
+    "string": "STRLEN",
+    "hash": "HLEN",
+    "list": "LLEN",
+    "set": "SCARD",
+    "zset": "ZCARD",
+    "stream": "XLEN"
+}
+
+#####################
+### Game counters ###
+#####################
+
+def count_games_created(target, count: int = 1):
+    """Queue on the same client or pipeline that stores the new game(s)."""
+    target.hincrby(OPS_COUNTERS_KEY, ACTIVE_GAMES, count)
+
+
+def delete_game(redis_client, game_id: str):
+    delete_script = redis_client.register_script(DELETE_GAME_SCRIPT)
+    if delete_script(keys=game_side_keys(game_id), args=[FINISHED_TOKEN_SUFFIX]):
+        redis_client.hincrby(OPS_COUNTERS_KEY, ACTIVE_GAMES, -1)
+
+
+def finish_game(target, game_id: str, token: str, ttl_secs: int, was_live: bool = True):
+    """
+    Queue on the pipeline that writes a game's result record; `token` must
+    end in FINISHED_TOKEN_SUFFIX. Pass was_live=False when re-saving a game
+    already known to be finished so it is not uncounted twice.
+    """
+    target.set(version_key(game_id), token, ex=ttl_secs)
+    if was_live:
+        target.hincrby(OPS_COUNTERS_KEY, ACTIVE_GAMES, -1)
+
+
+def recount_games(redis_client) -> int:
+    """
+    Reset the active game counter from a full SCAN, leaving out result
+    records of finished games; an explicit admin action only.
+    """
+    keys = list(redis_client.scan_iter(match=game_key("*"), count=1000))
+    with redis_client.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.get(version_key(storage.game_id_from_key(key)))
+        tokens = storage.execute(pipe, "ops_recount")
+    total = sum(1 for token in tokens if not (token and token.endswith(FINISHED_TOKEN_SUFFIX)))
+    redis_client.hset(OPS_COUNTERS_KEY, ACTIVE_GAMES, total)
+    return total
+
+
+def migrate_legacy_keys(redis_client) -> int:
+    """
+    Rename per-game keys written before hash tags (`game:<id>`) to their
+    tagged names (`game:{<id>}`). Run once on the single node before moving
+    to a cluster, where a cross-slot RENAME is refused. Presence keys
+    expire within seconds and are left alone. Returns the keys renamed.
+    """
+    game_ids = set()
+    for family in {key_family(key) for key in game_side_keys("*")}:
+        for key in redis_client.scan_iter(match=f"{family}:*", count=1000):
+            if "{" not in key:
+                game_ids.add(storage.game_id_from_key(key))
+    if not game_ids:
+        return 0
+
+    pairs = [(legacy_key(key), key) for game_id in game_ids for key in game_side_keys(game_id)]
+    with redis_client.pipeline(transaction=False) as pipe:
+        for old, _ in pairs:
+            pipe.exists(old)
+        found = storage.execute(pipe, "ops_migrate_keys")
+    with redis_client.pipeline(transaction=False) as pipe:
+        for (old, new), exists in zip(pairs, found):
+            if exists:
+                pipe.rename(old, new)
+        renamed = len(storage.execute(pipe, "ops_migrate_keys", new_call=False))
+    print(f"Migrated {renamed} legacy keys of {len(game_ids)} games to hash-tagged names")
+    return renamed
+
+######################
+### Worker reports ###
+######################
+
+def sample_memory(redis_client, game_ids: list) -> dict:
+    """Average bytes per game for each key family, over a few known games."""
+    game_ids = game_ids[:OPS_MEMORY_SAMPLE]
+    if not game_ids:
+        return {"games": 0, "bytes_per_game": {}}
+
+    keys = [key for game_id in game_ids for key in game_side_keys(game_id)]
+    with redis_client.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.memory_usage(key)
+        usages = storage.execute(pipe, "ops_memory_sample")
+
+    per_family = {}
+    for key, usage in zip(keys, usages):
+        if usage:
+            family = key_family(key)
+            per_family[family] = per_family.get(family, 0) + usage
+    return {
+        "games": len(game_ids),
+        "bytes_per_game": {family: total / len(game_ids) for family, total in per_family.items()}
+    }
+
+
+def worker_report(redis_client, broadcaster, timer_tasks: dict) -> dict:
+    local_games = set(broadcaster.players) | set(broadcaster.spectators)
+    try:
+        memory = sample_memory(redis_client, list(local_games))
+    except Exception as e:
+        # MEMORY USAGE may be disabled (e.g. renamed on managed Redis)
+        print(f"Ops memory sample failed: {e}")
+        memory = {"games": 0, "bytes_per_game": {}}
+    return {
+        "worker": WORKER_ID,
+        "updated_at": time.time(),
+        "games": len(local_games),
+        "players": sum(len(s) for s in broadcaster.players.values()),
+        "spectators": sum(len(s) for s in broadcaster.spectators.values()),
+        "timer_tasks": len(timer_tasks),
+        "memory": memory
+    }
+
+
+async def run_ops_reporter(redis_client, broadcaster, timer_tasks: dict,
+                           interval_secs: float = OPS_REPORT_INTERVAL_SECS):
+    while True:
+        try:
+            report = worker_report(redis_client, broadcaster, timer_tasks)
+            redis_client.hset(OPS_WORKERS_KEY, WORKER_ID, json.dumps(report))
+        except Exception as e:
+            print(f"Ops report error: {e}")
+        await asyncio.sleep(interval_secs)
+
+
+def remove_worker_report(redis_client):
+    redis_client.hdel(OPS_WORKERS_KEY, WORKER_ID)
+
+
+def ops_snapshot(redis_client) -> dict:
+    """Everything the live ops panel shows, from counters and worker reports only."""
+    with redis_client.pipeline(transaction=False) as pipe:
+        pipe.hgetall(OPS_COUNTERS_KEY)
+        pipe.hgetall(OPS_WORKERS_KEY)
+        pipe.zcard(DEADLINES_KEY)
+        pipe.info("memory")
+        counters, raw_reports, pending_deadlines, memory_info = storage.execute(pipe, "ops_snapshot")
+
+    now = time.time()
+    workers, stale = [], []
+    for worker_id, raw in raw_reports.items():
+        report = json.loads(raw)
+        if now - report["updated_at"] > 3 * OPS_REPORT_INTERVAL_SECS:
+            stale.append(worker_id)
+        else:
+            workers.append(report)
+    if stale:
+        redis_client.hdel(OPS_WORKERS_KEY, *stale)
+
+    active_games = max(0, int(counters.get(ACTIVE_GAMES, 0)))
+
+    # Weighted average of every worker's sample, scaled to all active games
+    sampled_games = sum(w["memory"]["games"] for w in workers)
+    family_bytes = {}
+    for w in workers:
+        for family, per_game in w["memory"]["bytes_per_game"].items():
+            family_bytes[family] = family_bytes.get(family, 0) + per_game * w["memory"]["games"]
+    memory_by_family = {
+        family: round(total / sampled_games * active_games)
+        for family, total in family_bytes.items()
+    } if sampled_games else {}
+
+    return {
+        "active_games": active_games,
+        "pending_deadlines": pending_deadlines,
+        "players": sum(w["players"] for w in workers),
+        "spectators": sum(w["spectators"] for w in workers),
+        "workers": sorted(workers, key=lambda w: w["worker"]),
+        "memory": {
+            "used_bytes": memory_info.get("used_memory"),
+            "used_human": memory_info.get("used_memory_human"),
+            "estimated_by_family": memory_by_family,
+            "sampled_games": sampled_games
+        }
+    }
+
+######################
+### Key inspector ###
+######################
+
+def _glob_escape(prefix: str) -> str:
+    return "".join("\\" + c if c in "*?[]\\" else c for c in prefix)
+
+
+def _scan_page(redis_client, cursor: str, match: str, count: int) -> tuple:
+    """
+    One SCAN call. A cluster has a keyspace (and cursor) per primary, so
+    they are scanned one after another in name order and the cursor is
+    "<node name>:<node cursor>"; a node gone since the last page is skipped.
+    """
+    if not isinstance(redis_client, RedisCluster):
+        next_cursor, keys = redis_client.scan(cursor=int(cursor), match=match, count=count)
+        return str(next_cursor), keys
+
+    name, node_cursor = cursor.rsplit(":", 1) if cursor != "0" else ("", "0")
+    nodes = sorted((n for n in redis_client.get_primaries() if n.name >= name), key=lambda n: n.name)
+    if not nodes:
+        return "0", []
+    node = nodes[0]
+    if node.name != name:
+        node_cursor = "0"
+    cursors, keys = redis_client.scan(cursor=int(node_cursor), match=match, count=count, target_nodes=node)
+    next_cursor = cursors[node.name]
+    if next_cursor:
+        return f"{node.name}:{next_cursor}", keys
+    # This node is done; the next page starts on the following one
+    return (f"{nodes[1].name}:0" if len(nodes) > 1 else "0"), keys
+
+
+def scan_keys(redis_client, prefix: str = "", cursor: str = "0", count: int = INSPECT_DEFAULT_COUNT) -> dict:
+    """
+    One SCAN step over keys starting with `prefix`, with type, size and TTL
+    of each key found. SCAN may return fewer (or no) keys than asked for
+    while the cursor is not "0"; the listing is complete once it is.
+    """
+    count = max(1, min(count, INSPECT_MAX_COUNT))
+    next_cursor, keys = _scan_page(redis_client, cursor, _glob_escape(prefix) + "*", count)
+
+    with redis_client.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.type(key)
+            pipe.ttl(key)
+        meta = storage.execute(pipe, "inspect_scan")
+    types, ttls = meta[::2], meta[1::2]
+
+    with redis_client.pipeline(transaction=False) as pipe:
+        for key, key_type in zip(keys, types):
+            command = SIZE_COMMANDS.get(key_type)
+            if command:
+                pipe.execute_command(command, key)
+        sizes = iter(storage.execute(pipe, "inspect_scan", new_call=False))
+
+    return {
+        "cursor": next_cursor,
+        "keys": [
+            {
+                "key": key,
+                "type": key_type,
+                "size": next(sizes) if key_type in SIZE_COMMANDS else None,
+                "ttl": ttl
+            }
+            for key, key_type, ttl in zip(keys, types, ttls)
+        ]
+    }
+
+
+def read_key(redis_client, key: str) -> dict | None:
+    """A bounded view of one key's value."""
+    key_type = redis_client.type(key)
+    limit = INSPECT_MAX_ELEMENTS
+    if key_type == "none":
+        return None
+    if key_type == "string":
+        value = redis_client.getrange(key, 0, INSPECT_MAX_STRING - 1)
+    elif key_type == "hash":
+        _, value = redis_client.hscan(key, count=limit)
+    elif key_type == "list":
+        value = redis_client.lrange(key, 0, limit - 1)
+    elif key_type == "set":
+        _, value = redis_client.sscan(key, count=limit)
+    elif key_type == "zset":
+        value = redis_client.zrange(key, 0, limit - 1, withscores=True)
+    elif key_type == "stream":
+        value = redis_client.xrevrange(key, count=limit)
+    else:
+        value = f"<Unsupported type: {key_type}>"
+    return {"key": key, "type": key_type, "ttl": redis_client.ttl(key), "value": value}
@@ -0,0 +1,46 @@
+import storage
+from clock import Clock, system_clock
+from deadlines import PRESENCE_LOST, DISCONNECT_FORFEIT, deadline_member, DEADLINES_KEY
+from storage import presence_key, disconnect_key
+
+# Server pings every socket this often; clients answer with a pong
+HEARTBEAT_INTERVAL_SECS = 5
+# A player whose presence key outlives this many seconds without a refresh
+# is treated as disconnected, even if the socket never closed cleanly
+PRESENCE_TTL_SECS = 15
+
+
+def touch_presence(game_id: str, player_id: str, redis_client, clock: Clock = system_clock) -> bool:
+    """
+    Refresh a player's presence key and push back their presence deadline.
+    Returns True if the player had been marked disconnected, i.e. this
+    heartbeat is a reconnect.
+    """
+    return bool(touch_presences([game_id], player_id, redis_client, clock))
+
+
+def touch_presences(game_ids: list, player_id: str, redis_client, clock: Clock = system_clock) -> list:
+    """
+    touch_presence for one player in several games, in one round trip.
+    Returns the games in which this heartbeat is a reconnect.
+    """
+    now = clock.time()
+    pipe = redis_client.pipeline(transaction=False)
+    for game_id in game_ids:
+        pipe.set(presence_key(game_id, player_id), now, ex=PRESENCE_TTL_SECS)
+        pipe.zadd(DEADLINES_KEY, {deadline_member(PRESENCE_LOST, game_id, player_id): now + PRESENCE_TTL_SECS})
+        pipe.hdel(disconnect_key(game_id), player_id)
+        pipe.zrem(DEADLINES_KEY, deadline_member(DISCONNECT_FORFEIT, game_id, player_id))
+    results = storage.execute(pipe, "presence_touch")
+    return [game_id for game_id, was_disconnected in zip(game_ids, results[2::4]) if was_disconnected]
+
+
+def clear_presence(game_id: str, player_id: str, redis_client):
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.delete(presence_key(game_id, player_id))
+    pipe.zrem(DEADLINES_KEY, deadline_member(PRESENCE_LOST, game_id, player_id))
+    storage.execute(pipe, "presence_clear")
+
+
+def is_present(game_id: str, player_id: str, redis_client) -> bool:
+    return bool(redis_client.exists(presence_key(game_id, player_id)))
@@ -1,15 +1,28 @@
 # clients/redis_client.py
 import os
 import redis
+from redis.cluster import RedisCluster
+
+# REDIS_CLUSTER=1 talks to a Redis Cluster through REDIS_URL (or host/port),
+# any node will do. Every per-game key carries its game id as a hash tag,
+# so one game's keys, scripts and transactions stay on a single slot.
+REDIS_CLUSTER = os.getenv("REDIS_CLUSTER", "0") == "1"
+# Game update channels use SPUBLISH/SSUBSCRIBE (Redis 7+), which keeps each
+# message on the shard owning the game instead of fanning it out to every
+# node. On by default on a cluster, where plain PUBLISH does not scale.
+SHARDED_PUBSUB = os.getenv("REDIS_SHARDED_PUBSUB", "1" if REDIS_CLUSTER else "0") == "1"
 
 REDIS_URL = os.getenv("REDIS_URL")
-if REDIS_URL:
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+
+if REDIS_CLUSTER:
+    redis_client = RedisCluster.from_url(REDIS_URL or f"redis://{REDIS_HOST}:{REDIS_PORT}", decode_responses=True)
+elif REDIS_URL:
     redis_client = redis.from_url(REDIS_URL, decode_responses=True)
 else:
-    REDIS_HOST = os.getenv("REDIS_HOST", "redis")
-    REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
     redis_client = redis.Redis(
         host=REDIS_HOST,
         port=REDIS_PORT,
         decode_responses=True,
-    )
\ No newline at end of file
+    )
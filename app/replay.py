@@ -0,0 +1,173 @@
+import json
+from collections import OrderedDict
+
+from fastapi import HTTPException
+from game_state import GameState, Stone
+import storage
+from game_cache import load_game, is_finished
+from redis_client import redis_client
+from storage import checkpoint_key, game_key
+
+# A board checkpoint is stored every K moves, so reconstructing any
+# position replays at most K - 1 moves on top of the nearest one
+CHECKPOINT_INTERVAL = 20
+
+# Reconstructed positions kept per worker for repeated seeks
+POSITION_CACHE_SIZE = 512
+
+
+def snapshot(game: GameState) -> dict:
+    """The parts of a GameState that a position depends on."""
+    return {
+        "board_state": list(game.board_state),
+        "current_turn": game.current_turn.value,
+        "captured_black": game.captured_black,
+        "captured_white": game.captured_white,
+        "ko_point": game.ko_point,
+        "consecutive_passes": game.consecutive_passes
+    }
+
+
+def record_checkpoint(pipe, game_id: str, game: GameState):
+    """Queue a checkpoint on `pipe` when the game has just reached a multiple of K moves."""
+    count = len(game.moves)
+    if count and count % CHECKPOINT_INTERVAL == 0:
+        pipe.hset(checkpoint_key(game_id), count, json.dumps(snapshot(game)))
+
+
+def drop_checkpoint(pipe, game_id: str, move_count: int):
+    """Queue removal of the checkpoint for a move that is being taken back."""
+    if move_count and move_count % CHECKPOINT_INTERVAL == 0:
+        pipe.hdel(checkpoint_key(game_id), move_count)
+
+
+def initial_position(game: GameState) -> GameState:
+    board = GameState(game.board_size, komi=game.komi, rule_set=game.rule_set)
+    for index in game.handicap_placements or []:
+        board.board_state[index] = Stone.BLACK.value
+    if game.handicap_placements:
+        board.current_turn = Stone.WHITE
+    board.reset_legal_moves()
+    return board
+
+
+def restore_checkpoint(game: GameState, data: dict) -> GameState:
+    board = GameState(game.board_size, komi=game.komi, rule_set=game.rule_set)
+    board.board_state = data["board_state"]
+    board.current_turn = Stone(data["current_turn"])
+    board.captured_black = data["captured_black"]
+    board.captured_white = data["captured_white"]
+    board.ko_point = data["ko_point"]
+    board.consecutive_passes = data["consecutive_passes"]
+    board.reset_legal_moves()
+    return board
+
+
+class PositionCache:
+    """Small LRU of reconstructed positions."""
+
+    def __init__(self, maxsize: int = POSITION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        position = self.entries.get(key)
+        if position is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return position
+
+    def put(self, key, position: dict):
+        self.entries[key] = position
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+
+position_cache = PositionCache()
+
+
+def position_at(game_id: str, game: GameState, move_number: int) -> dict:
+    """
+    Board after the first `move_number` moves of `game`.
+    Starts from the nearest checkpoint at or below the target and replays
+    the remaining moves through GameState. Raises HTTPException on a bad index.
+    """
+    total = len(game.moves)
+    if not isinstance(move_number, int) or not 0 <= move_number <= total:
+        raise HTTPException(status_code=400, detail=f"Move must be between 0 and {total}")
+
+    # Keyed on the move prefix so a takeback followed by a different move never hits a stale entry
+    prefix = tuple((m["index"], m["color"]) for m in game.moves[:move_number])
+    cache_key = (game_id, move_number, hash(prefix))
+    position = position_cache.get(cache_key)
+    if position is not None:
+        return position
+
+    base = move_number - move_number % CHECKPOINT_INTERVAL
+    stored = redis_client.hget(checkpoint_key(game_id), base) if base else None
+    if stored or not base:
+        board = restore_checkpoint(game, json.loads(stored)) if stored else initial_position(game)
+        for move in game.moves[base:move_number]:
+            _replay(board, move)
+        position = _position(board, game, move_number)
+    else:
+        # Imported games and games from before checkpoints: replay the
+        # whole game once and store every checkpoint, so later seeks
+        # start from one
+        board = initial_position(game)
+        backfill = {}
+        for count, move in enumerate(game.moves, 1):
+            _replay(board, move)
+            if count == move_number:
+                position = _position(board, game, move_number)
+            if count % CHECKPOINT_INTERVAL == 0:
+                backfill[count] = json.dumps(snapshot(board))
+        store_checkpoints(game_id, game, backfill)
+
+    position_cache.put(cache_key, position)
+    return position
+
+
+def _replay(board: GameState, move: dict):
+    if move["index"] != -2:
+        board.make_move(move["index"], Stone(move["color"]))
+
+
+def _position(board: GameState, game: GameState, move_number: int) -> dict:
+    last_move = game.moves[move_number - 1]["index"] if move_number else None
+    return {
+        "move": move_number,
+        "total_moves": len(game.moves),
+        "board_state": list(board.board_state),
+        "current_turn": board.current_turn.value,
+        "captured_black": board.captured_black,
+        "captured_white": board.captured_white,
+        "ko_point": board.ko_point,
+        "last_move_index": last_move if last_move is not None and last_move >= 0 else None
+    }
+
+
+def store_checkpoints(game_id: str, game: GameState, checkpoints: dict):
+    """Store rebuilt checkpoints; a finished game's expire with its result record."""
+    if not checkpoints:
+        return
+    ttl = redis_client.pttl(game_key(game_id)) if is_finished(game) else -1
+    if is_finished(game) and ttl <= 0:
+        return  # The record is gone or about to be
+    with redis_client.pipeline(transaction=False) as pipe:
+        pipe.hset(checkpoint_key(game_id), mapping=checkpoints)
+        if ttl > 0:
+            pipe.pexpire(checkpoint_key(game_id), ttl)
+        storage.execute(pipe, "replay_checkpoints")
+
+
+def get_position(game_id: str, move_number: int) -> dict:
+    game = load_game(game_id, redis_client, fresh=False)
+    if game is None:
+        raise HTTPException(status_code=404, detail="Game not found")
+    return position_at(game_id, game, move_number)
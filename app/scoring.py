@@ -0,0 +1,206 @@
+import json
+
+from fastapi import HTTPException
+
+from game_state import GameState, Stone
+from redis_client import redis_client
+from storage import dead_stones_key, finalized_key, publish_update
+
+# During the scoring phase each side's dead-stone marks live in their own
+# Redis set and agreement is tracked in a third one, so marking a group
+# never rewrites the game document. The document is written once, when
+# both players finalize the same marks. Both run on the game's actor.
+
+COLOR_NAMES = {Stone.BLACK.value: "black", Stone.WHITE.value: "white"}
+
+# KEYS[1] the player's marks, KEYS[2] finalized players, KEYS[3] (bot
+# games) the bot's marks, which mirror its opponent's. ARGV the points.
+# A group already fully marked is unmarked, otherwise marked; any change
+# withdraws earlier finalizations. Returns 1 if the points are now dead.
+TOGGLE_SCRIPT = """
+local marked = 1
+for i = 1, #ARGV do
+    if redis.call('SISMEMBER', KEYS[1], ARGV[i]) == 0 then
+        marked = 0
+        break
+    end
+end
+for k = 1, #KEYS do
+    if k ~= 2 then
+        if marked == 1 then
+            redis.call('SREM', KEYS[k], unpack(ARGV))
+        else
+            redis.call('SADD', KEYS[k], unpack(ARGV))
+        end
+    end
+end
+redis.call('DEL', KEYS[2])
+return 1 - marked
+"""
+
+# KEYS[1] black's marks, KEYS[2] white's marks, KEYS[3] finalized players.
+# ARGV[1] the player, ARGV[2] the bot's id or "". Marks that differ are
+# refused ({-1}). Only the call that completes the agreement gets {1,
+# agreed points}; everyone else gets {0, finalized players}.
+FINALIZE_SCRIPT = """
+if #redis.call('SDIFF', KEYS[1], KEYS[2]) > 0 or #redis.call('SDIFF', KEYS[2], KEYS[1]) > 0 then
+    return {-1, {}}
+end
+local added = redis.call('SADD', KEYS[3], ARGV[1])
+if ARGV[2] ~= '' then
+    added = added + redis.call('SADD', KEYS[3], ARGV[2])
+end
+if added > 0 and redis.call('SCARD', KEYS[3]) == 2 then
+    return {1, redis.call('SMEMBERS', KEYS[1])}
+end
+return {0, redis.call('SMEMBERS', KEYS[3])}
+"""
+
+
+def _scoring_color(game: GameState, player_id: str) -> int:
+    if not game.in_scoring_phase:
+        raise HTTPException(status_code=400, detail="Game is not in the scoring phase")
+    color = game.players.get(player_id)
+    if color is None:
+        raise HTTPException(status_code=403, detail="You are not part of this game")
+    return color
+
+
+def expand_mark(game: GameState, index) -> list:
+    """A clicked stone marks its whole group; an empty point (Japanese seki) only itself."""
+    if not isinstance(index, int) or not game.is_in_bounds(index):
+        raise HTTPException(status_code=400, detail="Invalid point")
+    stone = game.board_state[index]
+    if stone == Stone.EMPTY.value:
+        if getattr(game, "rule_set", "japanese").lower() != "japanese":
+            raise HTTPException(status_code=400, detail="Only stones can be marked dead")
+        return [index]
+    return sorted(game.get_connected_group(index, stone))
+
+
+def toggle_dead_stone(game_id: str, game: GameState, player_id: str, index, pipe) -> dict:
+    """Mark or unmark the group at `index` for this player and queue just that change for broadcast."""
+    color = _scoring_color(game, player_id)
+    points = expand_mark(game, index)
+
+    colors = [COLOR_NAMES[color]]
+    if game.bot and game.bot["player_id"] != player_id:
+        # The bot accepts whatever its opponent marks dead
+        colors.append(COLOR_NAMES[game.players[game.bot["player_id"]]])
+    keys = [dead_stones_key(game_id, colors[0]), finalized_key(game_id)]
+    keys += [dead_stones_key(game_id, c) for c in colors[1:]]
+
+    toggle = redis_client.register_script(TOGGLE_SCRIPT)
+    dead = bool(toggle(keys=keys, args=points))
+
+    message = {
+        "type": "dead_stones",
+        "player_id": player_id,
+        "colors": colors,
+        "indices": points,
+        "dead": dead,
+        "finalized_players": []
+    }
+    publish_update(pipe, game_id, json.dumps(message))
+    return message
+
+
+def score_agreed(game: GameState, agreed: list):
+    """Remove the agreed dead stones, score the board and end the game."""
+    removed_stones = []
+    excluded_points = []
+    for idx in agreed:
+        color = game.board_state[idx]
+        if color in (Stone.BLACK.value, Stone.WHITE.value):
+            removed_stones.append((idx, color))
+            game.board_state[idx] = Stone.EMPTY.value
+        elif color == Stone.EMPTY.value:
+            excluded_points.append(idx)
+        if color == Stone.BLACK.value:
+            game.captured_white += 1
+        elif color == Stone.WHITE.value:
+            game.captured_black += 1
+
+    game.dead_black = list(agreed)
+    game.dead_white = list(agreed)
+    game.finalized_players = list(game.players)
+    game.agreed_dead = [
+        {"index": idx, "color": color}
+        for idx, color in removed_stones
+    ]
+    game.excluded_points = excluded_points
+
+    rule_set = getattr(game, "rule_set", "japanese").lower()
+    if rule_set == "japanese":
+        game.final_score = game.score_game(excluded=excluded_points)
+    else:
+        game.final_score = game.score_game()
+
+    game.game_over = True
+    game.in_scoring_phase = False
+    game.game_over_reason = "double_pass"
+
+    black_score, white_score = game.final_score
+    if black_score != white_score:
+        winner_color = Stone.BLACK if black_score > white_score else Stone.WHITE
+        for pid, stone in game.players.items():
+            if stone == winner_color.value:
+                game.winner = pid
+                break
+    else:
+        game.winner = None
+
+
+def finalize_score(game_id: str, game: GameState, player_id: str, pipe) -> bool:
+    """
+    Accept the current marks for this player. Scores the game and returns
+    True once both players have finalized the same marks.
+    """
+    _scoring_color(game, player_id)
+    keys = [
+        dead_stones_key(game_id, "black"),
+        dead_stones_key(game_id, "white"),
+        finalized_key(game_id)
+    ]
+    finalize = redis_client.register_script(FINALIZE_SCRIPT)
+    status, members = finalize(keys=keys, args=[player_id, game.bot["player_id"] if game.bot else ""])
+
+    if status == -1:
+        raise HTTPException(status_code=409, detail="Dead stone selections do not match")
+    if status == 0:
+        print(f"Player {player_id} finalized their score in game {game_id}")
+        publish_update(pipe, game_id, json.dumps({
+            "type": "score_finalized",
+            "player_id": player_id,
+            "finalized_players": members
+        }))
+        return False
+
+    # This call completed the agreement; the actor stores the result, which
+    # drops the marks
+    score_agreed(game, sorted(int(i) for i in members))
+    game.version += 1
+    print(f"Score finalized in game {game_id}: {game.final_score}")
+    return True
+
+
+def queue_scoring_marks(pipe, game_id: str):
+    """Queue the three reads scoring_marks takes the replies of."""
+    pipe.smembers(dead_stones_key(game_id, "black"))
+    pipe.smembers(dead_stones_key(game_id, "white"))
+    pipe.smembers(finalized_key(game_id))
+
+
+def scoring_marks(dead_black: set, dead_white: set, finalized: set) -> dict | None:
+    """
+    Both sides' current marks, for a player (re)joining during scoring, or
+    None if there are none; the sets only exist during scoring.
+    """
+    if not (dead_black or dead_white or finalized):
+        return None
+    return {
+        "type": "scoring_marks",
+        "dead_black": sorted(int(i) for i in dead_black),
+        "dead_white": sorted(int(i) for i in dead_white),
+        "finalized_players": sorted(finalized)
+    }
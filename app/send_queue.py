@@ -0,0 +1,190 @@
+import asyncio
+import json
+import time
+from collections import deque
+
+# Per-socket queue limits. Players get more room and more patience than
+# spectators, and are never shed to relieve worker-wide pressure.
+PLAYER_MAX_QUEUE = 256
+SPECTATOR_MAX_QUEUE = 32
+PLAYER_OVER_BUDGET_GRACE_SECS = 30
+SPECTATOR_OVER_BUDGET_GRACE_SECS = 5
+
+# Total messages queued across all sockets on this worker before
+# lagging spectators start being disconnected
+WORKER_QUEUE_BUDGET = 5000
+
+# Message types where a newer one fully supersedes an older one
+COALESCED_TYPES = {"game_state"}
+
+
+class SendRegistry:
+    """Worker-wide view of every outgoing socket queue."""
+
+    def __init__(self, queue_budget: int = WORKER_QUEUE_BUDGET):
+        self.queue_budget = queue_budget
+        self.senders = set()
+        self.total_queued = 0
+        self.players_pending = 0
+
+    def register(self, sender):
+        self.senders.add(sender)
+
+    def unregister(self, sender):
+        self.senders.discard(sender)
+
+    def shed_spectators(self):
+        """Drop the most-lagged spectators until the worker is back under budget."""
+        if self.total_queued <= self.queue_budget:
+            return
+        lagging = sorted(
+            (s for s in self.senders if s.is_spectator and not s.closed),
+            key=lambda s: len(s.queue),
+            reverse=True
+        )
+        for sender in lagging:
+            if self.total_queued <= self.queue_budget:
+                break
+            print(f"Shedding lagging spectator with {len(sender.queue)} queued messages")
+            sender.close(code=1013, reason="Server overloaded")
+
+
+send_registry = SendRegistry()
+
+
+class SocketSender:
+    """
+    Bounded outgoing queue for one WebSocket, drained by its own writer task.
+    Producers never await the socket, so one slow client cannot stall
+    the Redis listener or anybody else.
+    """
+
+    def __init__(self, websocket, is_spectator: bool, registry: SendRegistry = send_registry, binary: bool = False):
+        self.websocket = websocket
+        self.is_spectator = is_spectator
+        self.binary = binary  # client negotiated packed game_state frames
+        self.registry = registry
+        self.max_queue = SPECTATOR_MAX_QUEUE if is_spectator else PLAYER_MAX_QUEUE
+        self.grace_secs = SPECTATOR_OVER_BUDGET_GRACE_SECS if is_spectator else PLAYER_OVER_BUDGET_GRACE_SECS
+        self.queue = deque()  # ((message_type, game_id), str or bytes frame)
+        self.wakeup = asyncio.Event()
+        self.over_budget_since = None
+        self.closed = False
+        self.writer_task = None
+
+    def start(self):
+        self.registry.register(self)
+        self.writer_task = asyncio.create_task(self._writer())
+
+    def enqueue(self, frame: str | bytes, message_type: str | None = None, game_id: str | None = None):
+        """`game_id` tells apart snapshots of different games on a multiplexed socket."""
+        if self.closed:
+            return
+
+        # A lagging client only needs the newest full snapshot of each game
+        tag = (message_type, game_id)
+        if message_type in COALESCED_TYPES and self.queue and self.queue[-1][0] == tag:
+            self.queue[-1] = (tag, frame)
+        else:
+            self._push((tag, frame))
+
+        if len(self.queue) > self.max_queue:
+            now = time.monotonic()
+            if self.over_budget_since is None:
+                self.over_budget_since = now
+            elif now - self.over_budget_since > self.grace_secs:
+                print(f"Closing socket that stayed over its send budget for {self.grace_secs}s")
+                self.close(code=1013, reason="Too slow to keep up")
+                return
+        else:
+            self.over_budget_since = None
+
+        self.wakeup.set()
+        self.registry.shed_spectators()
+
+    def _push(self, item):
+        if not self.queue and not self.is_spectator:
+            self.registry.players_pending += 1
+        self.queue.append(item)
+        self.registry.total_queued += 1
+
+    def _pop(self):
+        item = self.queue.popleft()
+        self.registry.total_queued -= 1
+        if not self.queue and not self.is_spectator:
+            self.registry.players_pending -= 1
+        return item
+
+    def _clear(self):
+        if self.queue and not self.is_spectator:
+            self.registry.players_pending -= 1
+        self.registry.total_queued -= len(self.queue)
+        self.queue.clear()
+
+    async def _writer(self):
+        try:
+            while not self.closed:
+                if not self.queue:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                    continue
+
+                # Let player writers go first whenever they have work queued
+                if self.is_spectator and self.registry.players_pending:
+                    await asyncio.sleep(0)
+
+                _, frame = self._pop()
+                if isinstance(frame, bytes):
+                    await self.websocket.send_bytes(frame)
+                else:
+                    await self.websocket.send_text(frame)
+        except asyncio.CancelledError:
+            pass
+        except Exception as err:
+            print("Socket writer error:", err)
+            self.closed = True
+
+    def close(self, code: int = 1000, reason: str = ""):
+        if self.closed:
+            return
+        self.closed = True
+        self._clear()
+        self.wakeup.set()
+        asyncio.create_task(self._close_socket(code, reason))
+
+    async def _close_socket(self, code, reason):
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    async def stop(self):
+        """Tear down after the connection has ended."""
+        self.closed = True
+        self._clear()
+        self.registry.unregister(self)
+        if self.writer_task:
+            self.writer_task.cancel()
+            try:
+                await self.writer_task
+            except asyncio.CancelledError:
+                pass
+
+
+class TaggedSender:
+    """
+    One game's view of a multiplexed socket. Looks like a SocketSender to
+    the broadcaster, but wraps every frame as {"game_id": ..., "message": ...}
+    by string concatenation, so payloads are still never re-encoded.
+    """
+
+    binary = False  # multiplexed sockets speak JSON only
+
+    def __init__(self, sender: SocketSender, game_id: str, is_spectator: bool):
+        self.sender = sender
+        self.game_id = game_id
+        self.is_spectator = is_spectator
+        self.prefix = '{"game_id": ' + json.dumps(game_id) + ', "message": '
+
+    def enqueue(self, frame: str, message_type: str | None = None):
+        self.sender.enqueue(self.prefix + frame + '}', message_type, game_id=self.game_id)
@@ -0,0 +1,264 @@
+# app/sgf_replay.py
+#
+# Replay a directory of SGF files through GameState on every core.
+#
+#   python sgf_replay.py path/to/sgfs [--workers N] [--import]
+#
+# Reports moves the engine rejects, how score_game compares with each
+# file's RE[] result, and throughput in moves/sec. Exits non-zero when any
+# move disagreed, so it can gate engine changes.
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import re
+import sys
+import time
+import uuid
+from multiprocessing import Pool
+from pathlib import Path
+
+from game_state import GameState, Stone
+from geometry import geometry, is_valid_size
+
+PROPERTY = re.compile(r"([A-Z]+)((?:\s*\[(?:\\.|[^\]])*\])+)", re.S)
+VALUE = re.compile(r"\[((?:\\.|[^\]])*)\]", re.S)
+RESULT = re.compile(r"^([BW])\+(\d+(?:\.\d+)?)$")
+
+CHINESE_RULES = {"chinese", "cn", "aga", "nz", "new zealand"}
+
+
+def parse_sgf(text: str) -> dict:
+    """
+    Main line of an SGF game as plain values. Only the first variation
+    is followed: parsing stops at the first closing parenthesis.
+    """
+    nodes = []
+    depth = 0
+    pos = 0
+    while pos < len(text):
+        char = text[pos]
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            break
+        elif char == ";" and depth:
+            nodes.append({})
+        elif char.isupper() and nodes:
+            match = PROPERTY.match(text, pos)
+            if match:
+                ident, raw_values = match.groups()
+                nodes[-1].setdefault(ident, []).extend(VALUE.findall(raw_values))
+                pos = match.end()
+                continue
+        pos += 1
+
+    if not nodes:
+        raise ValueError("No game tree found")
+
+    root = nodes[0]
+    size = int(root.get("SZ", ["19"])[0].split(":")[0])
+    game = {
+        "size": size,
+        "komi": float(root.get("KM", ["6.5"])[0] or 6.5),
+        "rules": (root.get("RU", ["japanese"])[0] or "japanese").strip().lower(),
+        "result": (root.get("RE", [""])[0] or "").strip(),
+        "handicap": [point_to_index(v, size) for v in root.get("AB", [])],
+        "first_player": root.get("PL", [None])[0],
+        "moves": []
+    }
+    for node in nodes:
+        for color, ident in ((Stone.BLACK, "B"), (Stone.WHITE, "W")):
+            if ident in node:
+                game["moves"].append((color, point_to_index(node[ident][0], size)))
+    return game
+
+
+def point_to_index(value: str, size: int) -> int:
+    """SGF "cd" -> board index; empty (or "tt" on small boards) is a pass."""
+    if is_valid_size(size):
+        return geometry(size).from_sgf(value)
+    if not value or (value == "tt" and size <= 19):
+        return -1
+    x = ord(value[0]) - ord("a")
+    y = ord(value[1]) - ord("a")
+    return y * size + x
+
+
+def parse_result(result: str):
+    """Signed black-minus-white margin for scored results, else None."""
+    if result in ("0", "Draw", "Jigo"):
+        return 0.0
+    match = RESULT.match(result)
+    if not match:
+        return None
+    margin = float(match.group(2))
+    return margin if match.group(1) == "B" else -margin
+
+
+def _quiet_worker():
+    # is_valid_move prints its reason for every rejection; keep workers quiet
+    sys.stdout = open(os.devnull, "w")
+
+
+def replay_file(path: str, keep_state: bool = False) -> dict:
+    report = {"file": path, "moves": 0, "illegal": None, "error": None,
+              "result": None, "score": None, "score_agrees": None, "state": None}
+    started = time.perf_counter()
+    try:
+        sgf = parse_sgf(Path(path).read_text(encoding="utf-8", errors="replace"))
+    except (OSError, ValueError, IndexError) as e:
+        report["error"] = str(e)
+        return report
+
+    rule_set = "chinese" if sgf["rules"] in CHINESE_RULES else "japanese"
+    game = GameState(sgf["size"], komi=sgf["komi"], rule_set=rule_set)
+    for index in sgf["handicap"]:
+        game.board_state[index] = Stone.BLACK.value
+    if sgf["handicap"]:
+        game.handicap_placements = list(sgf["handicap"])
+        game.current_turn = Stone.WHITE
+    if sgf["first_player"] in ("B", "W"):
+        game.current_turn = Stone.BLACK if sgf["first_player"] == "B" else Stone.WHITE
+    game.reset_legal_moves()
+
+    for number, (color, index) in enumerate(sgf["moves"], start=1):
+        if not game.is_valid_move(index, color):
+            # Ask again with output captured to get the engine's reason
+            reason = io.StringIO()
+            with contextlib.redirect_stdout(reason):
+                game.is_valid_move(index, color)
+            report["illegal"] = {
+                "move": number,
+                "color": color.name,
+                "index": index,
+                "reason": reason.getvalue().strip()
+            }
+            break
+        game.make_move(index, color)
+        game.moves.append({"index": index, "color": color.value, "timestamp": None})
+    report["moves"] = len(game.moves)
+
+    report["result"] = sgf["result"]
+    black, white = game.score_game()
+    report["score"] = [black, white]
+    expected = parse_result(sgf["result"])
+    if expected is not None and report["illegal"] is None:
+        report["score_agrees"] = abs((black - white) - expected) < 0.01
+
+    if keep_state and report["illegal"] is None:
+        report["state"] = archived_state(game, sgf["result"])
+    report["seconds"] = time.perf_counter() - started
+    return report
+
+
+def archived_state(game: GameState, result: str) -> dict:
+    """Result record in the same shape the server compacts finished games into."""
+    black_id, white_id = "sgf-black", "sgf-white"
+    game.players = {black_id: Stone.BLACK.value, white_id: Stone.WHITE.value}
+    game.game_type = "private"
+    game.game_over = True
+    game.in_scoring_phase = False
+
+    winner = {"B": black_id, "W": white_id}.get(result[:1])
+    loser = white_id if winner == black_id else black_id
+    if result[2:3] == "R" and winner:
+        game.game_over_reason = "resign"
+        game.resigned_player = loser
+        game.winner = winner
+    elif result[2:3] == "T" and winner:
+        game.game_over_reason = "timeout"
+        game.resigned_player = loser
+        game.winner = winner
+    else:
+        game.game_over_reason = "double_pass"
+        game.final_score = game.score_game()
+        black, white = game.final_score
+        game.winner = black_id if black > white else white_id if white > black else None
+    return game.to_record()
+
+
+def _replay_for_import(path: str) -> dict:
+    return replay_file(path, keep_state=True)
+
+
+def import_games(states: list) -> list:
+    """
+    Store replayed games under fresh ids in one pipeline, as the result
+    records finished games are compacted into (expiring like them). They
+    were never live, so the active game count is left alone.
+    """
+    from redis_client import redis_client
+    from storage import players_key
+    from game_cache import save_result
+
+    game_ids = []
+    with redis_client.pipeline(transaction=False) as pipe:
+        for state in states:
+            game_id = str(uuid.uuid4())[:8]
+            pipe.hset(players_key(game_id), mapping=state["players"])
+            save_result(pipe, game_id, GameState.from_record(state),
+                        json.dumps(state, separators=(",", ":")), cache=False, was_live=False)
+            game_ids.append(game_id)
+        pipe.execute()
+    return game_ids
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Replay SGF files through GameState in parallel.")
+    parser.add_argument("directory", help="directory searched recursively for *.sgf")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes (default: all cores)")
+    parser.add_argument("--chunksize", type=int, default=16, help="files handed to a worker at a time")
+    parser.add_argument("--import", dest="import_games", action="store_true",
+                        help="store every fully legal game in Redis as a finished game")
+    parser.add_argument("--json", dest="json_path", help="write the per-file reports to this path")
+    args = parser.parse_args(argv)
+
+    paths = sorted(str(p) for p in Path(args.directory).rglob("*.sgf"))
+    if not paths:
+        print(f"No SGF files under {args.directory}")
+        return 1
+
+    task = _replay_for_import if args.import_games else replay_file
+    started = time.perf_counter()
+    with Pool(args.workers, initializer=_quiet_worker) as pool:
+        reports = list(pool.imap_unordered(task, paths, chunksize=args.chunksize))
+    elapsed = time.perf_counter() - started
+
+    errors = [r for r in reports if r["error"]]
+    illegal = [r for r in reports if r["illegal"]]
+    scored = [r for r in reports if r["score_agrees"] is not None]
+    agreeing = sum(1 for r in scored if r["score_agrees"])
+    total_moves = sum(r["moves"] for r in reports)
+    cpu_seconds = sum(r.get("seconds", 0) for r in reports)
+
+    for r in sorted(illegal, key=lambda r: r["file"]):
+        bad = r["illegal"]
+        print(f"ILLEGAL {r['file']}: move {bad['move']} {bad['color']} at {bad['index']} ({bad['reason']})")
+    for r in sorted(errors, key=lambda r: r["file"]):
+        print(f"ERROR   {r['file']}: {r['error']}")
+
+    print(f"Files:            {len(paths)} ({len(errors)} unreadable)")
+    print(f"Disagreements:    {len(illegal)} games with a move the engine rejects")
+    print(f"Scored results:   {agreeing}/{len(scored)} match score_game (dead stones are not removed)")
+    print(f"Moves replayed:   {total_moves} in {elapsed:.2f}s with {args.workers} workers")
+    print(f"Throughput:       {total_moves / elapsed:,.0f} moves/sec wall, "
+          f"{total_moves / cpu_seconds if cpu_seconds else 0:,.0f} moves/sec per core")
+
+    if args.import_games:
+        states = [r.pop("state") for r in reports if r.get("state")]
+        game_ids = import_games(states)
+        print(f"Imported:         {len(game_ids)} games")
+
+    if args.json_path:
+        for r in reports:
+            r.pop("state", None)
+        Path(args.json_path).write_text(json.dumps(reports, indent=2))
+
+    return 1 if illegal else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -39,6 +39,100 @@ document.addEventListener("DOMContentLoaded", function () {
         }
     }
 
+    function formatBytes(bytes) {
+        if (bytes == null) return '-';
+        const units = ['B', 'KB', 'MB', 'GB'];
+        let i = 0;
+        while (bytes >= 1024 && i < units.length - 1) {
+            bytes /= 1024;
+            i++;
+        }
+        return `${bytes.toFixed(i ? 1 : 0)} ${units[i]}`;
+    }
+
+    function fillRows(tbody, rows) {
+        tbody.innerHTML = '';
+        for (const cells of rows) {
+            const tr = document.createElement('tr');
+            for (const cell of cells) {
+                const td = document.createElement('td');
+                td.textContent = cell;
+                tr.appendChild(td);
+            }
+            tbody.appendChild(tr);
+        }
+    }
+
+    // Live ops panel: counters and worker reports only, so polling is cheap
+    async function fetchOps() {
+        const res = await fetch('/admin/ops');
+        if (!res.ok) return;
+        const data = await res.json();
+        document.getElementById('opsActiveGames').textContent = data.active_games;
+        document.getElementById('opsPlayers').textContent = data.players;
+        document.getElementById('opsSpectators').textContent = data.spectators;
+        document.getElementById('opsDeadlines').textContent = data.pending_deadlines;
+        document.getElementById('opsMemory').textContent = data.memory.used_human || '-';
+
+        fillRows(document.getElementById('opsWorkers'), data.workers.map(w => [
+            w.worker, w.games, w.players, w.spectators, w.timer_tasks
+        ]));
+        fillRows(document.getElementById('opsFamilies'), Object.entries(data.memory.estimated_by_family)
+            .sort((a, b) => b[1] - a[1])
+            .map(([family, bytes]) => [family, formatBytes(bytes)]));
+    }
+
+    async function recountGames() {
+        const res = await fetch('/admin/ops/recount', { method: 'POST' });
+        if (res.ok) fetchOps();
+    }
+
+    // Redis inspector: one SCAN page per request
+    let inspectorCursor = '0';
+
+    async function inspect(fromStart) {
+        if (fromStart) {
+            inspectorCursor = '0';
+            document.getElementById('inspectorKeys').innerHTML = '';
+        }
+        const prefix = document.getElementById('inspectorPrefix').value;
+        const params = new URLSearchParams({ prefix, cursor: inspectorCursor });
+        const res = await fetch(`/admin/redis?${params}`);
+        if (!res.ok) return;
+        const data = await res.json();
+
+        const tbody = document.getElementById('inspectorKeys');
+        for (const entry of data.keys) {
+            const tr = document.createElement('tr');
+            const keyCell = document.createElement('td');
+            keyCell.textContent = entry.key;
+            keyCell.className = 'inspector-key';
+            keyCell.addEventListener('click', () => showKey(entry.key));
+            tr.appendChild(keyCell);
+            for (const cell of [entry.type, entry.size ?? '-', entry.ttl < 0 ? '-' : `${entry.ttl}s`]) {
+                const td = document.createElement('td');
+                td.textContent = cell;
+                tr.appendChild(td);
+            }
+            tbody.appendChild(tr);
+        }
+
+        inspectorCursor = data.cursor;
+        document.getElementById('inspectorNextBtn').disabled = inspectorCursor === '0';
+    }
+
+    async function showKey(key) {
+        const res = await fetch(`/admin/redis/key?${new URLSearchParams({ key })}`);
+        const pre = document.getElementById('inspectorValue');
+        pre.hidden = false;
+        pre.textContent = res.ok ? JSON.stringify(await res.json(), null, 2) : 'Key not found';
+    }
+
     document.getElementById('saveSettingsBtn').addEventListener('click', saveSettings);
+    document.getElementById('opsRecountBtn').addEventListener('click', recountGames);
+    document.getElementById('inspectorSearchBtn').addEventListener('click', () => inspect(true));
+    document.getElementById('inspectorNextBtn').addEventListener('click', () => inspect(false));
     window.addEventListener('DOMContentLoaded', fetchSettings);
+    fetchOps();
+    setInterval(fetchOps, 5000);
 });
\ No newline at end of file
@@ -1,4 +1,5 @@
-import { Stone, replayMovesUpTo, getConnectedGroup, isCaptured, getAdjacentIndices} from "./go_engine.js";
+import { Stone, getConnectedGroup, isCaptured, getAdjacentIndices, getGeometry, decodeLegalMask } from "./go_engine.js";
+import { preferredWireFormat, decodeFrame, parseMessage, expandRecord } from "./wire_format.js";
 
 document.addEventListener("DOMContentLoaded", function () {
 
@@ -25,11 +26,21 @@ document.addEventListener("DOMContentLoaded", function () {
             this.myDead = new Set(); //My selected dead stones
             this.theirDead = new Set(); //Opponent's selected dead stones
 
+            // Scoring marks per colour, kept current by scoring_marks and dead_stones messages
+            this.deadBlack = new Set();
+            this.deadWhite = new Set();
+            this.finalizedPlayers = [];
+
             this.playerId = localStorage.getItem("zg_player_id");
 
             this.doubleClickEnabled = false;
             this.pendingMoveIndex = null;
 
+            // Moves sent over the socket
+            this.playerCount = 0;
+            this.moveRequestId = 0;
+            this.lastAckedVersion = null;
+
             // Sound stuff
             this.firstUpdate = true;
             this.prevMoveCount = 0;
@@ -44,6 +55,9 @@ document.addEventListener("DOMContentLoaded", function () {
             // Hover state
             this.hoverIndex = null;
 
+            // Points the side to move may play, from the server's legal mask
+            this.legal = null;
+
             //Game review stuff
             this.reviewIndex = null;
             this.originalGameState = null;
@@ -67,8 +81,10 @@ document.addEventListener("DOMContentLoaded", function () {
 
         /** Connect to WebSocket for real-time updates */
         connectWebSocket(gameId, playerId) {
-            const wsPath = `/ws/${gameId}?player_id=${playerId}`;
+            this.gameId = gameId;
+            const wsPath = `/ws/${gameId}?player_id=${playerId}&format=${preferredWireFormat()}`;
             this.socket = new WebSocket(this.getWebsocketUrl(wsPath));
+            this.socket.binaryType = "arraybuffer";
 
             this.socket.onopen = () => {
                 console.log("Connected to WebSocket for game updates");
@@ -76,10 +92,17 @@ document.addEventListener("DOMContentLoaded", function () {
 
             this.socket.onmessage = async (event) => {
                 try {
-                    const message = JSON.parse(event.data);
+                    const message = event.data instanceof ArrayBuffer
+                        ? decodeFrame(event.data)
+                        : parseMessage(event.data);
                     const countdownElement = document.getElementById("countdown");
             
                     switch (message.type) {
+                        case "ping":
+                            // Heartbeat: answering keeps our presence alive on the server
+                            this.socket.send(JSON.stringify({ type: "pong" }));
+                            break;
+
                         case "disconnect_notice":
                             let boardState = await getBoardState();
                             if (boardState.game_over && !boardState.in_scoring_phase) {
@@ -130,17 +153,84 @@ document.addEventListener("DOMContentLoaded", function () {
                             this.updateBoard(message.payload);
                             break;
 
-                        case "toggle_dead_stone":
-                            if (message.payload) {
-                                this.updateBoard(message.payload);
-                            } else {
-                                console.warn("toggle_dead_stone message missing payload.");
+                        case "scoring_marks":
+                            this.deadBlack = new Set(message.dead_black);
+                            this.deadWhite = new Set(message.dead_white);
+                            this.finalizedPlayers = message.finalized_players;
+                            this.applyScoringMarks();
+                            break;
+
+                        case "dead_stones":
+                            for (const color of message.colors) {
+                                const marks = color === "black" ? this.deadBlack : this.deadWhite;
+                                message.indices.forEach(i => message.dead ? marks.add(i) : marks.delete(i));
                             }
+                            this.finalizedPlayers = message.finalized_players;
+                            this.applyScoringMarks();
+                            break;
+
+                        case "score_finalized":
+                            this.finalizedPlayers = message.finalized_players;
+                            this.applyScoringMarks();
+                            break;
+
+                        case "scoring_rejected":
+                            console.warn("Scoring action rejected:", message.detail);
+                            this.applyScoringMarks();
                             break;
 
                         case "chat":
                             this.appendChatMessage(message.sender, message.text);
                             break;
+
+                        case "move_ack":
+                            this.lastAckedVersion = message.version;
+                            break;
+
+                        case "move_rejected":
+                            this.handleMoveRejected(message.detail || "Unknown error");
+                            break;
+
+                        case "chat_history":
+                            for (const entry of message.messages || []) {
+                                this.appendChatMessage(entry.sender, entry.text);
+                            }
+                            break;
+
+                        case "takeback_request":
+                            if (message.player_id === this.playerId) {
+                                this.appendChatNotice("Takeback requested. Waiting for your opponent...");
+                            } else {
+                                const accept = confirm("Your opponent asks to take back their last move. Allow it?");
+                                this.socket.send(JSON.stringify({ type: accept ? "takeback_accept" : "takeback_decline" }));
+                            }
+                            break;
+
+                        case "takeback":
+                            this.applyTakeback(message);
+                            break;
+
+                        case "takeback_declined":
+                            if (message.player_id === this.playerId) {
+                                this.appendChatNotice("Your opponent declined the takeback.");
+                            }
+                            break;
+
+                        case "takeback_rejected":
+                            this.appendChatNotice(`Takeback failed: ${message.detail}`);
+                            break;
+
+                        case "position":
+                            this.showPosition(message);
+                            break;
+
+                        case "seek_rejected":
+                            console.warn("Seek rejected:", message.detail);
+                            break;
+
+                        case "chat_rate_limited":
+                            this.appendChatNotice(`You're sending messages too quickly. Try again in ${Math.ceil(message.retry_after)}s.`);
+                            break;
             
                         default:
                             console.warn("Unrecognized WebSocket message type:", message.type);
@@ -215,12 +305,7 @@ document.addEventListener("DOMContentLoaded", function () {
 
             this.drawStarPoints();
 
-            const letterSource = [
-                "A","B","C","D","E","F","G","H",
-                "J","K","L","M","N","O","P","Q","R","S","T"
-            ];
-            // For any size (9, 13, 19), we take the first `size` entries from letterSource
-            const colLabels = letterSource.slice(0, size);
+            const colLabels = getGeometry(size).columnLabels;
 
             ctx.fillStyle = "black";
             ctx.font = `${Math.floor(cellSize / 2)}px sans-serif`;
@@ -252,30 +337,10 @@ document.addEventListener("DOMContentLoaded", function () {
             const { ctx, cellSize, size } = this;
             ctx.fillStyle = "black";
 
-            let starCoords = [];
-            if (size === 19) {
-                starCoords = [
-                    [4, 4], [4, 10], [4, 16],
-                    [10, 4], [10, 10], [10, 16],
-                    [16, 4], [16, 10], [16, 16]
-                ];
-            } else if (size === 13) {
-                starCoords = [
-                    [4, 4], [4, 7], [4, 10],
-                    [7, 4], [7, 7], [7, 10],
-                    [10, 4], [10, 7], [10, 10]
-                ];
-            } else if (size === 9) {
-                starCoords = [
-                    [3, 3], [3, 5], [3, 7],
-                    [5, 3], [5, 5], [5, 7],
-                    [7, 3], [7, 5], [7, 7]
-                ];
-            }
-
-            starCoords.forEach(([x, y]) => {
+            // Grid lines start one cell in, hence the +1
+            getGeometry(size).starPoints.forEach(([x, y]) => {
                 ctx.beginPath();
-                ctx.arc(x * cellSize, y * cellSize, cellSize / 6, 0, Math.PI * 2);
+                ctx.arc((x + 1) * cellSize, (y + 1) * cellSize, cellSize / 6, 0, Math.PI * 2);
                 ctx.fill();
             });
         }
@@ -323,8 +388,7 @@ document.addEventListener("DOMContentLoaded", function () {
 
                     this.socket.send(JSON.stringify({
                         type: "toggle_dead_stone",
-                        group: [index],
-                        player_id: this.playerId
+                        index: index
                     }));
 
                     this.redrawStones();
@@ -342,10 +406,10 @@ document.addEventListener("DOMContentLoaded", function () {
                     } else {
                         group.forEach(i => this.myDead.add(i));
                     }
+                    // The server expands the clicked stone to the same group
                     this.socket.send(JSON.stringify({
                         type: "toggle_dead_stone",
-                        group: [...group],
-                        player_id: this.playerId
+                        index: index
                     }));
 
                     this.redrawStones();
@@ -355,6 +419,9 @@ document.addEventListener("DOMContentLoaded", function () {
                 return;
             }
         
+            // Occupied, ko and suicide points are known to be illegal without asking
+            if (this.isMyTurn() && !this.isLegal(index)) return;
+
             if (this.doubleClickEnabled) {
                 if (this.pendingMoveIndex === index) {
                     // Second click on same spot: send move
@@ -373,6 +440,49 @@ document.addEventListener("DOMContentLoaded", function () {
             }
         }
 
+        isMyTurn() {
+            return this.currentTurn === this.playerColor && this.reviewIndex === null;
+        }
+
+        isLegal(index) {
+            return !this.legal || this.legal[index] === 1;
+        }
+
+        /** Split the per-colour marks into mine and my opponent's */
+        setMarkViews() {
+            if (this.playerColor === 1) {
+                this.myDead = this.deadBlack;
+                this.theirDead = this.deadWhite;
+            } else {
+                this.myDead = this.deadWhite;
+                this.theirDead = this.deadBlack;
+            }
+        }
+
+        /** Redraw after a scoring update without a full game_state */
+        applyScoringMarks() {
+            if (!this.inScoringPhase) return;
+            this.setMarkViews();
+            this.redrawStones();
+            this.drawDeadOverlays();
+            this.updateFinalizeButton();
+        }
+
+        /** Finalizing is only possible while both players' marks agree */
+        updateFinalizeButton() {
+            const finalizeBtn = document.getElementById("finalizeScoreBtn");
+            if (!finalizeBtn) return;
+
+            const setsMatch =
+                this.myDead.size === this.theirDead.size &&
+                [...this.myDead].every(i => this.theirDead.has(i));
+            // Any change to the marks withdraws earlier finalizations
+            const finalized = this.finalizedPlayers.includes(this.playerId);
+
+            finalizeBtn.disabled = !setsMatch || finalized;
+            finalizeBtn.textContent = finalized ? "Waiting for opponent..." : "Finalize Score";
+        }
+
         drawDeadOverlays() {
             this.ctx.save();
         
@@ -426,15 +536,23 @@ document.addEventListener("DOMContentLoaded", function () {
                 return;
             }
 
-            // Fetch game state to check if both players have joined
-            const gameResponse = await fetch(`/game/${gameId}/state`);
-            const gameData = await gameResponse.json();
-
-            if (index != -2 && (!gameData.players || Object.keys(gameData.players).length < 2)) {
+            // Player count comes from the last game_state we received
+            if (index != -2 && this.playerCount < 2) {
                 alert("Waiting for another player to join...");
                 return;
             }
 
+            // Prefer the open game socket; the server answers with move_ack or move_rejected
+            if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+                this.moveRequestId += 1;
+                this.socket.send(JSON.stringify({
+                    type: "move",
+                    index: index,
+                    request_id: this.moveRequestId
+                }));
+                return;
+            }
+
             await fetch(`/game/${gameId}/move`, {
                 method: "POST",
                 headers: { "Content-Type": "application/json" },
@@ -442,15 +560,54 @@ document.addEventListener("DOMContentLoaded", function () {
             }).then(async response => {
                 if (!response.ok) {
                     const data = await response.json();
-                    const msg = data.detail || "Unknown error";
+                    this.handleMoveRejected(data.detail || "Unknown error");
+                }
+            }).catch(error => console.error("Failed to send move:", error));
+        }
 
-                    if (msg.toLowerCase().includes("not your turn")) {
-                        return;
-                    }
+        updateTurnIndicator() {
+            const colorText = document.querySelector("#playerColor span");
+            const turnText = document.querySelector("#turnIndicator span");
+
+            colorText.textContent = this.playerColor === 1 ? "Black" : "White";
 
-                    alert(`Error: ${msg}`);
+            if (this.playerColor === this.currentTurn) {
+                turnText.textContent = "Your move";
+                turnText.style.color = "green";
+            } else {
+                turnText.textContent = "Opponent's move";
+                turnText.style.color = "gray";
+            }
+        }
+
+        /** Undo the last move locally from the broadcast delta instead of a full snapshot */
+        applyTakeback(message) {
+            const { index, color, captured } = message.delta;
+            if (index >= 0) {
+                const opponent = color === Stone.BLACK ? Stone.WHITE : Stone.BLACK;
+                this.board[index] = Stone.EMPTY;
+                for (const point of captured) {
+                    this.board[point] = opponent;
                 }
-            }).catch(error => console.error("Failed to send move:", error));
+            }
+
+            const last = message.last_move_index;
+            this.lastMoveIndex = last !== null && last >= 0 ? last : null;
+            this.prevMoveCount = Math.max(0, this.prevMoveCount - 1);
+            this.currentTurn = message.current_turn;
+            this.legal = message.legal ? decodeLegalMask(message.legal, this.board.length) : null;
+
+            this.updateTurnIndicator();
+            this.redrawStones();
+            this.appendChatNotice("The last move was taken back.");
+        }
+
+        handleMoveRejected(msg) {
+            if (msg.toLowerCase().includes("not your turn")) {
+                return;
+            }
+
+            alert(`Error: ${msg}`);
         }
 
         /** Convert (x, y) to 1D board index */
@@ -542,10 +699,25 @@ document.addEventListener("DOMContentLoaded", function () {
                     this.ctx.restore();
                 }
             }
+            // Grey out empty points that are illegal for me (ko, suicide)
+            if (this.legal && this.isMyTurn() && !this.inScoringPhase) {
+                this.ctx.save();
+                this.ctx.fillStyle = "rgba(80, 80, 80, 0.35)";
+                const mark = this.cellSize / 6;
+                for (let index = 0; index < this.board.length; index++) {
+                    if (this.board[index] === Stone.EMPTY && !this.legal[index]) {
+                        const { x: ix, y: iy } = this.getCanvasCoords(index);
+                        this.ctx.fillRect(ix - mark / 2, iy - mark / 2, mark, mark);
+                    }
+                }
+                this.ctx.restore();
+            }
+
             if (
                 this.hoverIndex !== null &&
                 !this.inScoringPhase && 
-                this.board[this.hoverIndex] === Stone.EMPTY
+                this.board[this.hoverIndex] === Stone.EMPTY &&
+                (!this.isMyTurn() || this.isLegal(this.hoverIndex))
             ) {
                 const { x: hx, y: hy } = this.getCanvasCoords(this.hoverIndex);
                 this.ctx.save();
@@ -574,12 +746,7 @@ document.addEventListener("DOMContentLoaded", function () {
                     this.reviewIndex--;
                 }
 
-                const result = replayMovesUpTo(this.originalGameState.moves, this.reviewIndex, this.size, this.originalGameState.handicap_placements || []);
-                this.board = result.board;
-                this.capturedBlack = result.capturedBlack;
-                this.capturedWhite = result.capturedWhite;
-                this.currentTurn = result.currentTurn;
-                this.redrawStones();
+                this.seekTo(this.reviewIndex);
             }
         }
         
@@ -599,42 +766,60 @@ document.addEventListener("DOMContentLoaded", function () {
                     this.reviewIndex++;
                 }
         
-                // If this is the final move again, re-show agreed dead
-                if (this.reviewIndex === max) {
-                    const result = replayMovesUpTo(moves, this.reviewIndex, this.size, this.originalGameState.handicap_placements || []);
-                    this.board = result.board;
-                    this.capturedBlack = result.capturedBlack;
-                    this.capturedWhite = result.capturedWhite;
-                    this.currentTurn = result.currentTurn;
-                    
-                    const agreedDead = this.originalGameState.agreed_dead || [];
-                    const excludedPoints = this.originalGameState.excluded_points || [];
-
-                    for (const stone of agreedDead) {
-                        this.board[stone.index] = Stone.EMPTY;  // Remove it for redraw
-                    }
-    
-                    this.redrawStones();  // draw board first
-                    
-                    // Redraw agreed dead stones at half opacity
-                    for (const stone of agreedDead) {
-                        const boardPos = this.getBoardCoords(stone.index);
-                        const color = stone.color === 1 ? "black" : "white";
-                        this.drawStone(boardPos.x, boardPos.y, color, 0.5);
-                    }
-                    // Redraw excluded points as Xs
-                    for (const index of excludedPoints) {
-                        const boardPos = this.getBoardCoords(index);
-                        this.drawX(boardPos.x, boardPos.y, "black", 0.5);
-                    }
-                } else {
-                    const result = replayMovesUpTo(this.originalGameState.moves, this.reviewIndex, this.size, this.originalGameState.handicap_placements || []);
-                    this.board = result.board;
-                    this.capturedBlack = result.capturedBlack;
-                    this.capturedWhite = result.capturedWhite;
-                    this.currentTurn = result.currentTurn;
-                    this.redrawStones();
-                }
+                this.seekTo(this.reviewIndex);
+            }
+        }
+
+        /** Ask the server for the position after `move` moves (checkpointed replay) */
+        seekTo(move) {
+            if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+                this.socket.send(JSON.stringify({ type: "seek", move: move }));
+                return;
+            }
+            fetch(`/game/${this.gameId}/position?move=${move}`)
+                .then(response => response.json())
+                .then(position => this.showPosition(position))
+                .catch(error => console.error("Failed to load position:", error));
+        }
+
+        showPosition(position) {
+            // Ignore replies to seeks the user has already stepped past
+            if (position.move !== this.reviewIndex) {
+                return;
+            }
+
+            this.board = position.board_state;
+            this.capturedBlack = position.captured_black;
+            this.capturedWhite = position.captured_white;
+            this.currentTurn = position.current_turn;
+            this.lastMoveIndex = position.last_move_index;
+
+            const moves = this.originalGameState.moves || [];
+            if (this.reviewIndex !== moves.length - 1) {
+                this.redrawStones();
+                return;
+            }
+
+            // Final move again: re-show agreed dead
+            const agreedDead = this.originalGameState.agreed_dead || [];
+            const excludedPoints = this.originalGameState.excluded_points || [];
+
+            for (const stone of agreedDead) {
+                this.board[stone.index] = Stone.EMPTY;  // Remove it for redraw
+            }
+
+            this.redrawStones();  // draw board first
+
+            // Redraw agreed dead stones at half opacity
+            for (const stone of agreedDead) {
+                const boardPos = this.getBoardCoords(stone.index);
+                const color = stone.color === 1 ? "black" : "white";
+                this.drawStone(boardPos.x, boardPos.y, color, 0.5);
+            }
+            // Redraw excluded points as Xs
+            for (const index of excludedPoints) {
+                const boardPos = this.getBoardCoords(index);
+                this.drawX(boardPos.x, boardPos.y, "black", 0.5);
             }
         }
 
@@ -672,6 +857,9 @@ document.addEventListener("DOMContentLoaded", function () {
                 }
             }
 
+            this.playerCount = Object.keys(gameState.players || {}).length;
+            this.legal = gameState.legal ? decodeLegalMask(gameState.legal, gameState.board_size * gameState.board_size) : null;
+
             // 1. Update the board
             this.board = gameState.board_state.map(value => {
                 if (value === 1) return Stone.BLACK;
@@ -694,18 +882,13 @@ document.addEventListener("DOMContentLoaded", function () {
             }
 
             this.inScoringPhase = gameState.in_scoring_phase;
-            const color = this.playerColor;
-
-            const deadBlack = gameState.dead_black || [];
-            const deadWhite = gameState.dead_white || [];
 
-            if (color === 1) {
-                this.myDead = new Set(deadBlack);
-                this.theirDead = new Set(deadWhite);
-            } else {
-                this.myDead = new Set(deadWhite);
-                this.theirDead = new Set(deadBlack);
+            // During scoring the marks arrive separately; the document only holds the final ones
+            if (!this.inScoringPhase) {
+                this.deadBlack = new Set(gameState.dead_black || []);
+                this.deadWhite = new Set(gameState.dead_white || []);
             }
+            this.setMarkViews();
 
             // 2. Redraw stones
             this.redrawStones();
@@ -741,32 +924,20 @@ document.addEventListener("DOMContentLoaded", function () {
 
                     finalizeBtn.addEventListener("click", () => {
                         this.socket.send(JSON.stringify({
-                            type: "finalize_score",
-                            player_id: this.playerId
+                            type: "finalize_score"
                         }));
                         finalizeBtn.disabled = true;
                         finalizeBtn.textContent = "Waiting for opponent...";
                     });
                 }
 
-                // Check agreement between players
-                const myDead = color === 1 ? deadBlack : deadWhite;
-                const theirDead = color === 1 ? deadWhite : deadBlack;
-
-                const mySet = new Set(myDead);
-                const theirSet = new Set(theirDead);
-
-                const setsMatch =
-                    mySet.size === theirSet.size &&
-                    [...mySet].every(i => theirSet.has(i));
-
-                finalizeBtn.disabled = !setsMatch;
+                this.updateFinalizeButton();
             } else {
                 let finalizeBtn = document.getElementById("finalizeScoreBtn");
                 let finalizeMsg = document.getElementById("finalizeScoreMessage");
                 // Check if both players have finalized
                 const finalizedPlayers = gameState.finalized_players || [];
-                const bothFinalized = finalizedPlayers.length === 2;
+                const bothFinalized = finalizedPlayers.length === 2 || gameState.game_over;
 
                 // Disable further toggling and hide finalize button
                 if (bothFinalized) {
@@ -781,19 +952,7 @@ document.addEventListener("DOMContentLoaded", function () {
 
             // 3. Update turn and color info
             this.currentTurn = gameState.current_turn;
-
-            const colorText = document.querySelector("#playerColor span");
-            const turnText = document.querySelector("#turnIndicator span");
-
-            colorText.textContent = this.playerColor === 1 ? "Black" : "White";
-
-            if (this.playerColor === this.currentTurn) {
-                turnText.textContent = "Your move";
-                turnText.style.color = "green";
-            } else {
-                turnText.textContent = "Opponent's move";
-                turnText.style.color = "gray";
-            }
+            this.updateTurnIndicator();
 
             if (gameState.game_over && !gameState.in_scoring_phase && !this.gameOverHandled) {
                 this.gameOverHandled = true; // Prevent multiple alerts
@@ -956,6 +1115,17 @@ document.addEventListener("DOMContentLoaded", function () {
             };
         }
 
+        appendChatNotice(text) {
+            const notice = document.createElement("div");
+            notice.textContent = text;
+            notice.style.fontStyle = "italic";
+            notice.style.color = "#990033";
+
+            const chatBox = document.getElementById("chatMessages");
+            chatBox.appendChild(notice);
+            chatBox.scrollTop = chatBox.scrollHeight;
+        }
+
         addChatHint() {
             const roleHint = document.createElement("div");
             roleHint.textContent = `Welcome to the chat. Your messages appear on the right in blue.`;
@@ -1026,10 +1196,14 @@ document.addEventListener("DOMContentLoaded", function () {
             }
         });
 
+        document.getElementById("takebackBtn").addEventListener("click", () => {
+            goBoard.socket.send(JSON.stringify({ type: "takeback_request" }));
+        });
+
         document.getElementById("downloadSGF").addEventListener("click", async () => {
             const gameId = window.location.pathname.split("/").pop();
             const res = await fetch(`/game/${gameId}/state`);
-            const gameState = await res.json();
+            const gameState = expandRecord(await res.json());
             downloadSGF(gameState);
         });
 
@@ -1077,7 +1251,7 @@ async function getBoardState() {
         return;
     }
 
-    const gameData = await response.json();
+    const gameData = expandRecord(await response.json());
     return gameData;
 }
 
@@ -8,17 +8,68 @@ export function oppositeColor(color) {
     return color === Stone.BLACK ? Stone.WHITE : Stone.BLACK;
 }
 
-export function getAdjacentIndices(index, boardSize) {
-    const x = index % boardSize;
-    const y = Math.floor(index / boardSize);
+export const MIN_BOARD_SIZE = 5;
+export const MAX_BOARD_SIZE = 25;
+
+// Per-size tables, built once and shared (mirrors app/geometry.py)
+const geometries = new Map();
+
+export function getGeometry(size) {
+    let geometry = geometries.get(size);
+    if (geometry) return geometry;
+
     const neighbors = [];
+    for (let index = 0; index < size * size; index++) {
+        const x = index % size;
+        const y = Math.floor(index / size);
+        const adjacent = [];
+        if (y > 0) adjacent.push(index - size);
+        if (y < size - 1) adjacent.push(index + size);
+        if (x > 0) adjacent.push(index - 1);
+        if (x < size - 1) adjacent.push(index + 1);
+        neighbors.push(adjacent);
+    }
+
+    // Corners on the 4th line from 13x13 and the 3rd from 7x7, sides on
+    // odd boards from 9x9, centre on odd boards; [x, y] pairs, 0-based
+    const starPoints = [];
+    const edge = size >= 13 ? 3 : size >= 7 ? 2 : null;
+    const mid = size % 2 ? Math.floor(size / 2) : null;
+    if (edge !== null) {
+        const far = size - 1 - edge;
+        starPoints.push([edge, edge], [far, edge], [edge, far], [far, far]);
+        if (mid !== null && size >= 9) {
+            starPoints.push([edge, mid], [far, mid], [mid, edge], [mid, far]);
+        }
+    }
+    if (mid !== null) starPoints.push([mid, mid]);
 
-    if (x > 0) neighbors.push(index - 1);
-    if (x < boardSize - 1) neighbors.push(index + 1);
-    if (y > 0) neighbors.push(index - boardSize);
-    if (y < boardSize - 1) neighbors.push(index + boardSize);
+    const letter = (n) => String.fromCharCode(97 + n);
+    const sgfCoords = [];
+    for (let index = 0; index < size * size; index++) {
+        sgfCoords.push(letter(index % size) + letter(Math.floor(index / size)));
+    }
+
+    // Board coordinates skip "I"; A-Z without it covers 25 columns exactly
+    const columnLabels = "ABCDEFGHJKLMNOPQRSTUVWXYZ".slice(0, size).split("");
+
+    geometry = { size, neighbors, starPoints, sgfCoords, columnLabels };
+    geometries.set(size, geometry);
+    return geometry;
+}
 
-    return neighbors;
+/** Server legal-move mask (base64, bit i of byte i >> 3 is point i) -> 0/1 per point */
+export function decodeLegalMask(encoded, points) {
+    const bytes = Uint8Array.from(atob(encoded), c => c.charCodeAt(0));
+    const legal = new Uint8Array(points);
+    for (let i = 0; i < points; i++) {
+        legal[i] = (bytes[i >> 3] >> (i & 7)) & 1;
+    }
+    return legal;
+}
+
+export function getAdjacentIndices(index, boardSize) {
+    return getGeometry(boardSize).neighbors[index];
 }
 
 export function getConnectedGroup(startIndex, board, boardSize) {
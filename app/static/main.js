@@ -63,7 +63,8 @@ document.addEventListener("DOMContentLoaded", function () {
                     byo_yomi_periods: byoYomiPeriods,
                     byo_yomi_time: byoYomiTime,
                     game_type: gameType,
-                    creator_rank: creatorRank
+                    creator_rank: creatorRank,
+                    ...(gameType === "bot" && { bot_playouts: parseInt(document.getElementById("botStrength").value) })
                 })
             });
 
@@ -73,8 +74,8 @@ document.addEventListener("DOMContentLoaded", function () {
                 // Save (or preserve) the player_id
                 localStorage.setItem("zg_player_id", data.player_id);
 
-                //Redirect to the game page if public game
-                if (gameType === "public") {
+                //Redirect to the game page if public or bot game
+                if (gameType === "public" || gameType === "bot") {
                     window.location.href = `/game/${data.game_id}`;
                     return;
                 }
@@ -360,6 +361,65 @@ document.addEventListener("DOMContentLoaded", function () {
         }
     }
     gameTypeSelect.addEventListener("change", updateCreateRankUI);
+
+    // Automatch: queue, then poll until the server pairs us
+    document.getElementById("automatchRankContainer").innerHTML = getRankSelectHTML("automatchRank");
+    let automatchTimer = null;
+    const automatchBtn = document.getElementById("automatchBtn");
+    const automatchStatus = document.getElementById("automatchStatus");
+
+    function onAutomatchResult(data) {
+        if (data.status === "matched") {
+            clearInterval(automatchTimer);
+            window.location.href = `/game/${data.game_id}`;
+        } else if (data.status === "expired") {
+            clearInterval(automatchTimer);
+            automatchTimer = null;
+            automatchBtn.textContent = "Find Opponent";
+            automatchStatus.textContent = "Search expired. Try again.";
+        }
+    }
+
+    automatchBtn.addEventListener("click", async () => {
+        const playerId = localStorage.getItem("zg_player_id");
+        if (automatchTimer) {
+            clearInterval(automatchTimer);
+            automatchTimer = null;
+            await fetch(`/automatch/${playerId}`, { method: "DELETE" });
+            automatchBtn.textContent = "Find Opponent";
+            automatchStatus.textContent = "";
+            return;
+        }
+
+        const response = await fetch("/automatch", {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({
+                ...(playerId && { player_id: playerId }),
+                board_size: document.getElementById("automatchBoardSize").value,
+                time_control: document.getElementById("automatchTimeControl").value,
+                rule_set: document.getElementById("automatchRuleSet").value,
+                estimated_rank: document.getElementById("automatchRank").value
+            })
+        });
+        const data = await response.json();
+        if (!response.ok) {
+            alert(`Error: ${data.detail}`);
+            return;
+        }
+
+        localStorage.setItem("zg_player_id", data.player_id);
+        automatchBtn.textContent = "Cancel";
+        automatchStatus.textContent = "Looking for an opponent...";
+        automatchTimer = setInterval(async () => {
+            const res = await fetch(`/automatch/${data.player_id}`);
+            onAutomatchResult(await res.json());
+        }, 2000);
+        onAutomatchResult(data);
+    });
+    gameTypeSelect.addEventListener("change", () => {
+        document.getElementById("botStrengthGroup").style.display = gameTypeSelect.value === "bot" ? "" : "none";
+    });
     allowHandicapsCheckbox.addEventListener("change", updateCreateRankUI);
     updateCreateRankUI();
     loadSiteSettings();
@@ -1,9 +1,11 @@
 import {
     Stone,
     getAdjacentIndices,
+    getGeometry,
     getConnectedGroup,
     replayMovesUpTo
   } from "./go_engine.js";
+  import { preferredWireFormat, decodeFrame, parseMessage, expandRecord } from "./wire_format.js";
   
   class SpectatorBoard {
     constructor(canvasId, size, ruleSet) {
@@ -17,6 +19,11 @@ import {
       // Last move index
       this.lastMoveIndex = null;
 
+      // Review: null while following the live game, otherwise the move shown
+      this.reviewMove = null;
+      this.totalMoves = 0;
+      this.liveState = null;
+
       // Sound stuff
       this.firstUpdate = true;
       this.prevMoveCount = 0;
@@ -80,14 +87,9 @@ import {
     drawStarPoints() {
       const { ctx, cellSize, size } = this;
       ctx.fillStyle = "#000";
-      const coords = {
-        19: [[4,4],[4,10],[4,16],[10,4],[10,10],[10,16],[16,4],[16,10],[16,16]],
-        13: [[4,4],[4,7],[4,10],[7,4],[7,7],[7,10],[10,4],[10,7],[10,10]],
-         9: [[3,3],[3,5],[3,7],[5,3],[5,5],[5,7],[7,3],[7,5],[7,7]],
-      }[size] || [];
-      coords.forEach(([x,y]) => {
+      getGeometry(size).starPoints.forEach(([x,y]) => {
         ctx.beginPath();
-        ctx.arc(x * cellSize, y * cellSize, cellSize/6, 0, 2*Math.PI);
+        ctx.arc((x+1) * cellSize, (y+1) * cellSize, cellSize/6, 0, 2*Math.PI);
         ctx.fill();
       });
     }
@@ -159,16 +161,22 @@ import {
           localStorage.setItem("zg_player_id", specId);
         }
     
-        const wsPath = `/ws/${gameId}?player_id=${specId}&role=spectator`;
+        const wsPath = `/ws/${gameId}?player_id=${specId}&role=spectator&format=${preferredWireFormat()}`;
         this.socket = new WebSocket(
           this.getWebSocketUrl(wsPath)
         );
+        this.socket.binaryType = "arraybuffer";
 
         this.socket.onopen = () => console.log("Spectator WS open:", specId);
     
         this.socket.onmessage = (evt) => {
-          const msg = JSON.parse(evt.data);
+          const msg = evt.data instanceof ArrayBuffer
+            ? decodeFrame(evt.data)
+            : parseMessage(evt.data);
           switch (msg.type) {
+            case "ping":
+              this.socket.send(JSON.stringify({ type: "pong" }));
+              break;
             case "game_state":
               if (!this.firstUpdate) {
                 const moves = msg.payload.moves || [];
@@ -189,6 +197,17 @@ import {
             case "chat":
               this.appendChat(msg.sender, msg.text);
               break;
+            case "chat_history":
+              for (const entry of msg.messages || []) {
+                this.appendChat(entry.sender, entry.text);
+              }
+              break;
+            case "takeback":
+              this.applyTakeback(msg);
+              break;
+            case "position":
+              this.showPosition(msg);
+              break;
           }
         };
     
@@ -198,7 +217,66 @@ import {
           console.log("Spectator WS closed:", ev.code, ev.reason);
     }
   
+    /** Undo the last move locally from the broadcast delta */
+    applyTakeback(msg) {
+      // The held live state is stale now; goLive() refetches it
+      this.liveState = null;
+      this.totalMoves = Math.max(0, this.totalMoves - 1);
+      if (this.reviewMove !== null) {
+        this.reviewMove = Math.min(this.reviewMove, this.totalMoves);
+        return;
+      }
+      const { index, color, captured } = msg.delta;
+      if (index >= 0) {
+        const opponent = color === Stone.BLACK ? Stone.WHITE : Stone.BLACK;
+        this.board[index] = Stone.EMPTY;
+        for (const point of captured) {
+          this.board[point] = opponent;
+        }
+      }
+      const last = msg.last_move_index;
+      this.lastMoveIndex = last !== null && last >= 0 ? last : null;
+      this.prevMoveCount = Math.max(0, this.prevMoveCount - 1);
+      this.redrawStones();
+    }
+
+    /** Step through earlier positions; the server rebuilds them from checkpoints */
+    seek(move) {
+      move = Math.max(0, Math.min(move, this.totalMoves));
+      if (move === this.totalMoves) {
+        this.goLive();
+        return;
+      }
+      this.reviewMove = move;
+      this.socket.send(JSON.stringify({ type: "seek", move: move }));
+    }
+
+    showPosition(position) {
+      if (position.move !== this.reviewMove) {
+        return;  // superseded by a later seek or by going live
+      }
+      this.board = position.board_state;
+      this.lastMoveIndex = position.last_move_index;
+      this.redrawStones();
+      document.getElementById("reviewLabel").textContent = `Move ${position.move} / ${position.total_moves}`;
+    }
+
+    async goLive() {
+      this.reviewMove = null;
+      document.getElementById("reviewLabel").textContent = "";
+      if (!this.liveState) {
+        this.liveState = expandRecord(await fetch(`/game/${gameId}/state`).then(r => r.json()));
+      }
+      this.handleGameState(this.liveState);
+    }
+
     handleGameState(state) {
+      this.liveState = state;
+      this.totalMoves = (state.moves || []).length;
+      if (this.reviewMove !== null) {
+        return;  // keep showing the reviewed position
+      }
+
       // update board array
       this.board = state.board_state.map(v =>
         v===1 ? Stone.BLACK : v===2 ? Stone.WHITE : Stone.EMPTY
@@ -244,10 +322,16 @@ import {
   }
   
   async function initSpectate() {
-    const state = await fetch(`/game/${gameId}/state`).then(r=>r.json());
+    const state = expandRecord(await fetch(`/game/${gameId}/state`).then(r=>r.json()));
     const board = new SpectatorBoard("spectateCanvas", state.board_size, state.rule_set);
     board.connectWebSocket(gameId);
     board.handleGameState(state);
+
+    document.getElementById("prevMoveBtn").addEventListener("click", () =>
+      board.seek((board.reviewMove ?? board.totalMoves) - 1));
+    document.getElementById("nextMoveBtn").addEventListener("click", () =>
+      board.seek((board.reviewMove ?? board.totalMoves) + 1));
+    document.getElementById("liveBtn").addEventListener("click", () => board.goLive());
   }
   
   window.addEventListener("DOMContentLoaded", initSpectate);
@@ -0,0 +1,115 @@
+// Decoder for the opt-in binary game_state frames (see wire_format.py)
+
+const MAGIC = 0x43;
+const FORMAT_VERSION = 1;
+const MSG_GAME_STATE = 1;
+const HEADER_SIZE = 14;
+
+const FLAG_GAME_OVER = 0x01;
+const FLAG_IN_SCORING = 0x02;
+
+/** Binary frames for metered or data-saver connections, or when forced in localStorage */
+export function preferredWireFormat() {
+    const forced = localStorage.getItem("zg_wire_format");
+    if (forced === "binary" || forced === "json") {
+        return forced;
+    }
+    const conn = navigator.connection;
+    if (conn && (conn.saveData || conn.type === "cellular")) {
+        return "binary";
+    }
+    return "json";
+}
+
+function readVarint(bytes, pos) {
+    let result = 0;
+    let shift = 0;
+    while (true) {
+        const byte = bytes[pos++];
+        result += (byte & 0x7F) * 2 ** shift;
+        if (byte < 0x80) {
+            return [result, pos];
+        }
+        shift += 7;
+    }
+}
+
+/** Moves packed into a finished game's result record (see wire_format.pack_moves) */
+export function unpackMoves(packed) {
+    const bytes = Uint8Array.from(atob(packed), c => c.charCodeAt(0));
+    const moves = [];
+    let pos = 0;
+    while (pos < bytes.length) {
+        let value;
+        [value, pos] = readVarint(bytes, pos);
+        moves.push({ index: Math.floor(value / 2) - 2, color: (value & 1) + 1 });
+    }
+    return moves;
+}
+
+/** Give a finished game's result record the same moves list as a live game state */
+export function expandRecord(state) {
+    if (state && state.moves_packed !== undefined) {
+        state.moves = unpackMoves(state.moves_packed);
+        delete state.moves_packed;
+    }
+    return state;
+}
+
+/** JSON.parse for socket messages, expanding result records in game_state payloads */
+export function parseMessage(text) {
+    const message = JSON.parse(text);
+    if (message.type === "game_state") {
+        expandRecord(message.payload);
+    }
+    return message;
+}
+
+/** Turn a binary frame into the same {type, payload} shape as the JSON messages */
+export function decodeFrame(buffer) {
+    const view = new DataView(buffer);
+    const bytes = new Uint8Array(buffer);
+
+    if (view.getUint8(0) !== MAGIC || view.getUint8(1) !== FORMAT_VERSION || view.getUint8(2) !== MSG_GAME_STATE) {
+        throw new Error("Unknown binary frame");
+    }
+
+    const boardSize = view.getUint8(3);
+    const currentTurn = view.getUint8(4);
+    const flags = view.getUint8(5);
+    const capturedBlack = view.getUint16(6);
+    const capturedWhite = view.getUint16(8);
+    const version = view.getUint32(10);
+
+    let pos = HEADER_SIZE;
+    const points = boardSize * boardSize;
+    const board = new Array(points);
+    for (let i = 0; i < points; i++) {
+        board[i] = (bytes[pos + (i >> 2)] >> ((i & 3) << 1)) & 3;
+    }
+    pos += Math.ceil(points / 4);
+
+    let count;
+    [count, pos] = readVarint(bytes, pos);
+    const moves = new Array(count);
+    for (let i = 0; i < count; i++) {
+        let value;
+        [value, pos] = readVarint(bytes, pos);
+        moves[i] = { index: Math.floor(value / 2) - 2, color: (value & 1) + 1 };
+    }
+
+    const payload = JSON.parse(new TextDecoder().decode(bytes.subarray(pos)));
+    Object.assign(payload, {
+        board_size: boardSize,
+        current_turn: currentTurn,
+        game_over: (flags & FLAG_GAME_OVER) !== 0,
+        in_scoring_phase: (flags & FLAG_IN_SCORING) !== 0,
+        captured_black: capturedBlack,
+        captured_white: capturedWhite,
+        version: version,
+        board_state: board,
+        moves: moves,
+    });
+
+    return { type: "game_state", payload };
+}
@@ -0,0 +1,256 @@
+import json
+import time
+
+from redis_client import SHARDED_PUBSUB
+
+# ── Key schema ──────────────────────────────────────────────────────────────
+# Every Redis key and channel name used for a game is built here. The game
+# id sits in a {hash tag}, so under Redis Cluster all of a game's keys and
+# its update channel map to one slot: pipelines, WATCH and scripts over
+# them never cross slots. Global keys (counters, deadlines, lobby) live
+# wherever they hash and are kept out of per-game transactions.
+
+
+def _tag(game_id: str) -> str:
+    return "{" + game_id + "}"
+
+
+def game_key(game_id: str) -> str:
+    return f"game:{_tag(game_id)}"
+
+
+def version_key(game_id: str) -> str:
+    return f"game_version:{_tag(game_id)}"
+
+
+def players_key(game_id: str) -> str:
+    return f"players:{_tag(game_id)}"
+
+
+def disconnect_key(game_id: str) -> str:
+    return f"disconnect:{_tag(game_id)}"
+
+
+def chat_key(game_id: str) -> str:
+    return f"chat:{_tag(game_id)}"
+
+
+def takeback_key(game_id: str) -> str:
+    return f"takeback:{_tag(game_id)}"
+
+
+def checkpoint_key(game_id: str) -> str:
+    return f"checkpoints:{_tag(game_id)}"
+
+
+def dead_stones_key(game_id: str, color: str) -> str:
+    """Scoring-phase marks of one side; `color` is "black" or "white"."""
+    return f"dead_{color}:{_tag(game_id)}"
+
+
+def finalized_key(game_id: str) -> str:
+    return f"finalized:{_tag(game_id)}"
+
+
+def presence_key(game_id: str, player_id: str) -> str:
+    return f"presence:{_tag(game_id)}:{player_id}"
+
+
+def updates_channel(game_id: str) -> str:
+    return f"game_updates:{_tag(game_id)}"
+
+
+def commands_key(game_id: str) -> str:
+    """Stream of commands for the game's actor, kept as its command log."""
+    return f"commands:{_tag(game_id)}"
+
+
+def applied_key(game_id: str) -> str:
+    """Id of the last command stream entry reflected in the stored document."""
+    return f"commands_applied:{_tag(game_id)}"
+
+
+def actor_key(game_id: str) -> str:
+    """Lease naming the worker whose actor owns the game."""
+    return f"actor:{_tag(game_id)}"
+
+
+def deltas_key(game_id: str) -> str:
+    """Undo deltas of every move, which only the server needs (takebacks)."""
+    return f"undo_deltas:{_tag(game_id)}"
+
+
+# A worker's inbox and reply list share its id as hash tag, so one BLPOP
+# can wait on both under Redis Cluster
+
+def inbox_key(worker_id: str) -> str:
+    """Games with commands waiting for this worker's actors."""
+    return f"actor_inbox:{_tag(worker_id)}"
+
+
+def replies_key(worker_id: str) -> str:
+    """Results of commands this worker submitted to other workers' actors."""
+    return f"actor_replies:{_tag(worker_id)}"
+
+
+# Maintained counters for the admin ops panel, and one JSON report per worker
+OPS_COUNTERS_KEY = "ops:counters"
+OPS_WORKERS_KEY = "ops:workers"
+
+
+def key_family(key: str) -> str:
+    """`game:{<id>}` -> `game`; keys without a prefix are their own family."""
+    return key.split(":", 1)[0]
+
+
+def game_id_from_key(key: str) -> str:
+    """
+    `game:{<id>}` (or any per-game key or channel) -> `<id>`. Untagged
+    `<prefix>:<id>` keys written before hash tags are read too.
+    """
+    start = key.find("{")
+    if start == -1:
+        return key.split(":", 1)[1]
+    return key[start + 1:key.index("}", start)]
+
+
+def legacy_key(key: str) -> str:
+    """`game:{<id>}` -> `game:<id>`, the name the same key had before hash tags."""
+    return key.replace("{", "", 1).replace("}", "", 1)
+
+
+def publish_update(target, game_id: str, message: str):
+    """PUBLISH (or SPUBLISH, when sharded) to a game's update channel on a client or pipeline."""
+    if SHARDED_PUBSUB:
+        return target.spublish(updates_channel(game_id), message)
+    return target.publish(updates_channel(game_id), message)
+
+
+def game_side_keys(game_id: str) -> list:
+    """The document and every per-game key deleted with it (presence keys expire on their own)."""
+    return [
+        game_key(game_id),
+        version_key(game_id),
+        players_key(game_id),
+        disconnect_key(game_id),
+        chat_key(game_id),
+        takeback_key(game_id),
+        checkpoint_key(game_id),
+        dead_stones_key(game_id, "black"),
+        dead_stones_key(game_id, "white"),
+        finalized_key(game_id),
+        commands_key(game_id),
+        applied_key(game_id),
+        actor_key(game_id),
+        deltas_key(game_id)
+    ]
+
+
+def public_document(game_json: str) -> str:
+    """
+    A stored document as clients see it. The undo deltas are kept under
+    deltas_key; only documents written before that carry them inline.
+    """
+    if '"undo_deltas"' not in game_json and '"move_deltas"' not in game_json:
+        return game_json
+    game = json.loads(game_json)
+    game.pop("undo_deltas", None)
+    game.pop("move_deltas", None)
+    return json.dumps(game)
+
+
+def state_message(game_json: str) -> str:
+    """
+    The game_state update for an already serialised document, identical to
+    json.dumps({"type": "game_state", "payload": game}) without re-encoding
+    (bar inline undo deltas of old documents, which are dropped).
+    """
+    return '{"type": "game_state", "payload": ' + public_document(game_json) + '}'
+
+
+# ── Op accounting ───────────────────────────────────────────────────────────
+# Per logical operation ("actor_commit", "join", ...) this worker counts
+# calls, round trips, commands and request/reply bytes, so hot paths can be
+# compared before and after batching changes.
+
+
+class OpStats:
+    __slots__ = ("calls", "round_trips", "commands", "bytes_out", "bytes_in", "total_ms")
+
+    def __init__(self):
+        self.calls = 0
+        self.round_trips = 0
+        self.commands = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.total_ms = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "round_trips": self.round_trips,
+            "commands": self.commands,
+            "bytes_out": self.bytes_out,
+            "bytes_in": self.bytes_in,
+            "commands_per_call": round(self.commands / self.calls, 2) if self.calls else 0.0,
+            "avg_ms": round(self.total_ms / self.calls, 3) if self.calls else 0.0
+        }
+
+
+op_stats = {}  # op name -> OpStats
+
+
+def _size(value) -> int:
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sum(_size(v) for v in value)
+    if isinstance(value, dict):
+        return sum(_size(k) + _size(v) for k, v in value.items())
+    if value is None or isinstance(value, bool):
+        return 0
+    return len(str(value))
+
+
+def record(op: str, commands: int = 1, bytes_out: int = 0, bytes_in: int = 0,
+           round_trips: int = 1, elapsed_ms: float = 0.0, new_call: bool = True):
+    """Count work done outside execute(), e.g. a WATCHed read or a single command."""
+    stats = op_stats.get(op)
+    if stats is None:
+        stats = op_stats[op] = OpStats()
+    if new_call:
+        stats.calls += 1
+    stats.round_trips += round_trips
+    stats.commands += commands
+    stats.bytes_out += bytes_out
+    stats.bytes_in += bytes_in
+    stats.total_ms += elapsed_ms
+
+
+def execute(pipe, op: str, new_call: bool = True) -> list:
+    """
+    pipe.execute() under an op name. Pass new_call=False when the pipeline
+    finishes an operation whose first round trip was already recorded.
+    """
+    stack = pipe.command_stack
+    commands = len(stack)
+    bytes_out = sum(_size(args) for args, _ in stack)
+    started = time.perf_counter()
+    results = pipe.execute()
+    record(
+        op,
+        commands=commands,
+        bytes_out=bytes_out,
+        bytes_in=_size(results),
+        elapsed_ms=(time.perf_counter() - started) * 1000,
+        new_call=new_call
+    )
+    return results
+
+
+def stats() -> dict:
+    return {op: s.as_dict() for op, s in sorted(op_stats.items())}
+
+
+def reset_stats():
+    op_stats.clear()
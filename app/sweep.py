@@ -1,38 +1,42 @@
-import asyncio
-import time
 import json
 
 from sqlalchemy import select, delete
+import storage
 from db import async_session
 from models import PublicGame
+from game_helper import delete_game_keys
+from storage import game_key, disconnect_key, game_id_from_key
+from clock import Clock, system_clock
 
 async def sweep_stale_games(
     redis_client,
     sweep_interval_secs: int = 3600,
     stale_threshold_secs: int = 86400,
+    clock: Clock = system_clock,
 ):
     """
     Periodically:
-    1) Delete any Redis `game:<id>` older than `stale_threshold_secs` seconds.
+    1) Delete any Redis `game:{<id>}` older than `stale_threshold_secs` seconds.
     2) Delete any PublicGame rows whose Redis key no longer exists.
 
     Args:
         redis_client: A Redis client instance supporting scan_iter, get, delete, exists.
         sweep_interval_secs: How often (in seconds) to run this sweep.
         stale_threshold_secs: Age threshold (in seconds) after which a Redis game is considered stale.
+        clock: Source of the current time and of sleeps (a VirtualClock in simulations).
     """
     while True:
-        now = time.time()
+        now = clock.time()
 
         # 1) EXPIRE STALE REDIS GAMES
-        for redis_key in redis_client.scan_iter(match="game:*"):
+        for redis_key in redis_client.scan_iter(match=game_key("*")):
             if isinstance(redis_key, bytes):
                 key_str = redis_key.decode()
             else:
                 key_str = redis_key
 
             try:
-                _, game_id = key_str.split(":", 1)
+                game_id = game_id_from_key(key_str)
             except Exception:
                 continue
 
@@ -44,8 +48,7 @@ async def sweep_stale_games(
                 game_dict = json.loads(game_data_raw)
             except Exception:
                 # Invalid JSON: remove the key outright
-                redis_client.delete(f"game:{game_id}")
-                redis_client.delete(f"disconnect:{game_id}")
+                delete_game_keys(game_id, redis_client)
                 continue
 
             # If 'created_at' not set, treat as just-created (so age=0)
@@ -59,28 +62,32 @@ async def sweep_stale_games(
 
             if age > stale_threshold_secs:
                 # Delete stale game from Redis
-                redis_client.delete(f"game:{game_id}")
-                redis_client.delete(f"disconnect:{game_id}")
+                delete_game_keys(game_id, redis_client)
 
-        for dis_key in redis_client.scan_iter(match="disconnect:*"):
+        for dis_key in redis_client.scan_iter(match=disconnect_key("*")):
             key_str = dis_key.decode() if isinstance(dis_key, bytes) else dis_key
-            _, game_id = key_str.split(":", 1)
-            if not redis_client.exists(f"game:{game_id}"):
+            game_id = game_id_from_key(key_str)
+            if not redis_client.exists(game_key(game_id)):
                 # No corresponding game, so delete this stray disconnect hash
-                redis_client.delete(f"disconnect:{game_id}")
+                redis_client.delete(disconnect_key(game_id))
 
         # 2) REMOVE ORPHANED PUBLICGAME ROWS
         async with async_session() as session:
             result = await session.execute(select(PublicGame.id))
             public_ids = [row[0] for row in result.all()]
 
-            for pub_id in public_ids:
-                if not redis_client.exists(f"game:{pub_id}"):
-                    await session.execute(
-                        delete(PublicGame).where(PublicGame.id == pub_id)
-                    )
+            # One pipelined EXISTS per row, then a single DELETE for the orphans
+            with redis_client.pipeline(transaction=False) as pipe:
+                for pub_id in public_ids:
+                    pipe.exists(game_key(pub_id))
+                exists = storage.execute(pipe, "sweep_public_games")
+            orphans = [pub_id for pub_id, found in zip(public_ids, exists) if not found]
+            if orphans:
+                await session.execute(
+                    delete(PublicGame).where(PublicGame.id.in_(orphans))
+                )
 
             await session.commit()
 
         # Sleep until the next sweep
-        await asyncio.sleep(sweep_interval_secs)
+        await clock.sleep(sweep_interval_secs)
@@ -0,0 +1,171 @@
+# app/timer_sim.py
+#
+# Fast-forward thousands of timed games through the real timer code on a
+# VirtualClock.
+#
+#   python timer_sim.py [--games N] [--seconds S] [--time-control T] ...
+#
+# Every game gets its own track_game task and one deadline worker handles
+# join timeouts and disconnect forfeits, exactly as in a web worker; only
+# the clock is virtual. Reports timer CPU and Redis cost per simulated
+# second and how the games ended. It writes real keys: point REDIS_URL at
+# a scratch Redis that no live worker polls. Presence keys expire in real
+# time, so heartbeat loss is not simulated.
+
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import sys
+import time
+import uuid
+
+import storage
+from clock import VirtualClock
+from deadlines import DEADLINES_KEY, JOIN_TIMEOUT, DISCONNECT_FORFEIT, POST_GAME_CLEANUP, deadline_member
+from game_cache import load_game, save_game
+from game_helper import delete_game_keys
+from game_state import GameState, Stone
+from ops import count_games_created
+from redis_client import redis_client
+from storage import players_key
+from timers import (
+    mark_player_disconnected, schedule_join_timeout, start_timer_for_game,
+    stop_timer_for_game, run_deadline_worker, timer_tasks
+)
+
+
+def create_games(args, clock: VirtualClock) -> tuple:
+    """Timed two-player games plus `--empty` games nobody joins."""
+    timed, empty = [], []
+    with redis_client.pipeline(transaction=False) as pipe:
+        for n in range(args.games + args.empty):
+            game_id = f"sim-{uuid.uuid4().hex[:8]}"
+            game = GameState(args.board_size, time_control=str(args.time_control))
+            game.created_at = clock.time()
+            game.byo_yomi_periods = args.byo_yomi_periods
+            game.byo_yomi_time = args.byo_yomi_time
+            if n < args.games:
+                game.players = {f"{game_id}-b": Stone.BLACK.value, f"{game_id}-w": Stone.WHITE.value}
+                for pid in game.players:
+                    game.time_left[pid] = args.time_control
+                pipe.hset(players_key(game_id), mapping=game.players)
+                timed.append(game_id)
+            else:
+                schedule_join_timeout(game_id, pipe, timeout_seconds=args.join_timeout, clock=clock)
+                empty.append(game_id)
+            game.version += 1
+            save_game(pipe, game_id, game, cache=False)
+        count_games_created(pipe, len(timed) + len(empty))
+        pipe.execute()
+    return timed, empty
+
+
+async def disconnect_later(game_id: str, player_id: str, delay: float, clock: VirtualClock):
+    await clock.sleep(delay)
+    mark_player_disconnected(game_id, player_id, redis_client, clock)
+
+
+def outcomes(game_ids: list) -> dict:
+    counts = {}
+    for game_id in game_ids:
+        game = load_game(game_id, redis_client)
+        if game is None:
+            reason = "deleted"
+        elif game.game_over:
+            reason = game.game_over_reason
+        else:
+            reason = "running"
+        counts[reason] = counts.get(reason, 0) + 1
+    return counts
+
+
+def cleanup(game_ids: list):
+    for game_id in game_ids:
+        delete_game_keys(game_id, redis_client)
+    members = [deadline_member(kind, game_id) for kind in (JOIN_TIMEOUT, POST_GAME_CLEANUP) for game_id in game_ids]
+    members += [
+        deadline_member(DISCONNECT_FORFEIT, game_id, f"{game_id}-{side}")
+        for game_id in game_ids for side in ("b", "w")
+    ]
+    for start in range(0, len(members), 1000):
+        redis_client.zrem(DEADLINES_KEY, *members[start:start + 1000])
+
+
+async def simulate(args) -> int:
+    random.seed(args.seed)
+    clock = VirtualClock()
+    timed, empty = create_games(args, clock)
+    storage.reset_stats()
+
+    quiet = open(os.devnull, "w") if not args.verbose else None
+    helpers = []
+    with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+        for game_id in timed:
+            start_timer_for_game(game_id, redis_client, clock)
+            if random.random() < args.disconnect_rate:
+                helpers.append(asyncio.create_task(
+                    disconnect_later(game_id, f"{game_id}-b", random.uniform(0, args.seconds), clock)
+                ))
+        helpers.append(asyncio.create_task(run_deadline_worker(redis_client, clock=clock)))
+        await clock.settle()
+
+        wall_started = time.perf_counter()
+        cpu_started = time.process_time()
+        per_second_cpu = []
+        for _ in range(args.seconds):
+            step_started = time.process_time()
+            await clock.advance(1)
+            per_second_cpu.append(time.process_time() - step_started)
+        cpu = time.process_time() - cpu_started
+        wall = time.perf_counter() - wall_started
+
+        ops = storage.stats()
+        ended = outcomes(timed + empty)
+
+        for game_id in list(timer_tasks):
+            stop_timer_for_game(game_id)
+        for task in helpers:
+            task.cancel()
+        await asyncio.gather(*helpers, return_exceptions=True)
+        if not args.keep:
+            cleanup(timed + empty)
+
+    seconds = args.seconds
+    per_second_cpu.sort()
+    print(f"Games:             {len(timed)} timed, {len(empty)} never joined")
+    print(f"Simulated:         {seconds}s in {wall:.2f}s wall ({seconds / wall:,.0f}x real time)")
+    print(f"Timer CPU:         {cpu / seconds * 1000:.2f} ms per simulated second "
+          f"(p50 {per_second_cpu[len(per_second_cpu) // 2] * 1000:.2f}, max {per_second_cpu[-1] * 1000:.2f})")
+    if timed:
+        print(f"                   {cpu / seconds / len(timed) * 1e6:.1f} us per timed game per second")
+    print("Redis per simulated second:")
+    for op, s in ops.items():
+        print(f"  {op:<24} {s['calls'] / seconds:9.1f} calls  {s['round_trips'] / seconds:9.1f} round trips  "
+              f"{s['commands'] / seconds:9.1f} commands  {(s['bytes_out'] + s['bytes_in']) / seconds / 1024:9.1f} KiB")
+    print("Outcomes:          " + ", ".join(f"{reason}={n}" for reason, n in sorted(ended.items(), key=str)))
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Fast-forward timed games through the timer code on a virtual clock.")
+    parser.add_argument("--games", type=int, default=1000, help="timed two-player games")
+    parser.add_argument("--empty", type=int, default=0, help="games nobody joins, removed by the join timeout")
+    parser.add_argument("--seconds", type=int, default=600, help="simulated seconds")
+    parser.add_argument("--board-size", type=int, default=19)
+    parser.add_argument("--time-control", type=int, default=300, help="main time per player in seconds")
+    parser.add_argument("--byo-yomi-periods", type=int, default=0)
+    parser.add_argument("--byo-yomi-time", type=int, default=30)
+    parser.add_argument("--join-timeout", type=int, default=600)
+    parser.add_argument("--disconnect-rate", type=float, default=0.0,
+                        help="share of timed games whose black player disconnects for good")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep", action="store_true", help="leave the simulated games in Redis")
+    parser.add_argument("--verbose", action="store_true", help="show the timer code's own output")
+    args = parser.parse_args(argv)
+    return asyncio.run(simulate(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
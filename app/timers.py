@@ -1,19 +1,33 @@
 import asyncio
-import time
 import json
 
 from typing import Dict
-from game_state import GameState
-from game_helper import remove_public_game
+import storage
+from fastapi import HTTPException
+from clock import Clock, system_clock
+from game_cache import load_game
+from game_actor import game_actors
+from storage import game_key, disconnect_key, presence_key, publish_update
+from game_helper import remove_public_game, delete_game_keys
+from deadlines import (
+    JOIN_TIMEOUT, DISCONNECT_FORFEIT, POST_GAME_CLEANUP, PRESENCE_LOST, BOT_TURN,
+    schedule_deadline, cancel_deadline, pop_due_deadlines
+)
+from presence import is_present, clear_presence
+
+# Seconds a disconnected player has to come back before forfeiting
+DISCONNECT_TIMEOUT_SECS = 60
+# Game types seated before anyone connects; the join timeout drops them
+# if no player ever shows up
+PRESEATED_GAME_TYPES = ("tournament", "automatch")
 
 # Track running timers
 timer_tasks: Dict[str, asyncio.Task] = {}
-join_timeout_tasks: Dict[str, asyncio.Task] = {}
 
 
-def start_timer_for_game(game_id: str, redis_client):
+def start_timer_for_game(game_id: str, redis_client, clock: Clock = system_clock):
     if game_id not in timer_tasks:
-        timer_tasks[game_id] = asyncio.create_task(track_game(game_id, redis_client))
+        timer_tasks[game_id] = asyncio.create_task(track_game(game_id, redis_client, clock))
 
 
 def stop_timer_for_game(game_id: str):
@@ -22,106 +36,205 @@ def stop_timer_for_game(game_id: str):
         task.cancel()
 
 
-def record_disconnect_time(game_id: str, player_id: str, redis_client):
-    redis_client.hset(f"disconnect:{game_id}", player_id, time.time())
+def record_disconnect_time(game_id: str, player_id: str, redis_client, clock: Clock = system_clock) -> bool:
+    """Returns False if the player was already recorded as disconnected."""
+    now = clock.time()
+    if not redis_client.hsetnx(disconnect_key(game_id), player_id, now):
+        return False
+    schedule_deadline(redis_client, DISCONNECT_FORFEIT, game_id, now + DISCONNECT_TIMEOUT_SECS, player_id)
+    # Finished games are removed as soon as the last player leaves
+    schedule_deadline(redis_client, POST_GAME_CLEANUP, game_id, now)
+    return True
+
+
+def mark_player_disconnected(game_id: str, player_id: str, redis_client, clock: Clock = system_clock):
+    """Drop the player's presence, start their forfeit countdown and notify the room."""
+    clear_presence(game_id, player_id, redis_client)
+    if not record_disconnect_time(game_id, player_id, redis_client, clock):
+        return
+    publish_update(
+        redis_client,
+        game_id,
+        json.dumps({
+            "type": "disconnect_notice",
+            "disconnected_player": player_id,
+            "timestamp": clock.time(),
+            "timeout_seconds": DISCONNECT_TIMEOUT_SECS
+        })
+    )
 
 
 def clear_disconnect_time(game_id: str, player_id: str, redis_client):
-    redis_client.hdel(f"disconnect:{game_id}", player_id)
+    redis_client.hdel(disconnect_key(game_id), player_id)
+    cancel_deadline(redis_client, DISCONNECT_FORFEIT, game_id, player_id)
 
 
 def clear_all_disconnects(game_id: str, redis_client):
-    redis_client.delete(f"disconnect:{game_id}")
+    # Pending forfeit events become no-ops once the hash is gone
+    redis_client.delete(disconnect_key(game_id))
 
-def start_join_timeout_for_game(game_id: str, redis_client, timeout_seconds: int = 600):
-    if game_id not in join_timeout_tasks:
-        task = asyncio.create_task(join_timeout_check(game_id, redis_client, timeout_seconds))
-        join_timeout_tasks[game_id] = task
+def schedule_join_timeout(game_id: str, redis_client, timeout_seconds: int = 600, clock: Clock = system_clock):
+    schedule_deadline(redis_client, JOIN_TIMEOUT, game_id, clock.time() + timeout_seconds)
 
 
-async def track_game(game_id: str, redis_client):
+async def track_game(game_id: str, redis_client, clock: Clock = system_clock):
+    """
+    One tick per second of `clock`; charge_clock charges one second per tick.
+    Only the worker owning the game's actor charges it, on the game it
+    holds; a ticker on any other worker tries to take the lease over each
+    second, so the clock never runs twice and keeps running if the owner
+    goes away.
+    """
     print(f"Started tracking timer for game {game_id}")
     try:
         while True:
-            now = time.time()
-            players = redis_client.hgetall(f"disconnect:{game_id}")
-            game_data = redis_client.get(f"game:{game_id}")
-            if not game_data:
+            game = game_actors.run_local(game_id, lambda game: charge_clock(game_id, game), clock)
+            if game is None:
+                game = load_game(game_id, redis_client, fresh=False)
+            if game is None:
                 print(f"Game {game_id} not found. Cleaning up timer task.")
                 break
 
-            game = GameState.from_dict(json.loads(game_data))
-
-            # Cancel join timeout task once a player joins
-            if len(game.players) >= 1 and game_id in join_timeout_tasks:
-                task = join_timeout_tasks.pop(game_id)
-                task.cancel()
-
-            # Game is finished and not in review: cleanup when both disconnected
-            if game.game_over and not game.in_scoring_phase:
-                await handle_post_game_disconnect_cleanup(game_id, redis_client, game)
-                await asyncio.sleep(1)
-                continue
-
-            # Handle disconnection timeout logic
-            await handle_disconnection_timeouts(game_id, redis_client, game, now)
-
-            # Handle active gameplay time controls
-            if not game.game_over and not game.in_scoring_phase and game.time_control != "none" and len(game.players) == 2:
-                await handle_time_controls(game_id, redis_client, game)
+            # Nothing left to tick; join, disconnect and cleanup deadlines
+            # are handled by the shared deadline queue
+            if game.time_control == "none" or (game.game_over and not game.in_scoring_phase):
+                break
 
-            await asyncio.sleep(1)
+            await clock.sleep(1)
 
     except asyncio.CancelledError:
         print(f"Timer task cancelled for game {game_id}")
     finally:
         timer_tasks.pop(game_id, None)
 
-async def join_timeout_check(game_id: str, redis_client, timeout_seconds: int):
-    try:
-        print(f"Started join timeout for game {game_id} with {timeout_seconds} seconds")
-        await asyncio.sleep(timeout_seconds)
+#######################
+### Deadline events ###
+#######################
+
+async def handle_join_timeout(game_id: str, redis_client):
+    game = load_game(game_id, redis_client)
+    if game is None:
+        return
+    if len(game.players) == 0:
+        print(f"Game {game_id} was never joined. Cleaning up after timeout.")
+        delete_game_keys(game_id, redis_client)
+        remove_public_game(game_id)
+    elif game.game_type in PRESEATED_GAME_TYPES and not game.moves and not any_player_seen(game_id, game, redis_client):
+        # Seats were pre-assigned (in bulk or by matchmaking); nobody ever showed up
+        print(f"{game.game_type.capitalize()} game {game_id} was never started. Cleaning up after timeout.")
+        delete_game_keys(game_id, redis_client)
+        remove_public_game(game_id)
+
+
+def any_player_seen(game_id: str, game, redis_client) -> bool:
+    """True if a seated player is connected now or has disconnected before."""
+    with redis_client.pipeline(transaction=False) as pipe:
+        for pid in game.players:
+            pipe.exists(presence_key(game_id, pid))
+        pipe.exists(disconnect_key(game_id))
+        return any(storage.execute(pipe, "join_timeout_check"))
+
+
+async def handle_disconnect_forfeit(game_id: str, player_id: str, redis_client, now: float,
+                                   clock: Clock = system_clock):
+    disconnect_time_str = redis_client.hget(disconnect_key(game_id), player_id)
+    if disconnect_time_str is None:
+        return  # Player reconnected in time
+
+    deadline = float(disconnect_time_str) + DISCONNECT_TIMEOUT_SECS
+    if now < deadline:
+        # Disconnected again after an earlier event was queued
+        schedule_deadline(redis_client, DISCONNECT_FORFEIT, game_id, deadline, player_id)
+        return
 
-        game_data = redis_client.get(f"game:{game_id}")
-        if not game_data:
+    try:
+        result = await game_actors.submit(game_id, {"type": "forfeit", "player_id": player_id}, clock)
+        if result["changed"]:
+            print(f"Player {player_id} timed out (disconnect) in game {game_id}")
+    except HTTPException as e:
+        if e.status_code == 404:
             return
+        # Already finished
 
-        game = GameState.from_dict(json.loads(game_data))
-        if len(game.players) == 0:
-            print(f"Game {game_id} was never joined. Cleaning up after timeout.")
-            redis_client.delete(f"game:{game_id}")
-            asyncio.create_task(remove_public_game(game_id))
+    schedule_deadline(redis_client, POST_GAME_CLEANUP, game_id, now)
 
-    except asyncio.CancelledError:
-        # Join timeout was cancelled because someone joined
-        print(f"Join timeout for game {game_id} was cancelled.")
-    finally:
-        join_timeout_tasks.pop(game_id, None)
 
-async def handle_post_game_disconnect_cleanup(game_id, redis_client, game):
-    players = redis_client.hgetall(f"disconnect:{game_id}")
-    if len(players) >= len(game.players):
-        print(f"All players disconnected from finished game {game_id}. Cleaning up...")
-        redis_client.delete(f"game:{game_id}")
-        redis_client.delete(f"disconnect:{game_id}")
-        asyncio.create_task(remove_public_game(game_id))
-        raise asyncio.CancelledError
+async def handle_presence_lost(game_id: str, player_id: str, redis_client, clock: Clock = system_clock):
+    # Heartbeats stopped without a clean close (e.g. network loss)
+    if is_present(game_id, player_id, redis_client):
+        return
+    if not redis_client.exists(game_key(game_id)):
+        return
+    print(f"Presence expired for player {player_id} in game {game_id}")
+    mark_player_disconnected(game_id, player_id, redis_client, clock)
 
 
-async def handle_disconnection_timeouts(game_id, redis_client, game, now):
-    disconnects = redis_client.hgetall(f"disconnect:{game_id}")
-    for player_id, disconnect_time_str in disconnects.items():
-        disconnect_time = float(disconnect_time_str)
-        if now - disconnect_time > 60:
-            print(f"Player {player_id} timed out (disconnect) in game {game_id}")
-            game.end_game(reason="resign", resigned_player=player_id)
-            save_and_broadcast(game_id, redis_client, game)
+async def handle_bot_turn(game_id: str, clock: Clock = system_clock):
+    # Whichever worker owns the game (or takes it over) restarts the bot
+    # if it is still to move
+    try:
+        await game_actors.submit(game_id, {"type": "wake_bot"}, clock)
+    except HTTPException:
+        pass  # Gone or finished meanwhile
 
 
-async def handle_time_controls(game_id, redis_client, game):
+async def handle_post_game_cleanup(game_id: str, redis_client):
+    game = load_game(game_id, redis_client)
+    if game is None:
+        return
+    if not game.game_over or game.in_scoring_phase:
+        return
+
+    players = redis_client.hgetall(disconnect_key(game_id))
+    if len(players) >= len(game.players):
+        print(f"All players disconnected from finished game {game_id}. Cleaning up...")
+        delete_game_keys(game_id, redis_client)
+        remove_public_game(game_id)
+
+
+async def run_deadline_worker(redis_client, poll_interval_secs: float = 1.0, clock: Clock = system_clock):
+    """
+    Pop due lifecycle events from the shared deadline queue and handle them.
+    One of these runs per worker; the atomic pop guarantees each event is
+    handled exactly once across all workers, and events survive restarts.
+    """
+    while True:
+        now = clock.time()
+        try:
+            due = pop_due_deadlines(redis_client, now)
+        except Exception as e:
+            print(f"Deadline queue error: {e}")
+            due = []
+
+        for kind, game_id, player_id in due:
+            try:
+                if kind == JOIN_TIMEOUT:
+                    await handle_join_timeout(game_id, redis_client)
+                elif kind == DISCONNECT_FORFEIT:
+                    await handle_disconnect_forfeit(game_id, player_id, redis_client, now, clock)
+                elif kind == PRESENCE_LOST:
+                    await handle_presence_lost(game_id, player_id, redis_client, clock)
+                elif kind == POST_GAME_CLEANUP:
+                    await handle_post_game_cleanup(game_id, redis_client)
+                elif kind == BOT_TURN:
+                    await handle_bot_turn(game_id, clock)
+                else:
+                    print(f"Unknown deadline event {kind} for game {game_id}")
+            except Exception as e:
+                print(f"Error handling {kind} for game {game_id}: {e}")
+
+        # Keep draining without sleeping while a backlog is due
+        if len(due) < 100:
+            await clock.sleep(poll_interval_secs)
+
+
+def charge_clock(game_id: str, game) -> bool:
+    """Charge the player to move one second. Returns False when no clock is running."""
+    if game.time_control == "none" or game.game_over or game.in_scoring_phase or len(game.players) < 2:
+        return False
     current_player = next((pid for pid, color in game.players.items() if color == game.current_turn.value), None)
     if not current_player:
-        return
+        return False
 
     # Ensure timers are initialized
     if current_player not in game.time_left:
@@ -141,8 +254,6 @@ async def handle_time_controls(game_id, redis_client, game):
         if game.time_left[current_player] == 0 and game.byo_yomi_periods == 0:
             print(f"Player {current_player} ran out of main time (no byo-yomi) in game {game_id}")
             game.end_game(reason="timeout", resigned_player=current_player)
-            save_and_broadcast(game_id, redis_client, game)
-            return
 
     else:
         # Byo-yomi logic
@@ -152,18 +263,8 @@ async def handle_time_controls(game_id, redis_client, game):
             if game.periods_left[current_player] <= 0:
                 print(f"Player {current_player} ran out of byo-yomi in game {game_id}")
                 game.end_game(reason="timeout", resigned_player=current_player)
-                save_and_broadcast(game_id, redis_client, game)
-                return
             else:
                 game.byo_yomi_time_left[current_player] = game.byo_yomi_time
 
-    save_and_broadcast(game_id, redis_client, game)
-
+    return True
 
-def save_and_broadcast(game_id, redis_client, game):
-    game_json = json.dumps(game.to_dict())
-    redis_client.set(f"game:{game_id}", game_json)
-    redis_client.publish(f"game_updates:{game_id}", json.dumps({
-        "type": "game_state",
-        "payload": game.to_dict()
-}))
@@ -0,0 +1,14 @@
+from uvicorn.workers import UvicornWorker
+
+
+class GameWorker(UvicornWorker):
+    """
+    Gunicorn worker pinned to the `websockets` protocol implementation with
+    permessage-deflate on, so clients that stay on JSON frames still get
+    their game_state updates compressed on the wire.
+    """
+    CONFIG_KWARGS = {
+        **UvicornWorker.CONFIG_KWARGS,
+        "ws": "websockets",
+        "ws_per_message_deflate": True,
+    }
@@ -0,0 +1,156 @@
+import base64
+import json
+import struct
+
+# Opt-in compact WebSocket frames for game_state updates.
+#
+# Layout (all integers big-endian):
+#   header   magic "C", format version, message type, board size,
+#            current turn, flags, captured_black (u16), captured_white (u16),
+#            game version (u32)
+#   board    2 bits per point, four points per byte, lowest bits first
+#   moves    varint count, then one varint per move:
+#            ((index + 2) << 1) | (color - 1)   (index -1 = pass, -2 = resign)
+#   meta     UTF-8 JSON with every remaining game_state field
+FORMAT_JSON = "json"
+FORMAT_BINARY = "binary"
+
+MAGIC = 0x43  # "C"
+FORMAT_VERSION = 1
+MSG_GAME_STATE = 1
+
+FLAG_GAME_OVER = 0x01
+FLAG_IN_SCORING = 0x02
+
+HEADER = struct.Struct(">BBBBBBHHI")
+
+# Fields carried by the header, board and move sections instead of the JSON tail
+PACKED_FIELDS = {
+    "board_size", "current_turn", "game_over", "in_scoring_phase",
+    "captured_black", "captured_white", "version",
+    "board_state", "moves", "moves_packed",
+}
+# Server-side fields of stored documents that never go to clients
+SERVER_FIELDS = {"undo_deltas", "move_deltas"}
+
+
+def _write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, pos: int):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def pack_board(board: list) -> bytes:
+    packed = bytearray((len(board) + 3) // 4)
+    for i, stone in enumerate(board):
+        if stone:
+            packed[i >> 2] |= stone << ((i & 3) << 1)
+    return bytes(packed)
+
+
+def unpack_board(data: bytes, points: int) -> list:
+    return [(data[i >> 2] >> ((i & 3) << 1)) & 3 for i in range(points)]
+
+
+def _move_value(move: dict) -> int:
+    return ((move["index"] + 2) << 1) | (move["color"] - 1)
+
+
+def _move_from_value(value: int) -> dict:
+    return {"index": (value >> 1) - 2, "color": (value & 1) + 1}
+
+
+def pack_moves(moves: list) -> str:
+    """Moves as base64 varints, one per move, encoded as in binary frames (timestamps dropped)."""
+    out = bytearray()
+    for move in moves:
+        _write_varint(out, _move_value(move))
+    return base64.b64encode(bytes(out)).decode()
+
+
+def unpack_moves(packed: str) -> list:
+    data = base64.b64decode(packed)
+    moves = []
+    pos = 0
+    while pos < len(data):
+        value, pos = _read_varint(data, pos)
+        moves.append(_move_from_value(value))
+    return moves
+
+
+def encode_game_state(state: dict) -> bytes:
+    flags = 0
+    if state.get("game_over"):
+        flags |= FLAG_GAME_OVER
+    if state.get("in_scoring_phase"):
+        flags |= FLAG_IN_SCORING
+
+    out = bytearray(HEADER.pack(
+        MAGIC, FORMAT_VERSION, MSG_GAME_STATE,
+        state["board_size"], state["current_turn"], flags,
+        state.get("captured_black", 0), state.get("captured_white", 0),
+        state.get("version", 0)
+    ))
+    out += pack_board(state["board_state"])
+
+    # Result records of finished games carry their moves packed
+    moves = state["moves"] if "moves" in state else unpack_moves(state.get("moves_packed", ""))
+    _write_varint(out, len(moves))
+    for move in moves:
+        _write_varint(out, _move_value(move))
+
+    meta = {k: v for k, v in state.items() if k not in PACKED_FIELDS and k not in SERVER_FIELDS}
+    out += json.dumps(meta, separators=(",", ":")).encode()
+    return bytes(out)
+
+
+def decode_game_state(data: bytes) -> dict:
+    """Inverse of encode_game_state; used by tools and for round-trip checks."""
+    (magic, fmt_version, msg_type, board_size, current_turn, flags,
+     captured_black, captured_white, version) = HEADER.unpack_from(data)
+    if magic != MAGIC or fmt_version != FORMAT_VERSION or msg_type != MSG_GAME_STATE:
+        raise ValueError("Not a game_state frame")
+
+    pos = HEADER.size
+    points = board_size * board_size
+    board_bytes = (points + 3) // 4
+    board = unpack_board(data[pos:pos + board_bytes], points)
+    pos += board_bytes
+
+    count, pos = _read_varint(data, pos)
+    moves = []
+    for _ in range(count):
+        value, pos = _read_varint(data, pos)
+        moves.append(_move_from_value(value))
+
+    state = json.loads(data[pos:].decode())
+    state.update({
+        "board_size": board_size,
+        "current_turn": current_turn,
+        "game_over": bool(flags & FLAG_GAME_OVER),
+        "in_scoring_phase": bool(flags & FLAG_IN_SCORING),
+        "captured_black": captured_black,
+        "captured_white": captured_white,
+        "version": version,
+        "board_state": board,
+        "moves": moves,
+    })
+    return state
+
+
+def encode_game_state_message(raw: str) -> bytes:
+    """Turn a published {"type": "game_state", "payload": ...} string into a binary frame."""
+    return encode_game_state(json.loads(raw)["payload"])